@@ -0,0 +1,200 @@
+'''
+Hybrid adaptive inference : only the detailed tiles of an image are upscaled by the generator.
+
+Large parts of real photos (sky, walls, plain product backgrounds) are smooth, and the generator output
+on them is nearly identical to bicubic upscaling. The LR image is split into the same overlapping tiles
+as evaluation.upscale_image, and every tile is scored by its edge energy (mean absolute gradient) or
+texture (standard deviation), see content_filter.patch_score. Tiles scoring below the threshold are
+taken from a bicubic upscale of the whole image, and only the others are batched through the generator.
+
+The generator tiles are blended into the bicubic image with a window which ramps from 0 to 1 over the
+overlap border of every tile, so there is no visible seam between generator and bicubic regions.
+
+    python adaptive_inference.py weights/SRGAN.h5 tests/set14 --thresholds 2 4 8
+'''
+import time
+import numpy as np
+from PIL import Image
+
+from tiling import tile_image
+from content_filter import patch_score, SCORE_METHODS
+from evaluation import upscale_image
+
+
+def bicubic_upscale(img, scale):
+    ''' Bicubic upscaling of a uint8 image of shape (height, width, 3), returned as float32 '''
+    height, width = img.shape[:2]
+    img = Image.fromarray(img).resize((width * scale, height * scale), Image.BICUBIC)
+    return np.asarray(img, dtype='float32')
+
+
+def tile_scores(lr, tile_size, overlap=4, method='gradient'):
+    '''
+    Detail score of every tile of a uint8 image (tiled as in evaluation.upscale_image).
+
+    Returns:
+        (scores, tiles, grid) where tiles and grid are returned by tiling.tile_image
+    '''
+    assert method in SCORE_METHODS, "method must be one of %s" % str(SCORE_METHODS)
+
+    tiles, grid = tile_image(lr, tile_size, overlap)
+    scores = np.array([patch_score(tile, method, downscale=1) for tile in tiles])
+
+    return scores, tiles, grid
+
+
+def _blend_window(size, border):
+    ''' Weights of an upscaled tile : 1 in its core, ramping down to 0 across its overlap border '''
+    if border == 0:
+        return np.ones((size, size), dtype='float32')
+
+    positions = np.arange(size)
+    ramp = np.clip(np.minimum(positions + 0.5, size - positions - 0.5) / border, 0., 1.)
+
+    return np.outer(ramp, ramp).astype('float32')
+
+
+def adaptive_upscale_image(model, lr, tile_size, overlap, scale, threshold, method='gradient', batch_size=16,
+                           channels_first=True):
+    '''
+    Upscales a uint8 image of shape (height, width, 3) with the generator on the tiles whose detail score
+    is at least threshold, and with bicubic upscaling elsewhere. A threshold of 0 runs the generator on all
+    the tiles.
+
+    Returns:
+        (uint8 upscaled image, dictionary with the number of tiles and of generator tiles)
+    '''
+    scores, tiles, grid = tile_scores(lr, tile_size, overlap, method)
+    nb_rows, nb_cols, height, width = grid
+    detailed = np.where(scores >= threshold)[0]
+
+    sr = bicubic_upscale(lr, scale)
+
+    if len(detailed) > 0:
+        x = tiles[detailed].astype('float32')
+        if channels_first:
+            x = x.transpose((0, 3, 1, 2))
+
+        outputs = np.concatenate([model.predict_on_batch(x[i: i + batch_size]) for i in range(0, len(x), batch_size)])
+        if channels_first:
+            outputs = outputs.transpose((0, 2, 3, 1))
+        outputs = np.clip(outputs, 0, 255)
+
+        # Generator tiles are accumulated on a canvas of the (upscaled) reflect padded image
+        size = tile_size * scale
+        border = overlap * scale
+        stride = size - 2 * border
+        window = _blend_window(size, border)
+
+        canvas_shape = (nb_rows * stride + 2 * border, nb_cols * stride + 2 * border)
+        accumulated = np.zeros(canvas_shape + (3,), dtype='float32')
+        weights = np.zeros(canvas_shape, dtype='float32')
+
+        for k, tile_index in enumerate(detailed):
+            i, j = divmod(tile_index, nb_cols)
+            accumulated[i * stride: i * stride + size, j * stride: j * stride + size] += outputs[k] * window[..., None]
+            weights[i * stride: i * stride + size, j * stride: j * stride + size] += window
+
+        accumulated = accumulated[border: border + height * scale, border: border + width * scale]
+        weights = weights[border: border + height * scale, border: border + width * scale, None]
+
+        # Overlapping generator tiles are averaged, and faded into the bicubic image where the weights are < 1
+        alpha = np.minimum(weights, 1.)
+        sr = alpha * accumulated / np.maximum(weights, 1e-6) + (1. - alpha) * sr
+
+    stats = {'nb_tiles': len(scores),
+             'nb_generator_tiles': len(detailed)}
+
+    return np.clip(sr, 0, 255).astype('uint8'), stats
+
+
+def compare_thresholds(model, samples, tile_size, overlap=4, scale=4, thresholds=(2., 4., 8.), method='gradient',
+                       batch_size=16, channels_first=True, shave=None):
+    '''
+    Measures the latency and PSNR of adaptive inference at several thresholds, against the generator on all
+    the tiles (evaluation.upscale_image), on a list of (name, LR, HR) samples (see evaluation.prepare_dataset).
+
+    Returns:
+        list of rows (dictionaries), the first one being the full generator
+    '''
+    from loss import psnr
+
+    shave = shave if shave is not None else scale
+
+    def _psnr(hr, sr):
+        if shave > 0:
+            hr, sr = hr[shave:-shave, shave:-shave], sr[shave:-shave, shave:-shave]
+        return psnr(hr / 255., sr / 255.)
+
+    # Compiles the predict function before timing
+    upscale_image(model, samples[0][1], tile_size, overlap, scale, batch_size, channels_first)
+
+    t1 = time.time()
+    full_psnr = [_psnr(hr, upscale_image(model, lr, tile_size, overlap, scale, batch_size, channels_first))
+                 for _, lr, hr in samples]
+    full_time = time.time() - t1
+
+    table = [{'threshold': None,
+              'generator_fraction': 1.,
+              'time_per_image_ms': full_time / len(samples) * 1000.,
+              'speedup': 1.,
+              'psnr': float(np.mean(full_psnr)),
+              'psnr_cost': 0.}]
+
+    for threshold in thresholds:
+        values = []
+        nb_tiles = nb_generator_tiles = 0
+
+        t1 = time.time()
+        for _, lr, hr in samples:
+            sr, stats = adaptive_upscale_image(model, lr, tile_size, overlap, scale, threshold, method, batch_size,
+                                               channels_first)
+            values.append(_psnr(hr, sr))
+            nb_tiles += stats['nb_tiles']
+            nb_generator_tiles += stats['nb_generator_tiles']
+        adaptive_time = time.time() - t1
+
+        table.append({'threshold': threshold,
+                      'generator_fraction': nb_generator_tiles / float(nb_tiles),
+                      'time_per_image_ms': adaptive_time / len(samples) * 1000.,
+                      'speedup': full_time / adaptive_time,
+                      'psnr': float(np.mean(values)),
+                      'psnr_cost': table[0]['psnr'] - float(np.mean(values))})
+
+    return table
+
+
+def print_threshold_table(table):
+    print("%-10s %16s %18s %10s %10s %11s" % ('Threshold', 'Generator tiles', 'Time / image (ms)', 'Speedup',
+                                              'PSNR', 'PSNR cost'))
+    for row in table:
+        threshold = 'full' if row['threshold'] is None else '%0.2f' % row['threshold']
+        print("%-10s %15.1f%% %18.2f %9.2fx %10.4f %11.4f" % (threshold, row['generator_fraction'] * 100,
+                                                               row['time_per_image_ms'], row['speedup'],
+                                                               row['psnr'], row['psnr_cost']))
+
+
+if __name__ == "__main__":
+    import argparse
+    from keras import backend as K
+
+    from evaluation import prepare_dataset
+    from pruning import build_generator, load_generator_config
+
+    parser = argparse.ArgumentParser(description="Speedup and PSNR cost of hybrid adaptive inference")
+    parser.add_argument('weights_path', help='Generator weights (eg. weights/SRGAN.h5)')
+    parser.add_argument('image_dir', help='Directory of HR images (eg. tests/set14)')
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[2., 4., 8.])
+    parser.add_argument('--method', default='gradient', choices=SCORE_METHODS)
+    parser.add_argument('--tile_size', type=int, default=64)
+    parser.add_argument('--overlap', type=int, default=4)
+    parser.add_argument('--scale', type=int, default=4)
+    args = parser.parse_args()
+
+    _, model = build_generator(args.tile_size, args.scale, args.weights_path,
+                               **load_generator_config(args.weights_path))
+    samples = prepare_dataset(args.image_dir, args.scale)
+
+    table = compare_thresholds(model, samples, args.tile_size, args.overlap, args.scale, args.thresholds,
+                               args.method, channels_first=K.image_dim_ordering() == "th")
+    print_threshold_table(table)
@@ -0,0 +1,175 @@
+'''
+Automatic selection of the training image (patch) size and batch size under a memory budget.
+
+Every candidate configuration is built and trained for a few steps on synthetic images in a fresh
+process, so that its peak resident memory (RSS) and throughput are measured independently.
+'''
+import time
+import queue
+import resource
+import multiprocessing
+
+TRAINING_MODES = ('pre_train_srgan', 'pre_train_discriminator', 'train_full_model')
+
+
+def peak_rss_mb():
+    ''' Peak resident memory of the current process in MB (ru_maxrss is in KB on Linux) '''
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def synthetic_images(nb_images, img_width, img_height, seed=0):
+    ''' Random smooth high resolution images [0 - 255 scale] in the backend dim ordering '''
+    import numpy as np
+    from scipy.ndimage.filters import gaussian_filter
+
+    import models
+
+    rng = np.random.RandomState(seed)
+    images = rng.uniform(0, 255, size=(nb_images, img_width, img_height, 3))
+    images = gaussian_filter(images, sigma=(0, 1.5, 1.5, 0)).astype('float32')
+
+    return models.from_channels_last(images)
+
+
+def benchmark_training_mode(mode, img_width, img_height, batch_size, nb_steps=10, warmup_steps=2,
+                            network_kwargs=None):
+    '''
+    Builds the given training mode and measures its build time, compile time (first steps),
+    throughput and peak RSS on synthetic images. Should be run in a fresh process (see run_isolated).
+    '''
+    import models
+
+    assert mode in TRAINING_MODES, "mode must be one of %s" % str(TRAINING_MODES)
+    network_kwargs = network_kwargs if network_kwargs is not None else {}
+
+    srgan_network = models.SRGANNetwork(img_width=img_width, img_height=img_height, batch_size=batch_size,
+                                        **network_kwargs)
+
+    t1 = time.time()
+    if mode == 'pre_train_srgan':
+        srgan_network.build_srgan_pretrain_model()
+        mode_kwargs = {'pre_train_srgan': True}
+    elif mode == 'pre_train_discriminator':
+        srgan_network.build_discriminator_pretrain_model()
+        mode_kwargs = {'pre_train_discriminator': True}
+    else:
+        srgan_network.build_srgan_model()
+        mode_kwargs = {}
+    build_time = time.time() - t1
+
+    scale = srgan_network.scale
+    images = synthetic_images(batch_size * (warmup_steps + nb_steps), img_width * scale, img_height * scale)
+
+    # The first steps compile the training functions
+    t1 = time.time()
+    srgan_network._train_model(images[:batch_size * warmup_steps], nb_images=batch_size * warmup_steps,
+                               nb_epochs=1, save_loss=False, save_weights=False, **mode_kwargs)
+    compile_time = time.time() - t1
+
+    t1 = time.time()
+    srgan_network._train_model(images[batch_size * warmup_steps:], nb_images=batch_size * nb_steps,
+                               nb_epochs=1, save_loss=False, save_weights=False, **mode_kwargs)
+    train_time = time.time() - t1
+
+    return {'build_time': build_time,
+            'compile_time': compile_time,
+            'steps_per_sec': nb_steps / train_time,
+            'images_per_sec': nb_steps * batch_size / train_time,
+            'peak_rss_mb': peak_rss_mb(),
+            'scale': scale}
+
+
+def _worker(result_queue, func, args, kwargs):
+    try:
+        result_queue.put(func(*args, **kwargs))
+    except Exception as e:
+        result_queue.put({'error': repr(e)})
+
+
+def run_isolated(func, *args, **kwargs):
+    '''
+    Runs a benchmark function in a fresh process and returns its result dict.
+    If the process dies (eg. killed when running out of memory), an error dict is returned.
+    '''
+    ctx = multiprocessing.get_context('spawn')
+    result_queue = ctx.Queue()
+
+    process = ctx.Process(target=_worker, args=(result_queue, func, args, kwargs))
+    process.start()
+
+    while True:
+        try:
+            result = result_queue.get(timeout=1)
+            break
+        except queue.Empty:
+            if not process.is_alive():
+                result = {'error': 'Benchmark process exited with code %s' % str(process.exitcode)}
+                break
+
+    process.join()
+    return result
+
+
+def autotune(mode, memory_budget_mb, img_sizes=(16, 24, 32, 48, 64), batch_sizes=(1, 2, 4, 8, 16, 32, 64),
+             nb_steps=5, warmup_steps=2, network_kwargs=None, verbose=True):
+    '''
+    Finds the (img_size, batch_size) configuration of a training mode with the highest training
+    throughput whose peak RSS fits in the memory budget. Throughput is measured in high resolution
+    pixels per second, so that different image sizes can be compared.
+
+    img_size is the low resolution image width and height given to SRGANNetwork.
+    Larger batch sizes of an image size are not tried once a batch size exceeds the budget.
+
+    Args:
+        mode: one of 'pre_train_srgan', 'pre_train_discriminator' or 'train_full_model'
+        memory_budget_mb: maximum peak resident memory in MB.
+        network_kwargs: additional SRGANNetwork arguments (eg. {'upscale_type': 'subpixel'})
+
+    Returns:
+        (best, trials) where best is a dict with the img_width, img_height, batch_size and measured
+        statistics of the best configuration (None if no configuration fits), and trials is the
+        list of results of all the tried configurations.
+    '''
+    trials = []
+    best = None
+
+    for img_size in sorted(img_sizes):
+        for batch_size in sorted(batch_sizes):
+            stats = run_isolated(benchmark_training_mode, mode, img_size, img_size, batch_size, nb_steps=nb_steps,
+                                 warmup_steps=warmup_steps, network_kwargs=network_kwargs)
+
+            trial = {'img_width': img_size, 'img_height': img_size, 'batch_size': batch_size}
+            trial.update(stats)
+            trial['fits'] = 'error' not in stats and stats['peak_rss_mb'] <= memory_budget_mb
+
+            if 'error' not in stats:
+                # Images of different sizes are compared by the number of high resolution pixels per second
+                trial['pixels_per_sec'] = stats['images_per_sec'] * (img_size * stats['scale']) ** 2
+            trials.append(trial)
+
+            if verbose:
+                if 'error' in stats:
+                    print("Autotune %s | Image size : %d | Batch size : %d | Failed : %s" %
+                          (mode, img_size, batch_size, stats['error']))
+                else:
+                    print("Autotune %s | Image size : %d | Batch size : %d | Images / sec : %0.2f | "
+                          "Peak RSS : %0.1f MB | Fits budget : %s" % (mode, img_size, batch_size,
+                                                                      stats['images_per_sec'], stats['peak_rss_mb'],
+                                                                      trial['fits']))
+
+            if not trial['fits']:
+                # Memory grows with the batch size, so larger batches will not fit either
+                break
+
+            if best is None or trial['pixels_per_sec'] > best['pixels_per_sec']:
+                best = trial
+
+    if verbose:
+        if best is None:
+            print("Autotune %s : no configuration fits in %0.1f MB" % (mode, memory_budget_mb))
+        else:
+            print("Autotune %s : best configuration is image size %d, batch size %d (%0.2f images / sec, "
+                  "%0.1f MB)" % (mode, best['img_width'], best['batch_size'], best['images_per_sec'],
+                                 best['peak_rss_mb']))
+
+    return best, trials
@@ -0,0 +1,130 @@
+'''
+Content aware acceptance of training patches.
+
+Patches of sky, walls or solid backgrounds cost a full training step but teach the generator almost
+nothing. A ContentFilter scores every candidate patch cheaply on a downscaled grayscale copy, and accepts
+it with a probability given by an acceptance curve of the score. Low information patches are therefore
+rejected most of the time, but not always (min_acceptance), so flat regions are down weighted rather
+than removed from the training distribution.
+'''
+import numpy as np
+
+SCORE_METHODS = ('gradient', 'variance')
+
+
+def _downscale_gray(patch, factor):
+    ''' Grayscale copy of a (rows, cols, 3) patch, averaged over factor x factor blocks '''
+    gray = np.dot(patch[..., :3].astype('float32'), np.array([0.299, 0.587, 0.114], dtype='float32'))
+
+    if factor > 1:
+        rows = gray.shape[0] // factor * factor
+        cols = gray.shape[1] // factor * factor
+        gray = gray[:rows, :cols].reshape(rows // factor, factor, cols // factor, factor).mean(axis=(1, 3))
+
+    return gray
+
+
+def patch_score(patch, method='gradient', downscale=4):
+    '''
+    Information score of a uint8 patch of shape (rows, cols, 3) [0 - 255 scale].
+
+    'gradient': mean absolute horizontal + vertical gradient (gray levels per pixel of the downscaled copy).
+    'variance': standard deviation of the gray levels of the downscaled copy.
+    '''
+    gray = _downscale_gray(patch, downscale)
+
+    if method == 'gradient':
+        return float(np.mean(np.abs(np.diff(gray, axis=0))) + np.mean(np.abs(np.diff(gray, axis=1))))
+
+    return float(np.std(gray))
+
+
+class ContentFilter:
+    '''
+    Accepts or rejects candidate patches based on their information score.
+
+    The default acceptance curve is min_acceptance below the low score, 1 above the high score and
+    linear in between. Any function of the score returning a probability can be used instead.
+
+    Args:
+        method: 'gradient' or 'variance' (see patch_score).
+        low, high: scores of the linear acceptance ramp. Default to 2 and 8 gray levels for 'gradient',
+            and 5 and 20 for 'variance'.
+        min_acceptance: acceptance probability of the flattest patches.
+        acceptance_curve: optional function score -> acceptance probability, replacing the linear ramp.
+        downscale: downscaling factor of the copy the score is computed on.
+        max_tries: number of candidates drawn before the last one is accepted regardless of its score.
+        history_size: number of recent scores kept for the score percentiles of summary().
+    '''
+
+    def __init__(self, method='gradient', low=None, high=None, min_acceptance=0.1, acceptance_curve=None,
+                 downscale=4, max_tries=10, history_size=10000):
+        assert method in SCORE_METHODS, "method must be one of %s" % str(SCORE_METHODS)
+        assert 0. <= min_acceptance <= 1., "min_acceptance must be in the range [0, 1]"
+        assert max_tries >= 1, "max_tries must be at least 1"
+
+        default_low, default_high = (2., 8.) if method == 'gradient' else (5., 20.)
+
+        self.method = method
+        self.low = low if low is not None else default_low
+        self.high = high if high is not None else default_high
+        self.min_acceptance = min_acceptance
+        self.acceptance_curve = acceptance_curve
+        self.downscale = downscale
+        self.max_tries = max_tries
+        self.history_size = history_size
+
+        assert self.high > self.low, "high must be larger than low"
+
+        self.nb_scored = 0
+        self.nb_accepted = 0
+        self.nb_forced = 0
+        self.scores = []
+
+    def acceptance(self, score):
+        if self.acceptance_curve is not None:
+            return self.acceptance_curve(score)
+
+        ramp = np.clip((score - self.low) / (self.high - self.low), 0., 1.)
+        return self.min_acceptance + (1. - self.min_acceptance) * ramp
+
+    def accept(self, patch, rng=np.random, force=False):
+        '''
+        Scores a candidate patch and decides whether it is used.
+
+        Args:
+            force: accept the patch regardless of its score (it is still counted in the statistics).
+        '''
+        score = patch_score(patch, self.method, self.downscale)
+
+        self.nb_scored += 1
+        self.scores.append(score)
+        if len(self.scores) > self.history_size:
+            del self.scores[:len(self.scores) - self.history_size]
+
+        accepted = rng.uniform() < self.acceptance(score)
+        if not accepted and force:
+            self.nb_forced += 1
+            accepted = True
+
+        if accepted:
+            self.nb_accepted += 1
+
+        return accepted
+
+    def summary(self):
+        ''' Acceptance statistics and percentiles of the recent scores '''
+        summary = {'nb_scored': self.nb_scored,
+                   'nb_accepted': self.nb_accepted,
+                   'nb_forced': self.nb_forced,
+                   'acceptance_rate': self.nb_accepted / float(max(self.nb_scored, 1))}
+
+        if len(self.scores) > 0:
+            for percentile in [10, 50, 90]:
+                summary['score_p%d' % percentile] = float(np.percentile(self.scores, percentile))
+
+        return summary
+
+    def reset_stats(self):
+        self.nb_scored = self.nb_accepted = self.nb_forced = 0
+        self.scores = []
@@ -0,0 +1,255 @@
+'''
+Analytic compute and memory cost model of the generator, VGG and discriminator networks.
+
+Walks the same layer specifications as the builders in models.py (with the same layer names),
+but only computes shapes, so no Keras import or graph compilation is needed. Keep the layer
+specifications below in sync with models.py when the architectures change.
+
+Costs are reported per layer and in total:
+    - macs: multiply-accumulate operations of a forward pass
+    - param_bytes: size of the weights (float32)
+    - activation_bytes: size of the layer output (float32) for the whole batch
+'''
+import math
+from collections import namedtuple
+
+from upscaling import upscale_factors
+
+BYTES_PER_FLOAT = 4
+
+LayerCost = namedtuple('LayerCost', ['name', 'type', 'output_shape', 'macs', 'params', 'param_bytes',
+                                     'activation_bytes'])
+
+
+class _CostWalker:
+    ''' Tracks the current (channels, rows, cols) shape while layers are appended '''
+
+    def __init__(self, channels, rows, cols, batch_size):
+        self.shape = (channels, rows, cols)
+        self.batch_size = batch_size
+        self.layers = []
+
+    def _add(self, name, type, output_shape, macs=0, params=0):
+        self.shape = output_shape
+        nb_elements = 1
+        for dim in output_shape:
+            nb_elements *= dim
+
+        self.layers.append(LayerCost(name, type, output_shape, macs * self.batch_size, params,
+                                     params * BYTES_PER_FLOAT, nb_elements * self.batch_size * BYTES_PER_FLOAT))
+
+    def conv(self, name, nb_filters, k, stride=1):
+        channels, rows, cols = self.shape
+        rows = int(math.ceil(rows / float(stride)))  # border_mode='same'
+        cols = int(math.ceil(cols / float(stride)))
+
+        macs = rows * cols * nb_filters * channels * k * k
+        self._add(name, 'Convolution2D', (nb_filters, rows, cols), macs, k * k * channels * nb_filters + nb_filters)
+
+    def batchnorm(self, name):
+        self._add(name, 'BatchNormalization', self.shape, params=4 * self.shape[0])
+
+    def instancenorm(self, name):
+        self._add(name, 'InstanceNormalization', self.shape, params=2 * self.shape[0])
+
+    def elementwise(self, name, type):
+        self._add(name, type, self.shape)
+
+    def upsample(self, name, r=2):
+        channels, rows, cols = self.shape
+        self._add(name, 'UpSampling2D', (channels, rows * r, cols * r))
+
+    def subpixel(self, name, r, channels):
+        _, rows, cols = self.shape
+        self._add(name, 'SubPixelUpscaling', (channels, rows * r, cols * r))
+
+    def maxpool(self, name):
+        channels, rows, cols = self.shape
+        self._add(name, 'MaxPooling2D', (channels, rows // 2, cols // 2))
+
+    def flatten(self, name):
+        channels, rows, cols = self.shape
+        self._add(name, 'Flatten', (channels * rows * cols,))
+
+    def global_pool(self, name):
+        self._add(name, 'GlobalAveragePooling2D', (self.shape[0],))
+
+    def dense(self, name, output_dim):
+        input_dim = self.shape[0]
+        self._add(name, 'Dense', (output_dim,), input_dim * output_dim, input_dim * output_dim + output_dim)
+
+
+def generator_cost(img_width=32, img_height=32, batch_size=1, nb_upscales=2, small_model=False, gen_channels=64,
+                   nb_residual=None, upscale_type='nearest', normalization='batch', residual_filters=None, scale=None):
+    '''
+    Per layer costs of GenerativeNetwork.create_sr_model.
+    nb_residual overrides the number of residual blocks (5 for small_model, 15 otherwise), and
+    residual_filters the number of filters of the first convolution of every residual block.
+    scale overrides the 2 ** nb_upscales scale factor (see upscaling.upscale_factors).
+    '''
+    walker = _CostWalker(3, img_width, img_height, batch_size)
+    normalize = walker.instancenorm if normalization == 'instance' else walker.batchnorm
+
+    if nb_residual is None:
+        nb_residual = len(residual_filters) if residual_filters is not None else (5 if small_model else 15)
+
+    if residual_filters is None:
+        residual_filters = [gen_channels] * nb_residual
+
+    walker.conv('sr_res_conv1', gen_channels, 5)
+    normalize('sr_res_bn_1')
+    walker.elementwise('sr_res_lr1', 'LeakyReLU')
+
+    for i in range(1, nb_residual + 1):
+        walker.conv('sr_res_conv_%d_1' % i, residual_filters[i - 1], 3)
+        normalize('sr_res_bn_%d_1' % i)
+        walker.elementwise('sr_res_activation_%d_1' % i, 'LeakyReLU')
+        walker.conv('sr_res_conv_%d_2' % i, gen_channels, 3)
+        normalize('sr_res_bn_%d_2' % i)
+        walker.elementwise('sr_res_merge_%d' % i, 'Merge')
+
+    factors = upscale_factors(scale if scale is not None else 2 ** nb_upscales)
+    for i, factor in enumerate(factors, 1):
+        # Sub pixel blocks rearrange 32 * r * r channels into 32 channels
+        walker.conv('sr_res_upconv1_%d' % i, 32 * factor ** 2 if upscale_type == 'subpixel' else 128, 3)
+        walker.elementwise('sr_res_up_lr_%d_1_1' % i, 'LeakyReLU')
+
+        if upscale_type == 'subpixel':
+            walker.subpixel('sr_res_upscale_%d' % i, factor, 32)
+        else:
+            walker.upsample('sr_res_upscale_%d' % i, factor)
+            walker.conv('sr_res_filter1_%d' % i, 128, 3)
+            walker.elementwise('sr_res_up_lr_%d_1_2' % i, 'LeakyReLU')
+
+    walker.conv('sr_res_conv_final', 3, 5)
+    walker.elementwise('sr_res_conv_denorm', 'Denormalize')
+
+    return walker.layers
+
+
+def vgg_cost(img_width=128, img_height=128, batch_size=1):
+    '''
+    Per layer costs of VGGNetwork.append_vgg_network. The VGG network receives both the generated and
+    the true images, so it processes 2 * batch_size images.
+    '''
+    walker = _CostWalker(3, img_width, img_height, 2 * batch_size)
+    walker.elementwise('normalize_vgg', 'Normalize')
+
+    blocks = [(64, 2), (128, 2), (256, 3), (512, 3), (512, 3)]
+    for block, (nb_filters, nb_convs) in enumerate(blocks):
+        for conv in range(nb_convs):
+            walker.conv('vgg_conv%d_%d' % (block + 1, conv + 1), nb_filters, 3)
+        walker.maxpool('vgg_maxpool%d' % (block + 1))
+
+    return walker.layers
+
+
+def discriminator_cost(img_width=128, img_height=128, batch_size=1, small_model=False, head='dense',
+                       global_pooling=False, normalization='batch'):
+    ''' Per layer costs of DiscriminatorNetwork.append_gan_network for batch_size images '''
+    walker = _CostWalker(3, img_width, img_height, batch_size)
+    normalize = walker.instancenorm if normalization == 'instance' else walker.batchnorm
+
+    walker.elementwise('gan_normalize', 'Normalize')
+    walker.conv('gan_conv1_1', 64, 3)
+    walker.elementwise('gan_lrelu1_1', 'LeakyReLU')
+    walker.conv('gan_conv1_2', 64, 3, stride=2)
+    walker.elementwise('gan_lrelu1_2', 'LeakyReLU')
+    normalize('gan_batchnorm1_1')
+
+    filters = [128, 256] if small_model else [128, 256, 512]
+    for i, nb_filters in enumerate(filters):
+        for j in range(2):
+            walker.conv('gan_conv%d_%d' % (i + 2, j + 1), nb_filters, 3, stride=2 if j == 1 else 1)
+            walker.elementwise('gan_lrelu_%d_%d' % (i + 2, j + 1), 'LeakyReLU')
+            normalize('gan_batchnorm%d_%d' % (i + 2, j + 1))
+
+    output_dim = 128 if small_model else 1024
+
+    if head == 'patch':
+        walker.conv('gan_patch_dense1', output_dim, 1)
+        walker.elementwise('gan_lrelu5', 'LeakyReLU')
+
+        if global_pooling:
+            walker.global_pool('gan_global_pool')
+            walker.dense('gan_output', 2)
+        else:
+            walker.conv('gan_output', 2, 1)
+    else:
+        walker.flatten('gan_flatten')
+        walker.dense('gan_dense1', output_dim)
+        walker.elementwise('gan_lrelu5', 'LeakyReLU')
+        walker.dense('gan_output', 2)
+
+    return walker.layers
+
+
+def training_cost(mode, img_width=32, img_height=32, batch_size=1, scale=4, generator_kwargs=None,
+                  discriminator_kwargs=None):
+    '''
+    Forward pass costs of all the networks used by one training step of a mode of SRGANNetwork.
+
+    Args:
+        mode: one of 'pre_train_srgan', 'pre_train_discriminator' or 'train_full_model'
+        img_width, img_height: low resolution input size.
+
+    Returns:
+        dictionary of network name -> list of LayerCost
+    '''
+    generator_kwargs = generator_kwargs if generator_kwargs is not None else {}
+    discriminator_kwargs = discriminator_kwargs if discriminator_kwargs is not None else {}
+
+    large_width = img_width * scale
+    large_height = img_height * scale
+
+    costs = {'generator': generator_cost(img_width, img_height, batch_size, scale=scale, **generator_kwargs)}
+
+    if mode == 'pre_train_srgan':
+        costs['vgg'] = vgg_cost(large_width, large_height, batch_size)
+    elif mode == 'pre_train_discriminator':
+        # Discriminator is trained on the generated and true images
+        costs['discriminator'] = discriminator_cost(large_width, large_height, 2 * batch_size, **discriminator_kwargs)
+    else:
+        # Discriminator step on generated + true images, then generator step through the discriminator and VGG
+        costs['discriminator'] = discriminator_cost(large_width, large_height, 3 * batch_size, **discriminator_kwargs)
+        costs['vgg'] = vgg_cost(large_width, large_height, batch_size)
+
+    return costs
+
+
+def total_cost(layers):
+    ''' Sum of the macs, params, param_bytes and activation_bytes of a list of LayerCost '''
+    return {'macs': sum(layer.macs for layer in layers),
+            'params': sum(layer.params for layer in layers),
+            'param_bytes': sum(layer.param_bytes for layer in layers),
+            'activation_bytes': sum(layer.activation_bytes for layer in layers)}
+
+
+def print_cost_table(layers, top=None):
+    '''
+    Prints the per layer costs, optionally only the `top` most expensive layers (by MACs).
+    '''
+    total = total_cost(layers)
+
+    if top is not None:
+        layers = sorted(layers, key=lambda layer: layer.macs, reverse=True)[:top]
+
+    print("%-28s %-24s %-20s %12s %12s %12s" % ('Layer', 'Type', 'Output shape', 'GMACs', 'Params (MB)',
+                                                 'Activ. (MB)'))
+    for layer in layers:
+        print("%-28s %-24s %-20s %12.4f %12.3f %12.3f" % (layer.name, layer.type, str(layer.output_shape),
+                                                          layer.macs / 1e9, layer.param_bytes / 2. ** 20,
+                                                          layer.activation_bytes / 2. ** 20))
+
+    print("%-28s %-24s %-20s %12.4f %12.3f %12.3f" % ('Total (all layers)', '', '', total['macs'] / 1e9,
+                                                      total['param_bytes'] / 2. ** 20,
+                                                      total['activation_bytes'] / 2. ** 20))
+
+
+if __name__ == "__main__":
+    costs = training_cost('train_full_model', img_width=32, img_height=32, batch_size=1)
+
+    for network, layers in sorted(costs.items()):
+        print()
+        print("%s : top 10 layers by compute" % network)
+        print_cost_table(layers, top=10)
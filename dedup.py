@@ -0,0 +1,342 @@
+'''
+Perceptual hash deduplication of a training corpus.
+
+Every image of a DatasetManifest is reduced to a 64 bit perceptual hash (pHash : signs of the low
+frequency DCT coefficients of a 32x32 grayscale thumbnail, relative to their median), computed in a
+process pool. Near duplicates (resized, recompressed or slightly edited copies) have hashes within a
+small Hamming distance.
+
+The hashes are kept in a compact uint64 array, searched with multi-index hashing : the 64 bits are split
+into nb_chunks chunks, and two hashes within a Hamming radius r must have at least one chunk within
+r // nb_chunks bits. Candidates are found by binary search in the sorted chunk tables (for every chunk value
+within that distance), and then checked with the full Hamming distance.
+
+The index is saved to disk and updated incrementally : only new or modified images of the manifest are hashed.
+
+    python dedup.py coco.sqlite coco_hashes.npz coco_dedup.sqlite --radius 4
+'''
+import os
+import time
+import itertools
+import multiprocessing
+import numpy as np
+
+from image_loader import load_image
+from manifest import DatasetManifest
+
+HASH_SIZE = 8  # 8 x 8 = 64 bit hashes
+THUMBNAIL_SIZE = 32
+
+# Number of set bits of every byte value
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype='uint8')
+
+
+def _dct_matrix(n):
+    k = np.arange(n).reshape(-1, 1)
+    i = np.arange(n).reshape(1, -1)
+    return np.cos(np.pi * (2 * i + 1) * k / (2. * n))
+
+
+_DCT = _dct_matrix(THUMBNAIL_SIZE)
+
+
+def phash(img):
+    ''' 64 bit perceptual hash of a uint8 RGB image of shape (32, 32, 3) '''
+    gray = np.dot(img.astype('float64'), [0.299, 0.587, 0.114])
+    low = np.dot(np.dot(_DCT, gray), _DCT.T)[:HASH_SIZE, :HASH_SIZE]
+
+    bits = (low > np.median(low)).flatten()
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def _hash_image(path):
+    try:
+        # Draft mode decoding makes the thumbnail much cheaper than a full decode
+        return phash(load_image(path, (THUMBNAIL_SIZE, THUMBNAIL_SIZE)))
+    except Exception:
+        return None
+
+
+def hamming_distance(a, b):
+    ''' Element wise Hamming distance of two uint64 arrays '''
+    x = np.bitwise_xor(np.asarray(a, dtype='uint64'), np.asarray(b, dtype='uint64'))
+    return _POPCOUNT_TABLE[x.view('uint8')].reshape(x.shape + (8,)).sum(axis=-1)
+
+
+class HashIndex:
+    '''
+    Multi-index hashing over an array of 64 bit hashes.
+
+    Args:
+        hashes: uint64 array of hashes.
+        nb_chunks: number of chunks the hashes are split into (must divide 64).
+    '''
+
+    def __init__(self, hashes, nb_chunks=4):
+        assert 64 % nb_chunks == 0, "nb_chunks must divide 64"
+
+        self.hashes = np.asarray(hashes, dtype='uint64')
+        self.nb_chunks = nb_chunks
+        self.chunk_bits = 64 // nb_chunks
+
+        mask = np.uint64((1 << self.chunk_bits) - 1)
+        self.chunks = [(self.hashes >> np.uint64(c * self.chunk_bits)) & mask for c in range(nb_chunks)]
+        self.orders = [np.argsort(chunk, kind='mergesort') for chunk in self.chunks]
+        self.sorted_chunks = [chunk[order] for chunk, order in zip(self.chunks, self.orders)]
+
+    def _flip_masks(self, radius):
+        ''' All the chunk values with at most radius // nb_chunks set bits '''
+        masks = [0]
+        for nb_bits in range(1, radius // self.nb_chunks + 1):
+            for bits in itertools.combinations(range(self.chunk_bits), nb_bits):
+                masks.append(sum(1 << bit for bit in bits))
+
+        return [np.uint64(mask) for mask in masks]
+
+    def query(self, code, radius):
+        ''' Indices of the hashes within the Hamming radius of a hash '''
+        i, j = self._candidate_pairs(np.array([code], dtype='uint64'), radius)
+        candidates = np.unique(j)
+        distances = hamming_distance(self.hashes[candidates], np.uint64(code))
+        return candidates[distances <= radius]
+
+    def _candidate_pairs(self, queries, radius):
+        ''' (query index, hash index) of all the candidates sharing a chunk within radius // nb_chunks bits '''
+        mask = np.uint64((1 << self.chunk_bits) - 1)
+        query_ids, hash_ids = [], []
+
+        for c in range(self.nb_chunks):
+            query_chunks = (queries >> np.uint64(c * self.chunk_bits)) & mask
+
+            for flip in self._flip_masks(radius):
+                values = np.bitwise_xor(query_chunks, flip)
+                lo = np.searchsorted(self.sorted_chunks[c], values, side='left')
+                hi = np.searchsorted(self.sorted_chunks[c], values, side='right')
+
+                counts = hi - lo
+                total = int(counts.sum())
+                if total == 0:
+                    continue
+
+                # Expand every [lo, hi) range of the sorted table into positions
+                starts = np.repeat(lo - (np.cumsum(counts) - counts), counts)
+                positions = np.arange(total) + starts
+
+                query_ids.append(np.repeat(np.arange(len(queries)), counts))
+                hash_ids.append(self.orders[c][positions])
+
+        if len(query_ids) == 0:
+            return np.zeros(0, dtype='int64'), np.zeros(0, dtype='int64')
+
+        return np.concatenate(query_ids), np.concatenate(hash_ids)
+
+    def pairs(self, radius, block_size=65536):
+        '''
+        All the pairs (i, j), i < j of hashes within the Hamming radius.
+        Queries are processed in blocks to bound the memory used by the candidates.
+        '''
+        n = len(self.hashes)
+        pairs = []
+
+        for start in range(0, n, block_size):
+            i, j = self._candidate_pairs(self.hashes[start: start + block_size], radius)
+            i = i + start
+
+            keep = i < j
+            i, j = i[keep], j[keep]
+            keep = hamming_distance(self.hashes[i], self.hashes[j]) <= radius
+            i, j = i[keep], j[keep]
+
+            if len(i) > 0:
+                # A pair is found once per chunk within the chunk radius
+                pairs.append(np.unique(i.astype('int64') * n + j))
+
+        if len(pairs) == 0:
+            return np.zeros((0, 2), dtype='int64')
+
+        pairs = np.unique(np.concatenate(pairs))
+        return np.stack([pairs // n, pairs % n], axis=1)
+
+
+class DedupIndex:
+    '''
+    Persistent perceptual hash index of the images of a DatasetManifest.
+
+    Args:
+        index_path: path of the .npz file of the index.
+        nb_chunks: number of chunks of the multi-index hashing tables.
+    '''
+
+    def __init__(self, index_path, nb_chunks=4):
+        self.index_path = index_path
+        self.nb_chunks = nb_chunks
+
+        if os.path.exists(index_path):
+            data = np.load(index_path)
+            self.paths = [str(path) for path in data['paths']]
+            self.sizes = data['sizes']
+            self.mtimes = data['mtimes']
+            self.hashes = data['hashes']
+        else:
+            self.paths = []
+            self.sizes = np.zeros(0, dtype='int64')
+            self.mtimes = np.zeros(0, dtype='float64')
+            self.hashes = np.zeros(0, dtype='uint64')
+
+        self._index = None
+
+    def update(self, manifest, nb_workers=None, verbose=True):
+        '''
+        Hashes the images of the manifest which are new or modified since the last update, and drops
+        the images which are no longer in the manifest.
+
+        Returns:
+            dictionary with the number of hashed, reused, removed and failed images
+        '''
+        t1 = time.time()
+        nb_workers = nb_workers if nb_workers is not None else multiprocessing.cpu_count()
+
+        known = {path: (int(size), float(mtime), h) for path, size, mtime, h in
+                 zip(self.paths, self.sizes, self.mtimes, self.hashes)}
+
+        paths, sizes, mtimes, hashes = [], [], [], []
+        tasks = []
+        for path, size, mtime, _, _, _ in manifest.records():
+            entry = known.get(path)
+            if entry is not None and entry[:2] == (size, mtime):
+                paths.append(path)
+                sizes.append(size)
+                mtimes.append(mtime)
+                hashes.append(entry[2])
+            else:
+                tasks.append((path, size, mtime))
+
+        image_paths = [os.path.join(manifest.root, path) for path, _, _ in tasks]
+        if nb_workers > 1 and len(tasks) > 100:
+            pool = multiprocessing.Pool(nb_workers)
+            try:
+                new_hashes = pool.map(_hash_image, image_paths, chunksize=64)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            new_hashes = [_hash_image(path) for path in image_paths]
+
+        nb_failed = 0
+        for (path, size, mtime), h in zip(tasks, new_hashes):
+            if h is None:
+                nb_failed += 1
+                continue
+
+            paths.append(path)
+            sizes.append(size)
+            mtimes.append(mtime)
+            hashes.append(h)
+
+        stats = {'hashed': len(tasks) - nb_failed,
+                 'reused': len(paths) - (len(tasks) - nb_failed),
+                 'removed': len(known) - (len(paths) - (len(tasks) - nb_failed)),
+                 'failed': nb_failed}
+
+        self.paths = paths
+        self.sizes = np.array(sizes, dtype='int64')
+        self.mtimes = np.array(mtimes, dtype='float64')
+        self.hashes = np.array(hashes, dtype='uint64')
+        self._index = None
+        self.save()
+
+        if verbose:
+            print("Hash index updated in %0.2f seconds : %d hashed | %d reused | %d removed | %d failed" %
+                  (time.time() - t1, stats['hashed'], stats['reused'], stats['removed'], stats['failed']))
+
+        return stats
+
+    def save(self):
+        index_dir = os.path.dirname(self.index_path)
+        if index_dir != '' and not os.path.exists(index_dir):
+            os.makedirs(index_dir)
+
+        np.savez(self.index_path, paths=np.array(self.paths), sizes=self.sizes, mtimes=self.mtimes,
+                 hashes=self.hashes)
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = HashIndex(self.hashes, self.nb_chunks)
+        return self._index
+
+    def query(self, img, radius=4):
+        ''' Paths of the indexed images within the Hamming radius of a uint8 RGB image '''
+        thumbnail = np.asarray(img)
+        if thumbnail.shape[:2] != (THUMBNAIL_SIZE, THUMBNAIL_SIZE):
+            from PIL import Image
+            thumbnail = np.asarray(Image.fromarray(thumbnail).resize((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.BICUBIC))
+
+        return [self.paths[i] for i in self.index.query(phash(thumbnail), radius)]
+
+    def duplicate_groups(self, radius=4):
+        '''
+        Groups of near duplicate images (connected components of the pairs within the radius).
+
+        Returns:
+            list of lists of indices into paths, only for groups of at least 2 images
+        '''
+        from scipy.sparse import coo_matrix
+        from scipy.sparse.csgraph import connected_components
+
+        n = len(self.paths)
+        pairs = self.index.pairs(radius)
+        if len(pairs) == 0:
+            return []
+
+        graph = coo_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])), shape=(n, n))
+        _, labels = connected_components(graph, directed=False)
+
+        order = np.argsort(labels, kind='mergesort')
+        groups = np.split(order, np.flatnonzero(np.diff(labels[order])) + 1)
+        return [[int(i) for i in group] for group in groups if len(group) > 1]
+
+    def deduplicate(self, manifest, output_db_path, radius=4, verbose=True):
+        '''
+        Writes a manifest of the images of the manifest without near duplicates. The largest image
+        (by pixel count, then by byte size) of every group of near duplicates is kept.
+
+        Returns:
+            the deduplicated DatasetManifest
+        '''
+        records = {record[0]: record for record in manifest.records()}
+        groups = self.duplicate_groups(radius)
+
+        removed = set()
+        for group in groups:
+            group_paths = [self.paths[i] for i in group if self.paths[i] in records]
+            if len(group_paths) < 2:
+                continue
+
+            keep = max(group_paths, key=lambda path: (records[path][3] * records[path][4], records[path][1], path))
+            removed.update(path for path in group_paths if path != keep)
+
+        kept = [path for path in records if path not in removed]
+
+        if verbose:
+            print("Deduplication (radius %d) : %d groups of near duplicates | %d of %d images removed" %
+                  (radius, len(groups), len(removed), len(records)))
+
+        return manifest.subset(output_db_path, kept)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Perceptual hash deduplication of a dataset manifest")
+    parser.add_argument('manifest', help='Path of the SQLite manifest of the corpus (see manifest.py)')
+    parser.add_argument('index_path', help='Path of the hash index (.npz), updated incrementally')
+    parser.add_argument('output_manifest', help='Path of the deduplicated SQLite manifest')
+    parser.add_argument('--radius', type=int, default=4, help='Maximum Hamming distance of near duplicates')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    manifest = DatasetManifest(args.manifest)
+    dedup_index = DedupIndex(args.index_path)
+    dedup_index.update(manifest, nb_workers=args.workers)
+    dedup_index.deduplicate(manifest, args.output_manifest, radius=args.radius)
@@ -0,0 +1,268 @@
+import os
+import time
+import json
+import hashlib
+import multiprocessing
+import numpy as np
+from scipy.misc import imread, imresize, imsave
+
+from tiling import tile_image, stitch_tiles
+from manifest import DatasetManifest
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.ppm', '.tif', '.tiff')
+
+# Generator model of the current evaluation worker process
+_worker_state = {}
+
+
+def list_images(path):
+    ''' Sorted list of all the image files under path (including sub directories) '''
+    image_paths = []
+    for root, _, files in os.walk(path):
+        for file in files:
+            if file.lower().endswith(IMAGE_EXTENSIONS):
+                image_paths.append(os.path.join(root, file))
+
+    return sorted(image_paths)
+
+
+def dataset_cache_path(cache_dir, name, path, scale):
+    '''
+    Path of the prepared LR / HR pairs of a dataset (see prepare_dataset), keyed by the scale and a hash of
+    the absolute paths of all its images, so that another directory or manifest given under the same name
+    never reuses the cached images.
+
+    Args:
+        path: directory of HR images, or a DatasetManifest of the images.
+    '''
+    if isinstance(path, DatasetManifest):
+        image_paths = path.paths()
+    else:
+        image_paths = [os.path.abspath(image_path) for image_path in list_images(path)]
+
+    dataset_hash = hashlib.sha1("\n".join(image_paths).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_dir, "%s_%s_x%d.npz" % (name, dataset_hash, scale))
+
+
+def prepare_dataset(path, scale, cache_path=None, refresh=False):
+    '''
+    Loads the high resolution images of a dataset at their native resolution and creates the low
+    resolution (bicubic downscaled) generator inputs. High resolution images are cropped so that their
+    size is a multiple of the scale.
+
+    If cache_path is given, the prepared LR / HR pairs are stored there and reloaded on the next call,
+    so that images are only decoded and resized once per dataset and scale. The cache is not checked
+    against the images : use dataset_cache_path to key it by the dataset.
+
+    Args:
+        path: directory of HR images, or a DatasetManifest of the images.
+
+    Returns:
+        list of (image name, LR uint8 image, HR uint8 image), with images of shape (height, width, 3)
+    '''
+    if cache_path is not None and os.path.exists(cache_path) and not refresh:
+        cache = np.load(cache_path)
+        names = list(cache['names'])
+        return [(str(name), cache['lr_%d' % i], cache['hr_%d' % i]) for i, name in enumerate(names)]
+
+    image_paths = path.paths() if isinstance(path, DatasetManifest) else list_images(path)
+
+    samples = []
+    for image_path in image_paths:
+        hr = imread(image_path, mode='RGB')
+
+        height = hr.shape[0] - hr.shape[0] % scale
+        width = hr.shape[1] - hr.shape[1] % scale
+        hr = hr[:height, :width]
+
+        lr = imresize(hr, (height // scale, width // scale), interp='bicubic')
+        samples.append((os.path.splitext(os.path.basename(image_path))[0], lr, hr))
+
+    if cache_path is not None:
+        cache_dir = os.path.dirname(cache_path)
+        if cache_dir != '' and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+        arrays = {'names': np.array([name for name, _, _ in samples])}
+        for i, (_, lr, hr) in enumerate(samples):
+            arrays['lr_%d' % i] = lr
+            arrays['hr_%d' % i] = hr
+
+        np.savez(cache_path, **arrays)
+
+    return samples
+
+
+def _init_worker(weights_path, tile_size, scale, generator_kwargs):
+    from keras import backend as K
+    from keras.layers import Input
+    from keras.models import Model
+    import models
+
+    generative_network = models.GenerativeNetwork(tile_size, tile_size, scale=scale, **generator_kwargs)
+
+    ip = Input(shape=models.image_shape(tile_size, tile_size), name='x_generator')
+    model = Model(ip, generative_network.create_sr_model(ip))
+    model.load_weights(weights_path)
+
+    _worker_state['model'] = model
+    _worker_state['channels_first'] = K.image_dim_ordering() == "th"
+
+
+def upscale_image(model, lr, tile_size, overlap, scale, batch_size=16, channels_first=True):
+    '''
+    Upscales a uint8 image of shape (height, width, 3) of any size with a fixed input size generator,
+    by running it on overlapping tiles which are batched together.
+    '''
+    tiles, grid = tile_image(lr.astype('float32'), tile_size, overlap)
+
+    if channels_first:
+        tiles = tiles.transpose((0, 3, 1, 2))
+
+    outputs = []
+    for i in range(0, len(tiles), batch_size):
+        outputs.append(model.predict_on_batch(tiles[i: i + batch_size]))
+    outputs = np.concatenate(outputs)
+
+    if channels_first:
+        outputs = outputs.transpose((0, 2, 3, 1))
+
+    sr = stitch_tiles(outputs, grid, overlap, scale)
+    return np.clip(sr, 0, 255).astype('uint8')
+
+
+def _evaluate_image(task):
+    from loss import psnr, ssim
+
+    dataset, name, lr, hr, tile_size, overlap, scale, batch_size, shave, output_dir = task
+
+    t1 = time.time()
+    sr = upscale_image(_worker_state['model'], lr, tile_size, overlap, scale, batch_size,
+                       _worker_state['channels_first'])
+    inference_time = time.time() - t1
+
+    if shave > 0:
+        y_true = hr[shave:-shave, shave:-shave] / 255.
+        y_pred = sr[shave:-shave, shave:-shave] / 255.
+    else:
+        y_true = hr / 255.
+        y_pred = sr / 255.
+
+    result = {'dataset': dataset,
+              'name': name,
+              'psnr': float(psnr(y_true, y_pred)),
+              'ssim': float(ssim(y_true, y_pred)),
+              'inference_time': inference_time}
+
+    if output_dir is not None:
+        imsave(os.path.join(output_dir, "%s_%s_generated.png" % (dataset, name)), sr)
+
+    return result
+
+
+class EvaluationEngine:
+    '''
+    Evaluates a generator checkpoint on benchmark datasets (Set5, Set14, BSD100) at the native image resolution.
+
+    LR inputs are prepared once per dataset and scale and cached on disk. Images are spread over a pool of
+    worker processes, each of which holds its own copy of the generator. Images larger than the generator
+    input size are upscaled tile by tile.
+
+    Args:
+        weights_path: path to the generator weights (eg. weights/SRGAN.h5)
+        scale: upscaling factor of the generator.
+        tile_size: LR input size of the generator used for inference.
+        overlap: number of LR context pixels discarded around each tile.
+        nb_workers: number of worker processes. 0 evaluates in the current process.
+        batch_size: number of tiles per predict call.
+        shave: number of border pixels ignored when computing the metrics. Defaults to the scale.
+        cache_dir: directory where the prepared LR / HR pairs are cached.
+        output_dir: if given, the upscaled images are saved in this directory.
+        generator_kwargs: additional GenerativeNetwork arguments (eg. small_model=True).
+    '''
+
+    def __init__(self, weights_path, scale=4, tile_size=64, overlap=4, nb_workers=None, batch_size=16, shave=None,
+                 cache_dir="eval_cache/", output_dir=None, generator_kwargs=None):
+        self.weights_path = weights_path
+        self.scale = scale
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.nb_workers = nb_workers if nb_workers is not None else multiprocessing.cpu_count()
+        self.batch_size = batch_size
+        self.shave = shave if shave is not None else scale
+        self.cache_dir = cache_dir
+        self.output_dir = output_dir
+        self.generator_kwargs = generator_kwargs if generator_kwargs is not None else {}
+
+        if self.output_dir is not None and not os.path.exists(self.output_dir):
+            os.makedirs(self.output_dir)
+
+    def evaluate(self, datasets):
+        '''
+        Args:
+            datasets: dictionary of dataset name -> directory (or DatasetManifest) of HR images
+
+        Returns:
+            a report dictionary with the mean PSNR / SSIM and wall time of every dataset,
+            as well as the metrics of every image.
+        '''
+        t_start = time.time()
+
+        tasks = {}
+        for dataset, path in sorted(datasets.items()):
+            cache_path = None
+            if self.cache_dir is not None:
+                cache_path = dataset_cache_path(self.cache_dir, dataset, path, self.scale)
+
+            samples = prepare_dataset(path, self.scale, cache_path)
+            tasks[dataset] = [(dataset, name, lr, hr, self.tile_size, self.overlap, self.scale, self.batch_size,
+                               self.shave, self.output_dir) for name, lr, hr in samples]
+
+        report = {'config': {'weights_path': self.weights_path,
+                             'scale': self.scale,
+                             'tile_size': self.tile_size,
+                             'nb_workers': self.nb_workers},
+                  'datasets': {}}
+
+        initargs = (self.weights_path, self.tile_size, self.scale, self.generator_kwargs)
+
+        if self.nb_workers > 0:
+            ctx = multiprocessing.get_context('spawn')
+            pool = ctx.Pool(self.nb_workers, initializer=_init_worker, initargs=initargs)
+            map_func = pool.map
+        else:
+            pool = None
+            _init_worker(*initargs)
+            map_func = lambda func, items: list(map(func, items))
+
+        try:
+            for dataset, dataset_tasks in sorted(tasks.items()):
+                t1 = time.time()
+                results = map_func(_evaluate_image, dataset_tasks)
+                wall_time = time.time() - t1
+
+                report['datasets'][dataset] = {'psnr': float(np.mean([r['psnr'] for r in results])),
+                                               'ssim': float(np.mean([r['ssim'] for r in results])),
+                                               'nb_images': len(results),
+                                               'wall_time': wall_time,
+                                               'images': results}
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        report['total_time'] = time.time() - t_start
+        return report
+
+    @staticmethod
+    def print_report(report):
+        for dataset, stats in sorted(report['datasets'].items()):
+            print("%s : Average PSNR = %0.4f | Average SSIM = %0.4f | %d images | Wall time : %0.2f seconds" %
+                  (dataset, stats['psnr'], stats['ssim'], stats['nb_images'], stats['wall_time']))
+
+        print("Total evaluation time : %0.2f seconds" % report['total_time'])
+
+    @staticmethod
+    def save_report(report, path):
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,288 @@
+'''
+Image loading backend of the training and validation image streams.
+
+JPEG images are decoded with a reduced size (draft mode): the JPEG decoder can scale the image by
+1/2, 1/4 or 1/8 in the DCT domain, which skips most of the decoding work. The largest reduction
+which keeps the image at least as large as the target size is used, and the exact resize to the
+target size is done after decoding. Other formats are decoded at their full size.
+'''
+import os
+import time
+import numpy as np
+from PIL import Image
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.ppm')
+
+
+def list_image_files(directory):
+    ''' Sorted paths (relative to the directory) of all the images in the directory and its sub directories '''
+    filenames = []
+    for root, _, files in os.walk(directory):
+        for file in files:
+            if file.lower().endswith(IMAGE_EXTENSIONS):
+                filenames.append(os.path.relpath(os.path.join(root, file), directory))
+
+    return sorted(filenames)
+
+
+def load_image(path, target_size=None, draft=True, resample=Image.BICUBIC):
+    '''
+    Loads an RGB image as a uint8 array of shape (rows, cols, 3).
+
+    Args:
+        target_size: optional (rows, cols) to resize the image to (same convention as Keras target_size).
+        draft: use reduced size JPEG decoding when the image is larger than the target size.
+        resample: PIL filter of the resize to the target size.
+    '''
+    img = Image.open(path)
+
+    if target_size is not None and draft and img.format == 'JPEG':
+        # Picks the smallest DCT scale whose size is still >= the requested (width, height)
+        img.draft('RGB', (target_size[1], target_size[0]))
+
+    img = img.convert('RGB')
+
+    if target_size is not None and img.size != (target_size[1], target_size[0]):
+        img = img.resize((target_size[1], target_size[0]), resample)
+
+    return np.asarray(img, dtype='uint8')
+
+
+class DirectoryImageIterator:
+    '''
+    Infinite iterator over batches of the images of a directory, resized to target_size, which can replace
+    ImageDataGenerator.flow_from_directory(class_mode=None) in the training loops.
+
+    Like the Keras iterators, it exposes N (the number of images) and filenames (in the unshuffled order),
+    and reshuffles the images at the start of every pass over the directory.
+
+    Args:
+        directory: directory of images (searched recursively).
+        target_size: (rows, cols) of the images.
+        batch_size: number of images per batch. The last batch of a pass may be smaller.
+        shuffle: shuffle the images on every pass.
+        rescale: factor applied to the uint8 images (eg. 1. / 255).
+        channels_first: return batches of shape (batch, 3, rows, cols) instead of (batch, rows, cols, 3).
+        draft: use reduced size JPEG decoding (see load_image).
+        filenames: optional list of image paths relative to the directory, instead of listing the directory.
+        sampler: optional priority_sampler.PrioritySampler which draws the images of every batch (with
+            replacement) instead of the passes over the shuffled images. The indices and importance weights
+            of the last batch are available as batch_indices and batch_weights.
+    '''
+
+    def __init__(self, directory, target_size, batch_size=32, shuffle=True, seed=None, rescale=None,
+                 channels_first=True, draft=True, filenames=None, sampler=None):
+        self.directory = directory
+        self.target_size = tuple(target_size)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.rescale = rescale
+        self.channels_first = channels_first
+        self.draft = draft
+        self.sampler = sampler
+
+        self.filenames = list(filenames) if filenames is not None else list_image_files(directory)
+        self.N = len(self.filenames)
+        print('Found %d images.' % self.N)
+
+        self.rng = np.random.RandomState(seed)
+        self.batch_index = 0
+        self.index_array = None
+        self.batch_indices = None
+        self.batch_weights = None
+        self.decode_time = 0.
+
+    def reset(self):
+        self.batch_index = 0
+
+    def _next_indices(self):
+        if self.sampler is not None:
+            indices, self.batch_weights = self.sampler.sample(self.batch_size, self.rng)
+            return indices
+
+        if self.batch_index == 0:
+            self.index_array = self.rng.permutation(self.N) if self.shuffle else np.arange(self.N)
+
+        start = self.batch_index * self.batch_size
+        indices = self.index_array[start: start + self.batch_size]
+
+        self.batch_index += 1
+        if start + self.batch_size >= self.N:
+            self.batch_index = 0
+
+        return indices
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        self.batch_indices = self._next_indices()
+        return self.load_batch(self.batch_indices)
+
+    next = __next__  # Python 2
+
+    def load_batch(self, indices):
+        ''' Batch of the images at the given indices of filenames '''
+        t1 = time.time()
+        batch = np.empty((len(indices),) + self.target_size + (3,), dtype='float32')
+        for i, j in enumerate(indices):
+            batch[i] = load_image(os.path.join(self.directory, self.filenames[j]), self.target_size, self.draft)
+        self.decode_time += time.time() - t1
+
+        if self.rescale is not None:
+            batch *= self.rescale
+
+        if self.channels_first:
+            batch = batch.transpose((0, 3, 1, 2))
+
+        return batch
+
+
+class RandomPatchIterator:
+    '''
+    Infinite iterator over batches of random patch_size crops of the images of a directory.
+
+    Unlike DirectoryImageIterator, images are not resized to the patch size (which distorts their aspect
+    ratio), but cropped at their native resolution. Every decoded image is kept in a window of
+    reuse_window decoded images until crops_per_decode crops have been drawn from it, and the crops of a
+    batch are drawn at random from the whole window, so consecutive samples come from different images.
+    Images smaller than the patch size are upscaled (keeping their aspect ratio) to fit one patch.
+
+    A pass over the directory yields N = number of images * crops_per_decode samples.
+
+    Args:
+        directory: directory of images (searched recursively).
+        patch_size: (rows, cols) of the crops.
+        crops_per_decode: number of crops drawn from every decoded image.
+        reuse_window: number of decoded images kept in memory to draw crops from.
+        content_filter: optional content_filter.ContentFilter, which rejects most of the low information
+            candidate crops. Candidates count towards crops_per_decode whether they are accepted or not.
+        See DirectoryImageIterator for the other arguments.
+    '''
+
+    def __init__(self, directory, patch_size, batch_size=32, crops_per_decode=4, reuse_window=8, seed=None,
+                 rescale=None, channels_first=True, filenames=None, content_filter=None):
+        assert crops_per_decode >= 1, "crops_per_decode must be at least 1"
+        assert reuse_window >= 1, "reuse_window must be at least 1"
+
+        self.directory = directory
+        self.patch_size = tuple(patch_size)
+        self.batch_size = batch_size
+        self.crops_per_decode = crops_per_decode
+        self.reuse_window = reuse_window
+        self.rescale = rescale
+        self.channels_first = channels_first
+        self.content_filter = content_filter
+
+        self.filenames = list(filenames) if filenames is not None else list_image_files(directory)
+        self.N = len(self.filenames) * crops_per_decode
+        print('Found %d images. Drawing %d crops per image.' % (len(self.filenames), crops_per_decode))
+
+        self.rng = np.random.RandomState(seed)
+        self.file_order = []
+        self.window = []  # [image, number of remaining crops]
+
+        self.nb_decoded = 0
+        self.nb_crops = 0
+        self.decode_time = 0.
+
+    def _decode_next(self):
+        if len(self.file_order) == 0:
+            self.file_order = list(self.rng.permutation(len(self.filenames)))
+
+        path = os.path.join(self.directory, self.filenames[self.file_order.pop()])
+
+        t1 = time.time()
+        img = Image.open(path).convert('RGB')
+
+        rows, cols = self.patch_size
+        if img.size[0] < cols or img.size[1] < rows:
+            ratio = max(cols / float(img.size[0]), rows / float(img.size[1]))
+            img = img.resize((int(np.ceil(img.size[0] * ratio)), int(np.ceil(img.size[1] * ratio))), Image.BICUBIC)
+
+        self.window.append([np.asarray(img, dtype='uint8'), self.crops_per_decode])
+        self.decode_time += time.time() - t1
+        self.nb_decoded += 1
+
+    def _draw(self):
+        while len(self.window) < self.reuse_window and (len(self.window) == 0 or len(self.file_order) > 0):
+            self._decode_next()
+
+        slot = self.rng.randint(len(self.window))
+        img = self.window[slot][0]
+
+        rows, cols = self.patch_size
+        y = self.rng.randint(img.shape[0] - rows + 1)
+        x = self.rng.randint(img.shape[1] - cols + 1)
+
+        self.window[slot][1] -= 1
+        if self.window[slot][1] == 0:
+            self.window.pop(slot)
+
+        return img[y: y + rows, x: x + cols]
+
+    def _crop(self):
+        if self.content_filter is None:
+            patch = self._draw()
+        else:
+            # Rejected candidates also use up the crops of their image, so flat images leave the window quickly
+            for attempt in range(self.content_filter.max_tries):
+                patch = self._draw()
+                if self.content_filter.accept(patch, self.rng, force=attempt == self.content_filter.max_tries - 1):
+                    break
+
+        self.nb_crops += 1
+        return patch
+
+    def stats(self):
+        ''' Number of decoded images, number of crops and decoding time so far '''
+        return {'nb_decoded': self.nb_decoded,
+                'nb_crops': self.nb_crops,
+                'crops_per_decode': self.nb_crops / float(max(self.nb_decoded, 1)),
+                'decode_time': self.decode_time}
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        batch = np.empty((self.batch_size,) + self.patch_size + (3,), dtype='float32')
+        for i in range(self.batch_size):
+            batch[i] = self._crop()
+
+        if self.rescale is not None:
+            batch *= self.rescale
+
+        if self.channels_first:
+            batch = batch.transpose((0, 3, 1, 2))
+
+        return batch
+
+    next = __next__  # Python 2
+
+
+def benchmark_decoding(directory, target_size=(128, 128), nb_images=200):
+    ''' Average decoding time per image (in milliseconds) with and without draft mode '''
+    filenames = list_image_files(directory)[:nb_images]
+    results = {}
+
+    for draft in [False, True]:
+        t1 = time.time()
+        for filename in filenames:
+            load_image(os.path.join(directory, filename), target_size, draft)
+        results['draft' if draft else 'full'] = (time.time() - t1) / max(len(filenames), 1) * 1000.
+
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compares full and draft mode JPEG decoding times")
+    parser.add_argument('directory')
+    parser.add_argument('--size', type=int, default=128, help='Target image size')
+    parser.add_argument('--nb_images', type=int, default=200)
+    args = parser.parse_args()
+
+    results = benchmark_decoding(args.directory, (args.size, args.size), args.nb_images)
+    print("Full decode : %0.2f ms / image | Draft decode : %0.2f ms / image | Speedup : %0.2fx" %
+          (results['full'], results['draft'], results['full'] / results['draft']))
@@ -21,6 +21,24 @@ def smooth_gan_labels(y):
     return Y
 
 
+def patch_gan_labels(y, output_shape):
+    '''
+    Broadcasts (batch, 2) labels over the spatial grid of a per-patch discriminator output.
+    Labels for discriminators with a 2D output (dense head or global pooling) are returned as is.
+    '''
+    if len(output_shape) == 2:
+        return y
+
+    if K.image_dim_ordering() == "th":
+        _, _, rows, cols = output_shape
+        Y = np.tile(y[:, :, np.newaxis, np.newaxis], (1, 1, rows, cols))
+    else:
+        _, rows, cols, _ = output_shape
+        Y = np.tile(y[:, np.newaxis, np.newaxis, :], (1, rows, cols, 1))
+
+    return Y.astype('float32')
+
+
 def _standardize_user_data(model, x, y,
                            sample_weight=None, class_weight=None,
                            check_batch_dim=True, batch_size=None):
@@ -197,3 +215,79 @@ def fit(model, x, y, batch_size=32, nb_epoch=10, verbose=1, callbacks=[],
                            verbose=verbose, callbacks=callbacks,
                            val_f=val_f, val_ins=val_ins, shuffle=shuffle,
                            callback_metrics=callback_metrics)
+
+
+def per_sample_loss(model):
+    '''
+    Loss of every sample of a compiled model : the loss functions of its outputs, averaged over each
+    sample and summed with the loss weights of the model, before sample weighting. Regularization
+    losses are batch level and are not included.
+
+    Returns:
+        tensor of shape (batch,)
+    '''
+    loss_weights = model.loss_weights
+    if loss_weights is None:
+        loss_weights = [1.] * len(model.outputs)
+    elif isinstance(loss_weights, dict):
+        loss_weights = [loss_weights.get(name, 1.) for name in model.output_names]
+
+    total = None
+    for loss_function, loss_weight, y_true, y_pred in zip(model.loss_functions, loss_weights, model.targets,
+                                                          model.outputs):
+        loss = loss_weight * K.mean(K.batch_flatten(loss_function(y_true, y_pred)), axis=1)
+        total = loss if total is None else total + loss
+
+    return total
+
+
+def _function_inputs(model, x, y, sample_weights, learning_phase):
+    ins = [np.asarray(a, dtype=K.floatx()) for a in list(x) + list(y) + list(sample_weights)]
+    if model.uses_learning_phase and type(K.learning_phase()) is not int:
+        ins.append(learning_phase)
+
+    return ins
+
+
+def _placeholders(model):
+    inputs = model.inputs + model.targets + model.sample_weights
+    if model.uses_learning_phase and type(K.learning_phase()) is not int:
+        inputs = inputs + [K.learning_phase()]
+
+    return inputs
+
+
+def per_sample_train_function(model):
+    '''
+    Training function of a compiled model which also returns the loss of every sample (see per_sample_loss),
+    computed in the same forward pass as the weight updates. Use it instead of fit / train_on_batch, since
+    it creates its own optimizer updates.
+
+    Returns:
+        function (list of inputs, list of targets, list of sample weights) -> (list of the values of
+        model.metrics_names, per sample losses)
+    '''
+    training_updates = model.optimizer.get_updates(model._collected_trainable_weights, model.constraints,
+                                                   model.total_loss)
+    function = K.function(_placeholders(model), [model.total_loss] + model.metrics_tensors + [per_sample_loss(model)],
+                          updates=model.updates + training_updates)
+
+    def train(x, y, sample_weights):
+        outputs = function(_function_inputs(model, x, y, sample_weights, 1.))
+        return outputs[:-1], outputs[-1]
+
+    return train
+
+
+def per_sample_loss_function(model):
+    '''
+    Returns:
+        function (list of inputs, list of targets) -> per sample losses (see per_sample_loss), without training
+    '''
+    function = K.function(_placeholders(model), [per_sample_loss(model)])
+
+    def evaluate(x, y):
+        sample_weights = [np.ones(len(x[0]), dtype=K.floatx())] * len(model.outputs)
+        return function(_function_inputs(model, x, y, sample_weights, 0.))[0]
+
+    return evaluate
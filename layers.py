@@ -1,11 +1,14 @@
 from keras.engine.topology import Layer
 from keras import backend as K
-import itertools
+from keras import initializations
+import numpy as np
 
 class Normalize(Layer):
     '''
-    Custom layer to subtract the outputs of previous layer by 120,
-    to normalize the inputs to the VGG and GAN networks.
+    Custom layer to normalize the inputs to the VGG and GAN networks.
+
+    For the GAN network, the inputs are scaled from [0, 255] to [-1, +1].
+    For the VGG network, the per channel VGG means are subtracted, in either dim ordering.
     '''
 
     def __init__(self, type="vgg", value=120, **kwargs):
@@ -20,17 +23,13 @@ class Normalize(Layer):
         if self.type == "gan":
             return (x - self.value) / self.value # [0, 255] -> [-1, +1]
         else:
-            if K.backend() == "theano":
-                import theano.tensor as T
-                x = T.set_subtensor(x[:, 0, :, :], x[:, 0, :, :] - 103.939)
-                x = T.set_subtensor(x[:, 1, :, :], x[:, 1, :, :] - 116.779)
-                x = T.set_subtensor(x[:, 2, :, :], x[:, 2, :, :] - 123.680)
+            if K.image_dim_ordering() == "th":
+                mean_shape = (1, 3, 1, 1)
             else:
-                # No exact substitute for set_subtensor in tensorflow
-                # So we subtract an approximate value
-                x = x - self.value
-            return x
+                mean_shape = (1, 1, 1, 3)
 
+            vgg_mean = np.array([103.939, 116.779, 123.680], dtype=K.floatx()).reshape(mean_shape)
+            return x - K.constant(vgg_mean)
 
     def get_output_shape_for(self, input_shape):
         return input_shape
@@ -55,56 +54,107 @@ class Denormalize(Layer):
         return input_shape
 
 
-''' Theano Backend function '''
-def depth_to_scale_th(input, scale, channels):
-    ''' Uses phase shift algorithm [1] to convert channels/depth for spacial resolution '''
-    import theano.tensor as T
+class InstanceNormalization(Layer):
+    '''
+    Normalizes each channel of each sample independently over its spatial dimensions,
+    followed by a learned per channel scale and shift.
 
-    b, k, row, col = input.shape
-    output_shape = (b, channels, row * scale, col * scale)
+    Unlike BatchNormalization(mode=2), the output of a sample does not depend on the other
+    samples in the batch, so the same normalization is obtained at any batch size.
+
+    Args:
+        axis: channel axis. 1 for 'th' dim ordering, -1 for 'tf' dim ordering.
+        epsilon: small float added to the variance to avoid dividing by zero.
+    '''
+
+    def __init__(self, axis=-1, epsilon=1e-5, gamma_init='one', beta_init='zero', **kwargs):
+        super(InstanceNormalization, self).__init__(**kwargs)
+        self.axis = axis
+        self.epsilon = epsilon
+        self.gamma_init = initializations.get(gamma_init)
+        self.beta_init = initializations.get(beta_init)
+
+    def build(self, input_shape):
+        self.nb_channels = input_shape[self.axis]
+        shape = (self.nb_channels,)
+
+        self.gamma = self.gamma_init(shape, name='{}_gamma'.format(self.name))
+        self.beta = self.beta_init(shape, name='{}_beta'.format(self.name))
+        self.trainable_weights = [self.gamma, self.beta]
+
+        self.built = True
+
+    def call(self, x, mask=None):
+        ndim = K.ndim(x)
+        axis = self.axis % ndim
+        reduction_axes = [i for i in range(1, ndim) if i != axis]
+
+        mean = K.mean(x, axis=reduction_axes, keepdims=True)
+        var = K.var(x, axis=reduction_axes, keepdims=True)
+        x_normed = (x - mean) / K.sqrt(var + self.epsilon)
+
+        broadcast_shape = [1] * ndim
+        broadcast_shape[axis] = self.nb_channels
+
+        gamma = K.reshape(self.gamma, broadcast_shape)
+        beta = K.reshape(self.beta, broadcast_shape)
+        return gamma * x_normed + beta
+
+    def get_output_shape_for(self, input_shape):
+        return input_shape
+
+    def get_config(self):
+        config = {'axis': self.axis,
+                  'epsilon': self.epsilon,
+                  'gamma_init': self.gamma_init.__name__,
+                  'beta_init': self.beta_init.__name__}
+        base_config = super(InstanceNormalization, self).get_config()
+        return dict(list(base_config.items()) + list(config.items()))
 
-    out = T.zeros(output_shape)
-    r = scale
 
-    for y, x in itertools.product(range(scale), repeat=2):
-        out = T.inc_subtensor(out[:, :, y::r, x::r], input[:, r * y + x :: r * r, :, :])
+def depth_to_scale(input, scale, channels, dim_ordering='th'):
+    '''
+    Vectorized phase shift (pixel shuffle) [1] which converts channels/depth into spatial resolution.
 
-    return out
+    Implemented purely as a reshape + transpose so that it builds a constant size graph
+    on both Theano and Tensorflow backends.
 
+    For 'th' dim ordering, the input of shape (b, channels * r * r, h, w) is mapped as
+        out[:, c, h * r + i, w * r + j] = in[:, c * r * r + i * r + j, h, w]
 
-''' Tensorflow Backend Function '''
-def depth_to_scale_tf(input, scale, channels):
-    try:
-        import tensorflow as tf
-    except ImportError:
-        print("Could not import Tensorflow for depth_to_scale operation. Please install Tensorflow or switch to Theano backend")
-        exit()
+    For 'tf' dim ordering, the input of shape (b, h, w, r * r * channels) is mapped as
+        out[:, h * r + i, w * r + j, c] = in[:, h, w, (i * r + j) * channels + c]
+    which is the same layout as tf.depth_to_space.
 
-    def _phase_shift(I, r):
-        ''' Function copied as is from https://github.com/Tetrachrome/subpixel/blob/master/subpixel.py'''
+    [1] https://arxiv.org/abs/1609.05158
+    '''
+    r = scale
+    shape = K.shape(input)
 
-        bsize, a, b, c = I.get_shape().as_list()
-        bsize = tf.shape(I)[0]  # Handling Dimension(None) type for undefined batch dim
-        X = tf.reshape(I, (bsize, a, b, r, r))
-        X = tf.transpose(X, (0, 1, 2, 4, 3))  # bsize, a, b, 1, 1
-        X = tf.split(1, a, X)  # a, [bsize, b, r, r]
-        X = tf.concat(2, [tf.squeeze(x) for x in X])  # bsize, b, a*r, r
-        X = tf.split(1, b, X)  # b, [bsize, a*r, r]
-        X = tf.concat(2, [tf.squeeze(x) for x in X])  # bsize, a*r, b*r
-        return tf.reshape(X, (bsize, a * r, b * r, 1))
+    if dim_ordering == 'th':
+        b, h, w = shape[0], shape[2], shape[3]
 
-    if channels > 1:
-        Xc = tf.split(3, 3, input)
-        X = tf.concat(3, [_phase_shift(x, scale) for x in Xc])
+        x = K.reshape(input, (b, channels, r, r, h, w))
+        x = K.permute_dimensions(x, (0, 1, 4, 2, 5, 3))  # b, c, h, r, w, r
+        x = K.reshape(x, (b, channels, h * r, w * r))
     else:
-        X = _phase_shift(input, scale)
-    return X
+        b, h, w = shape[0], shape[1], shape[2]
+
+        x = K.reshape(input, (b, h, w, r, r, channels))
+        x = K.permute_dimensions(x, (0, 1, 3, 2, 4, 5))  # b, h, r, w, r, c
+        x = K.reshape(x, (b, h * r, w * r, channels))
+
+    return x
 
-'''
-Implementation is incomplete. Use lambda layer for now.
-'''
 
 class SubPixelUpscaling(Layer):
+    '''
+    Sub-pixel convolution upscaling layer. Rearranges an input of
+    (channels * r * r) feature maps into (channels) feature maps of r times the spatial size.
+
+    Placing this after a convolution lets the convolution run in the low resolution space,
+    which is r * r times cheaper than running it after an UpSampling2D layer.
+    '''
 
     def __init__(self, r, channels, **kwargs):
         super(SubPixelUpscaling, self).__init__(**kwargs)
@@ -113,19 +163,61 @@ class SubPixelUpscaling(Layer):
         self.channels = channels
 
     def build(self, input_shape):
-        pass
+        k = input_shape[1] if K.image_dim_ordering() == "th" else input_shape[-1]
+        assert k == self.channels * self.r * self.r, "SubPixelUpscaling requires channels * r * r = %d input " \
+                                                     "channels, found %d" % (self.channels * self.r * self.r, k)
 
     def call(self, x, mask=None):
-        if K.backend() == "theano":
-            y = depth_to_scale_th(x, self.r, self.channels)
-        else:
-            y = depth_to_scale_tf(x, self.r, self.channels)
-        return y
+        return depth_to_scale(x, self.r, self.channels, K.image_dim_ordering())
 
     def get_output_shape_for(self, input_shape):
         if K.image_dim_ordering() == "th":
             b, k, r, c = input_shape
-            return (b, self.channels, r * self.r, c * self.r)
+            r = r * self.r if r is not None else None
+            c = c * self.r if c is not None else None
+            return (b, self.channels, r, c)
         else:
             b, r, c, k = input_shape
-            return (b, r * self.r, c * self.r, self.channels)
\ No newline at end of file
+            r = r * self.r if r is not None else None
+            c = c * self.r if c is not None else None
+            return (b, r, c, self.channels)
+
+    def get_config(self):
+        config = {'r': self.r,
+                  'channels': self.channels}
+        base_config = super(SubPixelUpscaling, self).get_config()
+        return dict(list(base_config.items()) + list(config.items()))
+
+
+class ContentLoss(Layer):
+    '''
+    Per sample VGG content loss. The input is the batch of features of the generated images followed
+    by the features of the true images (as in the VGG network of the SRGAN model), and the output is
+    weight * the sum of the squared feature differences of every generated image, of shape (batch, 1).
+
+    Unlike loss.ContentVGGRegularizer, the loss of every image is a model output, so it can be weighted
+    with sample weights and read back after a training step.
+    '''
+
+    def __init__(self, weight=1.0, **kwargs):
+        super(ContentLoss, self).__init__(**kwargs)
+        self.weight = weight
+
+    def build(self, input_shape):
+        pass
+
+    def call(self, x, mask=None):
+        batch_size = K.shape(x)[0] // 2
+
+        generated = K.batch_flatten(x[:batch_size])
+        content = K.batch_flatten(x[batch_size:])
+
+        return self.weight * K.sum(K.square(content - generated), axis=1, keepdims=True)
+
+    def get_output_shape_for(self, input_shape):
+        return (input_shape[0] // 2 if input_shape[0] is not None else None, 1)
+
+    def get_config(self):
+        config = {'weight': self.weight}
+        base_config = super(ContentLoss, self).get_config()
+        return dict(list(base_config.items()) + list(config.items()))
@@ -12,6 +12,12 @@ def dummy_loss(y_true, y_pred):
     return dummy_loss_val
 
 
+# Loss of models whose output already is the loss of every sample (eg. layers.ContentLoss),
+# so that the per sample losses can be weighted with sample weights
+def identity_loss(y_true, y_pred):
+    return y_pred
+
+
 def psnr(y_true, y_pred):
     assert y_true.shape == y_pred.shape, "Cannot calculate PSNR. Input shapes not same." \
                                          " y_true shape = %s, y_pred shape = %s" % (str(y_true.shape),
@@ -19,6 +25,39 @@ def psnr(y_true, y_pred):
 
     return -10. * np.log10(np.mean(np.square(y_pred - y_true)))
 
+
+def ssim(y_true, y_pred, max_value=1., sigma=1.5):
+    '''
+    Structural Similarity [1] between two images of shape (height, width, channels),
+    computed with a gaussian window on every channel and averaged.
+
+    [1] Wang et al. "Image quality assessment: from error visibility to structural similarity"
+    '''
+    from scipy.ndimage.filters import gaussian_filter
+
+    assert y_true.shape == y_pred.shape, "Cannot calculate SSIM. Input shapes not same." \
+                                         " y_true shape = %s, y_pred shape = %s" % (str(y_true.shape),
+                                                                                   str(y_pred.shape))
+
+    c1 = (0.01 * max_value) ** 2
+    c2 = (0.03 * max_value) ** 2
+
+    y_true = y_true.astype('float64')
+    y_pred = y_pred.astype('float64')
+    window = (sigma, sigma, 0)
+
+    mu_true = gaussian_filter(y_true, window)
+    mu_pred = gaussian_filter(y_pred, window)
+
+    var_true = gaussian_filter(y_true * y_true, window) - mu_true ** 2
+    var_pred = gaussian_filter(y_pred * y_pred, window) - mu_pred ** 2
+    covariance = gaussian_filter(y_true * y_pred, window) - mu_true * mu_pred
+
+    ssim_map = ((2 * mu_true * mu_pred + c1) * (2 * covariance + c2)) / \
+               ((mu_true ** 2 + mu_pred ** 2 + c1) * (var_true + var_pred + c2))
+
+    return np.mean(ssim_map)
+
 def PSNRLoss(y_true, y_pred):
     """
     PSNR is Peek Signal to Noise Ratio, which is similar to mean squared error.
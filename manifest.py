@@ -0,0 +1,281 @@
+'''
+Persistent manifest of an image dataset, stored in SQLite.
+
+The manifest records the relative path, byte size, mtime, dimensions and validity of every image of a
+directory tree once. Updates are incremental: only new and modified files (by size and mtime) are opened
+again, and deleted files are removed. The training and evaluation loaders read the image list from the
+manifest instead of scanning the directory, and can filter images by size and shard them between workers.
+
+    python manifest.py build /path/to/coco coco.sqlite --workers 8
+    python manifest.py stats coco.sqlite
+
+    manifest = DatasetManifest("coco.sqlite", min_width=128, min_height=128, shard_index=0, nb_shards=4)
+    srgan_network.pre_train_srgan(manifest, nb_images=50000)
+'''
+import os
+import time
+import zlib
+import sqlite3
+import multiprocessing
+
+from PIL import Image
+
+from image_loader import IMAGE_EXTENSIONS
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    valid INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS info (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
+
+
+def _scan(directory, root):
+    ''' Yields (relative path, size, mtime) of all the images under directory '''
+    for entry in os.scandir(directory):
+        if entry.is_dir(follow_symlinks=False):
+            for item in _scan(entry.path, root):
+                yield item
+        elif entry.name.lower().endswith(IMAGE_EXTENSIONS):
+            stat = entry.stat()
+            yield os.path.relpath(entry.path, root), stat.st_size, stat.st_mtime
+
+
+def _probe(task):
+    '''
+    Reads the dimensions of an image from its header. With deep_check, the whole image is decoded,
+    which also detects truncated files.
+    '''
+    root, path, size, mtime, deep_check = task
+
+    try:
+        img = Image.open(os.path.join(root, path))
+        width, height = img.size
+
+        if deep_check:
+            img.load()
+
+        valid = width > 0 and height > 0
+    except Exception:
+        width, height, valid = 0, 0, False
+
+    return path, size, mtime, width, height, int(valid)
+
+
+class DatasetManifest:
+    '''
+    SQLite manifest of the images of a directory tree.
+
+    Args:
+        db_path: path of the SQLite database.
+        root: root directory of the images. Only needed to build or update the manifest, it is
+            stored in the database.
+        min_width, min_height: only list images at least this large.
+        shard_index, nb_shards: only list the images of one of nb_shards disjoint shards. Images are
+            assigned to shards by a hash of their path, so shards do not change when images are added.
+        include_invalid: also list images which could not be read.
+    '''
+
+    def __init__(self, db_path, root=None, min_width=None, min_height=None, shard_index=0, nb_shards=1,
+                 include_invalid=False):
+        assert 0 <= shard_index < nb_shards, "shard_index must be in the range [0, nb_shards)"
+
+        self.db_path = db_path
+        self.min_width = min_width
+        self.min_height = min_height
+        self.shard_index = shard_index
+        self.nb_shards = nb_shards
+        self.include_invalid = include_invalid
+
+        self.connection = sqlite3.connect(db_path)
+        self.connection.executescript(_SCHEMA)
+
+        stored_root = self._get_info('root')
+        if root is not None:
+            root = os.path.abspath(root)
+            if stored_root is not None and stored_root != root:
+                print("Manifest %s was built for %s. Using it for %s." % (db_path, stored_root, root))
+
+            self._set_info('root', root)
+            self.connection.commit()
+        elif stored_root is None:
+            raise ValueError("Manifest %s is empty, the root directory of the images must be given" % db_path)
+
+        self.root = root if root is not None else stored_root
+        self._filenames = None
+
+    def _get_info(self, key):
+        row = self.connection.execute("SELECT value FROM info WHERE key = ?", (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def _set_info(self, key, value):
+        self.connection.execute("INSERT OR REPLACE INTO info (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def update(self, nb_workers=None, deep_check=False, verbose=True):
+        '''
+        Scans the root directory and updates the manifest : new and modified images (by size and mtime)
+        are probed for their dimensions and validity, and deleted images are removed.
+
+        Args:
+            nb_workers: number of processes probing the images. Defaults to the number of CPUs.
+            deep_check: decode the whole image instead of only its header to check its validity.
+
+        Returns:
+            dictionary with the number of added, updated, removed and unchanged images
+        '''
+        t1 = time.time()
+        nb_workers = nb_workers if nb_workers is not None else multiprocessing.cpu_count()
+
+        existing = {path: (size, mtime) for path, size, mtime in
+                    self.connection.execute("SELECT path, size, mtime FROM images")}
+
+        seen = set()
+        tasks = []
+        for path, size, mtime in _scan(self.root, self.root):
+            seen.add(path)
+            if existing.get(path) != (size, mtime):
+                tasks.append((self.root, path, size, mtime, deep_check))
+
+        removed = [(path,) for path in existing if path not in seen]
+
+        if nb_workers > 1 and len(tasks) > 1000:
+            pool = multiprocessing.Pool(nb_workers)
+            try:
+                rows = pool.map(_probe, tasks, chunksize=256)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            rows = [_probe(task) for task in tasks]
+
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO images (path, size, mtime, width, height, valid) "
+                                        "VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self.connection.executemany("DELETE FROM images WHERE path = ?", removed)
+            self._set_info('updated', time.time())
+
+        self._filenames = None
+
+        nb_added = sum(1 for task in tasks if task[1] not in existing)
+        stats = {'added': nb_added,
+                 'updated': len(tasks) - nb_added,
+                 'removed': len(removed),
+                 'unchanged': len(seen) - len(tasks),
+                 'invalid': sum(1 for row in rows if not row[5])}
+
+        if verbose:
+            print("Manifest %s updated in %0.2f seconds : %d added | %d updated | %d removed | %d unchanged | "
+                  "%d new invalid images" % (self.db_path, time.time() - t1, stats['added'], stats['updated'],
+                                             stats['removed'], stats['unchanged'], stats['invalid']))
+
+        return stats
+
+    def records(self):
+        ''' (path, size, mtime, width, height, valid) of all the listed images, sorted by path '''
+        query = "SELECT path, size, mtime, width, height, valid FROM images WHERE 1"
+        params = []
+
+        if not self.include_invalid:
+            query += " AND valid = 1"
+        if self.min_width is not None:
+            query += " AND width >= ?"
+            params.append(self.min_width)
+        if self.min_height is not None:
+            query += " AND height >= ?"
+            params.append(self.min_height)
+
+        records = self.connection.execute(query + " ORDER BY path", params).fetchall()
+
+        if self.nb_shards > 1:
+            records = [record for record in records
+                       if zlib.crc32(record[0].encode('utf-8')) % self.nb_shards == self.shard_index]
+
+        return records
+
+    def filenames(self):
+        ''' Paths (relative to root) of the listed images, sorted by path. The list is queried once. '''
+        if self._filenames is None:
+            self._filenames = [record[0] for record in self.records()]
+
+        return self._filenames
+
+    def paths(self):
+        ''' Absolute paths of the listed images '''
+        return [os.path.join(self.root, path) for path in self.filenames()]
+
+    def stats(self):
+        nb_images, nb_valid, total_size = self.connection.execute(
+            "SELECT COUNT(*), SUM(valid), SUM(size) FROM images").fetchone()
+
+        return {'root': self.root,
+                'nb_images': nb_images,
+                'nb_valid': nb_valid or 0,
+                'nb_listed': len(self.filenames()),
+                'total_size_mb': (total_size or 0) / 2. ** 20}
+
+    def subset(self, db_path, paths):
+        '''
+        Writes a new manifest (with the same root) which only contains the given images of this manifest,
+        eg. the images kept after deduplication (see dedup.py).
+
+        Returns:
+            the new DatasetManifest
+        '''
+        if os.path.exists(db_path):
+            os.remove(db_path)
+
+        subset = DatasetManifest(db_path, self.root)
+        paths = set(paths)
+
+        rows = [row for row in self.connection.execute("SELECT path, size, mtime, width, height, valid FROM images")
+                if row[0] in paths]
+
+        with subset.connection:
+            subset.connection.executemany("INSERT INTO images (path, size, mtime, width, height, valid) "
+                                          "VALUES (?, ?, ?, ?, ?, ?)", rows)
+            subset._set_info('parent', os.path.abspath(self.db_path))
+
+        return subset
+
+    def __len__(self):
+        return len(self.filenames())
+
+    def close(self):
+        self.connection.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Persistent dataset manifest")
+    subparsers = parser.add_subparsers(dest='command')
+
+    build_parser = subparsers.add_parser('build', help='Build or incrementally update a manifest')
+    build_parser.add_argument('root', help='Root directory of the images')
+    build_parser.add_argument('db_path', help='Path of the SQLite manifest')
+    build_parser.add_argument('--workers', type=int, default=None)
+    build_parser.add_argument('--deep_check', action='store_true', help='Fully decode images to check them')
+
+    stats_parser = subparsers.add_parser('stats', help='Print the statistics of a manifest')
+    stats_parser.add_argument('db_path')
+    stats_parser.add_argument('--min_size', type=int, default=None)
+
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        manifest = DatasetManifest(args.db_path, args.root)
+        manifest.update(nb_workers=args.workers, deep_check=args.deep_check)
+        print(manifest.stats())
+    elif args.command == 'stats':
+        manifest = DatasetManifest(args.db_path, min_width=args.min_size, min_height=args.min_size)
+        print(manifest.stats())
+    else:
+        parser.print_help()
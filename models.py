@@ -1,28 +1,32 @@
 from keras import backend as K
 from keras.models import Model
-from keras.layers import Input, merge, BatchNormalization, LeakyReLU, Flatten, Dense
+from keras.layers import Input, merge, BatchNormalization, LeakyReLU, Flatten, Dense, GlobalAveragePooling2D
 from keras.layers.convolutional import Convolution2D, MaxPooling2D, UpSampling2D
 from keras.optimizers import Adam
 from keras.preprocessing.image import ImageDataGenerator
 from keras.utils.np_utils import to_categorical
-from keras.utils.data_utils import get_file
 
-from keras_ops import fit as bypass_fit, smooth_gan_labels
+from keras_ops import fit as bypass_fit, smooth_gan_labels, patch_gan_labels, per_sample_train_function, \
+    per_sample_loss_function
 
-from layers import Normalize, Denormalize, SubPixelUpscaling
-from loss import AdversarialLossRegularizer, ContentVGGRegularizer, TVRegularizer, psnr, dummy_loss
+from layers import Normalize, Denormalize, SubPixelUpscaling, InstanceNormalization, ContentLoss
+from scheduler import DiscriminatorScheduler
+from sample_cache import FakeSampleCache, weights_hash
+from priority_sampler import PrioritySampler, dataset_fingerprint
+from autotune import autotune
+from upscaling import upscale_factors
+from image_loader import DirectoryImageIterator, RandomPatchIterator
+from manifest import DatasetManifest
+from weight_registry import WeightRegistry, load_vgg16, read_h5_weights, set_weights_by_name
+from loss import AdversarialLossRegularizer, ContentVGGRegularizer, TVRegularizer, psnr, dummy_loss, identity_loss
 
 import os
 import time
-import h5py
 import numpy as np
 import json
 from scipy.misc import imresize, imsave
 from scipy.ndimage.filters import gaussian_filter
 
-THEANO_WEIGHTS_PATH_NO_TOP = r'https://github.com/fchollet/deep-learning-models/releases/download/v0.1/vgg16_weights_th_dim_ordering_th_kernels_notop.h5'
-TF_WEIGHTS_PATH_NO_TOP = r"https://github.com/fchollet/deep-learning-models/releases/download/v0.1/vgg16_weights_tf_dim_ordering_tf_kernels_notop.h5"
-
 if not os.path.exists("weights/"):
     os.makedirs("weights/")
 
@@ -34,6 +38,28 @@ if K.image_dim_ordering() == "th":
 else:
     channel_axis = -1
 
+
+def image_shape(width, height, channels=3):
+    ''' Shape of a single image in the dim ordering of the backend '''
+    if K.image_dim_ordering() == "th":
+        return (channels, width, height)
+    else:
+        return (width, height, channels)
+
+
+def to_channels_last(x):
+    ''' Converts images (or a batch of images) from the backend dim ordering to (..., width, height, channels) '''
+    if K.image_dim_ordering() == "th":
+        return np.moveaxis(x, -3, -1)
+    return x
+
+
+def from_channels_last(x):
+    ''' Converts images (or a batch of images) of shape (..., width, height, channels) to the backend dim ordering '''
+    if K.image_dim_ordering() == "th":
+        return np.moveaxis(x, -1, -3)
+    return x
+
 class VGGNetwork:
     '''
     Helper class to load VGG and its weights to the FastNet model
@@ -46,7 +72,13 @@ class VGGNetwork:
 
         self.vgg_layers = None
 
-    def append_vgg_network(self, x_in, true_X_input, pre_train=False):
+    def append_vgg_network(self, x_in, true_X_input, pre_train=False, per_image_loss=False):
+        '''
+        Args:
+            pre_train: use the content loss of the vgg_conv2_2 features instead of the vgg_conv5_3 features.
+            per_image_loss: (pre_train only) return the content loss of every image (layers.ContentLoss)
+                instead of a content loss regularizer, and stop the VGG network after vgg_conv2_2.
+        '''
 
         # Append the initial inputs to the outputs of the SRResNet
         x = merge([x_in, true_X_input], mode='concat', concat_axis=0)
@@ -62,7 +94,10 @@ class VGGNetwork:
 
         x = Convolution2D(128, 3, 3, activation='relu', name='vgg_conv2_1', border_mode='same')(x)
 
-        if pre_train:
+        if pre_train and per_image_loss:
+            x = Convolution2D(128, 3, 3, activation='relu', name='vgg_conv2_2', border_mode='same')(x)
+            return ContentLoss(weight=self.vgg_weight, name='content_loss')(x)
+        elif pre_train:
             vgg_regularizer2 = ContentVGGRegularizer(weight=self.vgg_weight)
             x = Convolution2D(128, 3, 3, activation='relu', name='vgg_conv2_2', border_mode='same',
                               activity_regularizer=vgg_regularizer2)(x)
@@ -95,27 +130,21 @@ class VGGNetwork:
 
         return x
 
-    def load_vgg_weight(self, model):
-        # Loading VGG 16 weights
-        if K.image_dim_ordering() == "th":
-            weights = get_file('vgg16_weights_th_dim_ordering_th_kernels_notop.h5', THEANO_WEIGHTS_PATH_NO_TOP,
-                                   cache_subdir='models')
-        else:
-            weights = get_file('vgg16_weights_tf_dim_ordering_tf_kernels_notop.h5', TF_WEIGHTS_PATH_NO_TOP,
-                                   cache_subdir='models')
-        f = h5py.File(weights)
+    def load_vgg_weight(self, model, up_to_block=5, registry=None):
+        '''
+        Loads the VGG 16 weights by layer name from the local weight registry (see weight_registry.py).
+        They are only downloaded if the registry does not have them yet.
 
-        layer_names = [name for name in f.attrs['layer_names']]
+        Args:
+            up_to_block: only load the weights of the first up_to_block VGG blocks.
+            registry: optional WeightRegistry. Defaults to weights/registry/ (or $SRGAN_WEIGHT_REGISTRY).
+        '''
+        load_vgg16(model, up_to_block=up_to_block, registry=registry)
 
         if self.vgg_layers is None:
             self.vgg_layers = [layer for layer in model.layers
                                if 'vgg_' in layer.name]
 
-        for i, layer in enumerate(self.vgg_layers):
-            g = f[layer_names[i]]
-            weights = [g[name] for name in g.attrs['weight_names']]
-            layer.set_weights(weights)
-
         # Freeze all VGG layers
         for layer in self.vgg_layers:
             layer.trainable = False
@@ -125,15 +154,34 @@ class VGGNetwork:
 
 class DiscriminatorNetwork:
 
-    def __init__(self, img_width=384, img_height=384, adversarial_loss_weight=1, small_model=False):
+    def __init__(self, img_width=384, img_height=384, adversarial_loss_weight=1, small_model=False,
+                 head='dense', global_pooling=False, normalization='batch'):
+        '''
+        Args:
+            head: 'dense' flattens the final feature maps into a Dense layer, whose size grows with the
+                image area. 'patch' keeps the head fully convolutional, producing a classification per
+                receptive field patch, so the number of parameters is independent of the image size.
+            global_pooling: only used by the 'patch' head. If True, the per-patch features are averaged
+                into a single (batch, 2) prediction. Otherwise the output is a spatial map of per-patch
+                probabilities, trained with binary crossentropy.
+            normalization: 'batch' for BatchNormalization or 'instance' for InstanceNormalization.
+        '''
+        assert head in ['dense', 'patch'], "head must be one of 'dense' or 'patch'"
+        assert normalization in ['batch', 'instance'], "normalization must be one of 'batch' or 'instance'"
+
         self.img_width = img_width
         self.img_height = img_height
         self.adversarial_loss_weight = adversarial_loss_weight
         self.small_model = small_model
+        self.head = head
+        self.global_pooling = global_pooling
+        self.normalization = normalization
 
         self.k = 3
         self.mode = 2
         self.weights_path = "weights/Discriminator weights.h5"
+        self.registry_name = "discriminator"
+        self.registry = None
 
         self.gan_layers = None
 
@@ -147,7 +195,7 @@ class DiscriminatorNetwork:
 
         x = Convolution2D(64, self.k, self.k, border_mode='same', name='gan_conv1_2', subsample=(2, 2))(x)
         x = LeakyReLU(0.3, name='gan_lrelu1_2')(x)
-        x = BatchNormalization(mode=self.mode, axis=channel_axis, name='gan_batchnorm1_1')(x)
+        x = self._normalize(x, name='gan_batchnorm1_1')
 
         filters = [128, 256] if self.small_model else [128, 256, 512]
 
@@ -158,7 +206,10 @@ class DiscriminatorNetwork:
                 x = Convolution2D(nb_filters, self.k, self.k, border_mode='same', subsample=subsample,
                                   name='gan_conv%d_%d' % (i + 2, j + 1))(x)
                 x = LeakyReLU(0.3, name='gan_lrelu_%d_%d' % (i + 2, j + 1))(x)
-                x = BatchNormalization(mode=self.mode, axis=channel_axis, name='gan_batchnorm%d_%d' % (i + 2, j + 1))(x)
+                x = self._normalize(x, name='gan_batchnorm%d_%d' % (i + 2, j + 1))
+
+        if self.head == 'patch':
+            return self._append_patch_head(x)
 
         x = Flatten(name='gan_flatten')(x)
 
@@ -172,6 +223,41 @@ class DiscriminatorNetwork:
 
         return x
 
+    def _normalize(self, ip, name):
+        if self.normalization == 'instance':
+            return InstanceNormalization(axis=channel_axis, name=name)(ip)
+
+        return BatchNormalization(mode=self.mode, axis=channel_axis, name=name)(ip)
+
+    def _append_patch_head(self, ip):
+        '''
+        Fully convolutional replacement of the Flatten + Dense head.
+        The 1x1 convolution acts as the dense layer applied independently to every patch.
+        '''
+        output_dim = 128 if self.small_model else 1024
+
+        x = Convolution2D(output_dim, 1, 1, border_mode='same', name='gan_patch_dense1')(ip)
+        x = LeakyReLU(0.3, name='gan_lrelu5')(x)
+
+        gan_regulrizer = AdversarialLossRegularizer(weight=self.adversarial_loss_weight)
+
+        if self.global_pooling:
+            x = GlobalAveragePooling2D(name='gan_global_pool')(x)
+            x = Dense(2, activation="softmax", activity_regularizer=gan_regulrizer, name='gan_output')(x)
+        else:
+            x = Convolution2D(2, 1, 1, activation='sigmoid', border_mode='same', activity_regularizer=gan_regulrizer,
+                              name='gan_output')(x)
+
+        return x
+
+    @property
+    def loss(self):
+        ''' Per-patch probability maps are trained as independent binary classifications '''
+        if self.head == 'patch' and not self.global_pooling:
+            return 'binary_crossentropy'
+
+        return 'categorical_crossentropy'
+
     def set_trainable(self, model, value=True):
         if self.gan_layers is None:
             disc_model = [layer for layer in model.layers
@@ -183,39 +269,87 @@ class DiscriminatorNetwork:
         for layer in self.gan_layers:
             layer.trainable = value
 
-    def load_gan_weights(self, model):
-        f = h5py.File(self.weights_path)
+    def _registry(self, registry=None):
+        ''' The given registry, or the default WeightRegistry (created once) '''
+        if registry is not None:
+            return registry
 
-        layer_names = [name for name in f.attrs['layer_names']]
-        layer_names = layer_names[1:] # First is an input layer. Not needed.
+        if self.registry is None:
+            self.registry = WeightRegistry()
 
-        if self.gan_layers is None:
-            self.gan_layers = [layer for layer in model.layers
-                                if 'gan_' in layer.name]
+        return self.registry
 
-        for i, layer in enumerate(self.gan_layers):
-            g = f[layer_names[i]]
-            weights = [g[name] for name in g.attrs['weight_names']]
-            layer.set_weights(weights)
+    def load_gan_weights(self, model, registry=None):
+        '''
+        Loads the discriminator weights by layer name (also into a discriminator nested in the SRGAN model).
+        If the weight registry has a 'discriminator' entry, it is used, otherwise the weights are read
+        from weights_path.
+        '''
+        registry = self._registry(registry)
 
-        print("GAN Model weights loaded.")
+        if registry.has(self.registry_name):
+            loaded = registry.load_into(model, self.registry_name)
+        else:
+            loaded = set_weights_by_name(model, read_h5_weights(self.weights_path))
+
+        loaded = [name for name in loaded if 'gan_' in name]
+        if len(loaded) == 0:
+            raise ValueError("No discriminator layer weights found for the model")
+
+        print("GAN Model weights loaded (%d layers)." % len(loaded))
         return model
 
-    def save_gan_weights(self, model):
+    def save_gan_weights(self, model, registry=None):
         print('GAN Weights are being saved.')
         model.save_weights(self.weights_path, overwrite=True)
+
+        # Keep the registry entry (if one was imported) in sync, since it takes precedence when loading
+        registry = self._registry(registry)
+        if registry.has(self.registry_name):
+            registry.put_model(self.registry_name, model, source=os.path.abspath(self.weights_path))
         print('GAN Weights saved.')
 
 
 class GenerativeNetwork:
 
     def __init__(self, img_width=96, img_height=96, batch_size=16, nb_upscales=2, small_model=False,
-                 content_weight=1, tv_weight=2e5, gen_channels=64):
+                 content_weight=1, tv_weight=2e5, gen_channels=64, upscale_type='nearest', normalization='batch',
+                 nb_residual=None, residual_filters=None, scale=None):
+        '''
+        Args:
+            upscale_type: 'nearest' uses UpSampling2D followed by a convolution at the upscaled resolution.
+                'subpixel' runs the convolution in the low resolution space and rearranges the channels
+                into pixels using SubPixelUpscaling, which is significantly cheaper.
+            normalization: 'batch' for BatchNormalization or 'instance' for InstanceNormalization, which
+                normalizes every image independently and therefore behaves the same at any batch size.
+            nb_residual: number of residual blocks. Overrides small_model (5 blocks) and the default of 15 blocks.
+            residual_filters: optional list with the number of filters of the first convolution of every
+                residual block (eg. of a pruned generator, see pruning.py). Defaults to gen_channels for all blocks.
+            scale: upscaling factor, which overrides nb_upscales (scale 2 ** nb_upscales). Powers of 2 use
+                2x upscale blocks, factors of 3 use 3x upscale blocks (see upscaling.upscale_factors).
+        '''
+        assert upscale_type in ['nearest', 'subpixel'], "upscale_type must be one of 'nearest' or 'subpixel'"
+        assert normalization in ['batch', 'instance'], "normalization must be one of 'batch' or 'instance'"
+
+        if nb_residual is None:
+            nb_residual = len(residual_filters) if residual_filters is not None else (5 if small_model else 15)
+
+        if residual_filters is None:
+            residual_filters = [gen_channels] * nb_residual
+
+        assert len(residual_filters) == nb_residual, "residual_filters must have one entry per residual block"
+
         self.img_width = img_width
         self.img_height = img_height
         self.batch_size = batch_size
         self.small_model = small_model
-        self.nb_scales = nb_upscales
+        self.scale = scale if scale is not None else 2 ** nb_upscales
+        self.upscale_factors = upscale_factors(self.scale)
+        self.nb_scales = len(self.upscale_factors)
+        self.upscale_type = upscale_type
+        self.normalization = normalization
+        self.nb_residual = nb_residual
+        self.residual_filters = list(residual_filters)
 
         self.content_weight = content_weight
         self.tv_weight = tv_weight
@@ -225,31 +359,41 @@ class GenerativeNetwork:
         self.init = 'glorot_uniform'
 
         self.sr_res_layers = None
-        self.sr_weights_path = "weights/SRGAN.h5"
+        self.sr_weights_path = None
+        self.sr_best_weights_path = None
+        self.set_weights_name("SRGAN")
 
         self.output_func = None
 
+    def set_weights_name(self, name):
+        ''' Sets the weight paths to weights/<name>.h5 and weights/<name>_best.h5 (with a _x<scale> suffix if not 4x) '''
+        if self.scale != 4:
+            name += "_x%d" % self.scale
+
+        self.sr_weights_path = "weights/%s.h5" % name
+        self.sr_best_weights_path = "weights/%s_best.h5" % name
+
     def create_sr_model(self, ip):
 
         x = Convolution2D(self.filters, 5, 5, activation='linear', border_mode='same', name='sr_res_conv1',
                           init=self.init)(ip)
-        x = BatchNormalization(axis=channel_axis, mode=self.mode, name='sr_res_bn_1')(x)
+        x = self._normalize(x, name='sr_res_bn_1')
         x = LeakyReLU(alpha=0.25, name='sr_res_lr1')(x)
 
         # x = Convolution2D(self.filters, 5, 5, activation='linear', border_mode='same', name='sr_res_conv2')(x)
         # x = BatchNormalization(axis=channel_axis, mode=self.mode, name='sr_res_bn_2')(x)
         # x = LeakyReLU(alpha=0.25, name='sr_res_lr2')(x)
 
-        nb_residual = 5 if self.small_model else 15
-
-        for i in range(nb_residual):
+        for i in range(self.nb_residual):
             x = self._residual_block(x, i + 1)
 
-        for scale in range(self.nb_scales):
-            x = self._upscale_block(x, scale + 1)
+        for i, factor in enumerate(self.upscale_factors):
+            if self.upscale_type == 'subpixel':
+                x = self._subpixel_upscale_block(x, i + 1, factor)
+            else:
+                x = self._upscale_block(x, i + 1, factor)
 
-        scale = 2 ** self.nb_scales
-        tv_regularizer = TVRegularizer(img_width=self.img_width * scale, img_height=self.img_height * scale,
+        tv_regularizer = TVRegularizer(img_width=self.img_width * self.scale, img_height=self.img_height * self.scale,
                                        weight=self.tv_weight) #self.tv_weight)
 
         x = Convolution2D(3, 5, 5, activation='tanh', border_mode='same', activity_regularizer=tv_regularizer,
@@ -262,20 +406,26 @@ class GenerativeNetwork:
     def _residual_block(self, ip, id):
         init = ip
 
-        x = Convolution2D(self.filters, 3, 3, activation='linear', border_mode='same', name='sr_res_conv_' + str(id) + '_1',
-                          init=self.init)(ip)
-        x = BatchNormalization(axis=channel_axis, mode=self.mode, name='sr_res_bn_' + str(id) + '_1')(x)
+        x = Convolution2D(self.residual_filters[id - 1], 3, 3, activation='linear', border_mode='same',
+                          name='sr_res_conv_' + str(id) + '_1', init=self.init)(ip)
+        x = self._normalize(x, name='sr_res_bn_' + str(id) + '_1')
         x = LeakyReLU(alpha=0.25, name="sr_res_activation_" + str(id) + "_1")(x)
 
         x = Convolution2D(self.filters, 3, 3, activation='linear', border_mode='same', name='sr_res_conv_' + str(id) + '_2',
                           init=self.init)(x)
-        x = BatchNormalization(axis=channel_axis, mode=self.mode, name='sr_res_bn_' + str(id) + '_2')(x)
+        x = self._normalize(x, name='sr_res_bn_' + str(id) + '_2')
 
         m = merge([x, init], mode='sum', name="sr_res_merge_" + str(id))
 
         return m
 
-    def _upscale_block(self, ip, id):
+    def _normalize(self, ip, name):
+        if self.normalization == 'instance':
+            return InstanceNormalization(axis=channel_axis, name=name)(ip)
+
+        return BatchNormalization(axis=channel_axis, mode=self.mode, name=name)(ip)
+
+    def _upscale_block(self, ip, id, factor=2):
         '''
         As per suggestion from http://distill.pub/2016/deconv-checkerboard/, I am swapping out
         SubPixelConvolution to simple Nearest Neighbour Upsampling
@@ -285,14 +435,28 @@ class GenerativeNetwork:
         x = Convolution2D(128, 3, 3, activation="linear", border_mode='same', name='sr_res_upconv1_%d' % id,
                           init=self.init)(init)
         x = LeakyReLU(alpha=0.25, name='sr_res_up_lr_%d_1_1' % id)(x)
-        x = UpSampling2D(name='sr_res_upscale_%d' % id)(x)
-        #x = SubPixelUpscaling(r=2, channels=32)(x)
+        x = UpSampling2D(size=(factor, factor), name='sr_res_upscale_%d' % id)(x)
         x = Convolution2D(128, 3, 3, activation="linear", border_mode='same', name='sr_res_filter1_%d' % id,
                           init=self.init)(x)
         x = LeakyReLU(alpha=0.3, name='sr_res_up_lr_%d_1_2' % id)(x)
 
         return x
 
+    def _subpixel_upscale_block(self, ip, id, factor=2):
+        '''
+        Upscales by factor with the convolution applied in the low resolution space.
+        The 32 * factor ** 2 output channels (128 for 2x) are rearranged into 32 channels at factor
+        times the resolution, so no convolution is run at the upscaled resolution.
+        '''
+        init = ip
+
+        x = Convolution2D(32 * factor ** 2, 3, 3, activation="linear", border_mode='same',
+                          name='sr_res_upconv1_%d' % id, init=self.init)(init)
+        x = LeakyReLU(alpha=0.25, name='sr_res_up_lr_%d_1_1' % id)(x)
+        x = SubPixelUpscaling(r=factor, channels=32, name='sr_res_upscale_%d' % id)(x)
+
+        return x
+
     def set_trainable(self, model, value=True):
         if self.sr_res_layers is None:
             self.sr_res_layers = [layer for layer in model.layers
@@ -313,11 +477,36 @@ class GenerativeNetwork:
 
 class SRGANNetwork:
 
-    def __init__(self, img_width=96, img_height=96, batch_size=16, nb_scales=2):
+    def __init__(self, img_width=96, img_height=96, batch_size=16, nb_scales=2, upscale_type='nearest',
+                 discriminator_head='dense', discriminator_global_pooling=False, normalization='batch',
+                 patch_sampling=False, crops_per_decode=4, reuse_window=8, content_filter=None, scale=None):
+        '''
+        Args:
+            scale: upscaling factor (eg. 2, 3 or 4), which overrides nb_scales (scale 2 ** nb_scales). The high
+                resolution training images, the VGG and discriminator inputs and the validation images are
+                img_width * scale x img_height * scale.
+            patch_sampling: train on random crops of the training images at their native resolution instead
+                of the whole images resized to the training size (see image_loader.RandomPatchIterator).
+                Validation images and cached (fake sample or teacher cache) training streams always use whole
+                images.
+            crops_per_decode: number of crops drawn from every decoded training image (patch_sampling only).
+            reuse_window: number of decoded training images crops are drawn from (patch_sampling only).
+            content_filter: optional content_filter.ContentFilter which rejects most of the flat training
+                crops (patch_sampling only).
+        '''
         self.img_width = img_width
         self.img_height = img_height
         self.batch_size = batch_size
-        self.nb_scales = nb_scales
+        self.scale = scale if scale is not None else 2 ** nb_scales
+        self.nb_scales = len(upscale_factors(self.scale))
+        self.upscale_type = upscale_type
+        self.discriminator_head = discriminator_head
+        self.discriminator_global_pooling = discriminator_global_pooling
+        self.normalization = normalization
+        self.patch_sampling = patch_sampling
+        self.crops_per_decode = crops_per_decode
+        self.reuse_window = reuse_window
+        self.content_filter = content_filter
 
         self.discriminative_network = None # type: DiscriminatorNetwork
         self.generative_network = None # type: GenerativeNetwork
@@ -327,47 +516,90 @@ class SRGANNetwork:
         self.generative_model_ = None # type: Model
         self.discriminative_model_ = None #type: Model
 
-    def build_srgan_pretrain_model(self, use_small_srgan=False):
-        large_width = self.img_width * 4
-        large_height = self.img_height * 4
+        self.teacher_network = None # type: GenerativeNetwork
+        self.teacher_model_ = None # type: Model
+
+    def autotune(self, mode, memory_budget_mb, img_sizes=(16, 24, 32, 48, 64), batch_sizes=(1, 2, 4, 8, 16, 32, 64),
+                 nb_steps=5):
+        '''
+        Measures candidate image and batch sizes of a training mode on synthetic images, and sets
+        img_width, img_height and batch_size to the fastest configuration which fits in the memory budget.
+        Call it before building the models (eg. before pre_train_srgan or train_full_model).
 
-        self.generative_network = GenerativeNetwork(self.img_width, self.img_height, self.batch_size, self.nb_scales,
-                                                    use_small_srgan)
+        Note that pre_train_discriminator sets its own batch size, so the tuned batch_size
+        should be passed to it.
+
+        Returns:
+            the best configuration (see autotune.autotune), or None if no configuration fits.
+        '''
+        network_kwargs = {'scale': self.scale,
+                          'upscale_type': self.upscale_type,
+                          'discriminator_head': self.discriminator_head,
+                          'discriminator_global_pooling': self.discriminator_global_pooling,
+                          'normalization': self.normalization}
+
+        best, _ = autotune(mode, memory_budget_mb, img_sizes=img_sizes, batch_sizes=batch_sizes, nb_steps=nb_steps,
+                           network_kwargs=network_kwargs)
+
+        if best is not None:
+            self.img_width = best['img_width']
+            self.img_height = best['img_height']
+            self.batch_size = best['batch_size']
+
+        return best
+
+    def build_srgan_pretrain_model(self, use_small_srgan=False, per_image_loss=False):
+        '''
+        Args:
+            per_image_loss: the model outputs the content loss of every image, to be trained with sample
+                weights (priority sampling). Otherwise the content loss is a regularizer of the VGG network.
+        '''
+        large_width = self.img_width * self.scale
+        large_height = self.img_height * self.scale
+
+        self.generative_network = GenerativeNetwork(self.img_width, self.img_height, self.batch_size, scale=self.scale,
+                                                    small_model=use_small_srgan, upscale_type=self.upscale_type,
+                                                    normalization=self.normalization)
         self.vgg_network = VGGNetwork(large_width, large_height)
 
-        ip = Input(shape=(3, self.img_width, self.img_height), name='x_generator')
-        ip_vgg = Input(shape=(3, large_width, large_height), name='x_vgg')  # Actual X images
+        ip = Input(shape=image_shape(self.img_width, self.img_height), name='x_generator')
+        ip_vgg = Input(shape=image_shape(large_width, large_height), name='x_vgg')  # Actual X images
 
         sr_output = self.generative_network.create_sr_model(ip)
         self.generative_model_ = Model(ip, sr_output)
 
-        vgg_output = self.vgg_network.append_vgg_network(sr_output, ip_vgg, pre_train=True)
+        vgg_output = self.vgg_network.append_vgg_network(sr_output, ip_vgg, pre_train=True,
+                                                         per_image_loss=per_image_loss)
 
         self.srgan_model_ = Model(input=[ip, ip_vgg],
                                   output=vgg_output)
 
-        self.vgg_network.load_vgg_weight(self.srgan_model_)
+        self.vgg_network.load_vgg_weight(self.srgan_model_, up_to_block=2 if per_image_loss else 5)
 
         srgan_optimizer = Adam(lr=1e-4)
         generator_optimizer = Adam(lr=1e-4)
 
         self.generative_model_.compile(generator_optimizer, dummy_loss)
-        self.srgan_model_.compile(srgan_optimizer, dummy_loss)
+        self.srgan_model_.compile(srgan_optimizer, identity_loss if per_image_loss else dummy_loss)
 
         return self.srgan_model_
 
 
     def build_discriminator_pretrain_model(self, use_small_srgan=False, use_small_discriminator=False):
-        large_width = self.img_width * 4
-        large_height = self.img_height * 4
+        large_width = self.img_width * self.scale
+        large_height = self.img_height * self.scale
 
-        self.generative_network = GenerativeNetwork(self.img_width, self.img_height, self.batch_size, self.nb_scales,
-                                                    use_small_srgan)
+        self.generative_network = GenerativeNetwork(self.img_width, self.img_height, self.batch_size, scale=self.scale,
+                                                    small_model=use_small_srgan, upscale_type=self.upscale_type,
+                                                    normalization=self.normalization)
         self.discriminative_network = DiscriminatorNetwork(large_width, large_height,
-                                                           small_model=use_small_discriminator)
+                                                           small_model=use_small_discriminator,
+                                                           head=self.discriminator_head,
+                                                           global_pooling=self.discriminator_global_pooling,
+                                                           normalization=self.normalization)
 
-        ip = Input(shape=(3, self.img_width, self.img_height), name='x_generator')
-        ip_gan = Input(shape=(3, large_width, large_height), name='x_discriminator')  # Actual X images
+        ip = Input(shape=image_shape(self.img_width, self.img_height), name='x_generator')
+        ip_gan = Input(shape=image_shape(large_width, large_height), name='x_discriminator')  # Actual X images
 
         sr_output = self.generative_network.create_sr_model(ip)
         self.generative_model_ = Model(ip, sr_output)
@@ -386,8 +618,9 @@ class SRGANNetwork:
         discriminator_optimizer = Adam(lr=1e-4)
 
         self.generative_model_.compile(generator_optimizer, loss='mse')
-        self.discriminative_model_.compile(discriminator_optimizer, loss='categorical_crossentropy', metrics=['acc'])
-        self.srgan_model_.compile(srgan_optimizer, loss='categorical_crossentropy', metrics=['acc'])
+        self.discriminative_model_.compile(discriminator_optimizer, loss=self.discriminative_network.loss,
+                                           metrics=['acc'])
+        self.srgan_model_.compile(srgan_optimizer, loss=self.discriminative_network.loss, metrics=['acc'])
 
 
 
@@ -395,18 +628,22 @@ class SRGANNetwork:
 
 
     def build_srgan_model(self, use_small_srgan=False, use_small_discriminator=False):
-        large_width = self.img_width * 4
-        large_height = self.img_height * 4
+        large_width = self.img_width * self.scale
+        large_height = self.img_height * self.scale
 
-        self.generative_network = GenerativeNetwork(self.img_width, self.img_height, self.batch_size, nb_upscales=self.nb_scales,
-                                                    small_model=use_small_srgan)
+        self.generative_network = GenerativeNetwork(self.img_width, self.img_height, self.batch_size, scale=self.scale,
+                                                    small_model=use_small_srgan, upscale_type=self.upscale_type,
+                                                    normalization=self.normalization)
         self.discriminative_network = DiscriminatorNetwork(large_width, large_height,
-                                                           small_model=use_small_discriminator)
+                                                           small_model=use_small_discriminator,
+                                                           head=self.discriminator_head,
+                                                           global_pooling=self.discriminator_global_pooling,
+                                                           normalization=self.normalization)
         self.vgg_network = VGGNetwork(large_width, large_height)
 
-        ip = Input(shape=(3, self.img_width, self.img_height), name='x_generator')
-        ip_gan = Input(shape=(3, large_width, large_height), name='x_discriminator') # Actual X images
-        ip_vgg = Input(shape=(3, large_width, large_height), name='x_vgg') # Actual X images
+        ip = Input(shape=image_shape(self.img_width, self.img_height), name='x_generator')
+        ip_gan = Input(shape=image_shape(large_width, large_height), name='x_discriminator') # Actual X images
+        ip_vgg = Input(shape=image_shape(large_width, large_height), name='x_vgg') # Actual X images
 
         sr_output = self.generative_network.create_sr_model(ip)
         self.generative_model_ = Model(ip, sr_output)
@@ -426,40 +663,186 @@ class SRGANNetwork:
         discriminator_optimizer = Adam(lr=1e-4)
 
         self.generative_model_.compile(generator_optimizer, dummy_loss)
-        self.discriminative_model_.compile(discriminator_optimizer, loss='categorical_crossentropy', metrics=['acc'])
+        self.discriminative_model_.compile(discriminator_optimizer, loss=self.discriminative_network.loss,
+                                           metrics=['acc'])
         self.srgan_model_.compile(srgan_optimizer, dummy_loss)
 
         return self.srgan_model_
 
 
-    def pre_train_srgan(self, image_dir, nb_images=50000, nb_epochs=1, use_small_srgan=False):
-        self.build_srgan_pretrain_model(use_small_srgan=use_small_srgan)
+    def build_distillation_model(self, teacher_weights_path=None, teacher_kwargs=None, output_weight=1.0,
+                                 feature_weight=1.0):
+        '''
+        Builds the frozen full size generator (teacher) and the small generator (student) which is
+        trained to reproduce the teacher outputs and the teacher features after the last residual block.
+
+        The student weights are saved to weights/SRGAN_small.h5 (SRGAN_small_x<scale>.h5 if the scale is not 4),
+        so that the teacher weights are not overwritten.
+
+        Args:
+            teacher_weights_path: weights of the teacher generator. Defaults to weights/SRGAN.h5
+            teacher_kwargs: additional GenerativeNetwork arguments of the teacher (eg. of a pruned generator).
+            output_weight: weight of the MSE between the student and teacher outputs (on the [0 - 1] scale).
+            feature_weight: weight of the MSE between the student and teacher features.
+        '''
+        teacher_kwargs = teacher_kwargs if teacher_kwargs is not None else {}
+
+        self.teacher_network = GenerativeNetwork(self.img_width, self.img_height, self.batch_size,
+                                                 scale=self.scale, upscale_type=self.upscale_type,
+                                                 normalization=self.normalization, **teacher_kwargs)
+        self.generative_network = GenerativeNetwork(self.img_width, self.img_height, self.batch_size,
+                                                    scale=self.scale, small_model=True,
+                                                    upscale_type=self.upscale_type, normalization=self.normalization)
+        self.generative_network.set_weights_name("SRGAN_small")
+
+        assert self.teacher_network.filters == self.generative_network.filters, \
+            "The teacher and student generators must have the same number of trunk channels"
+
+        if teacher_weights_path is None:
+            teacher_weights_path = self.teacher_network.sr_weights_path
+
+        ip_teacher = Input(shape=image_shape(self.img_width, self.img_height), name='x_teacher')
+        teacher_model = Model(ip_teacher, self.teacher_network.create_sr_model(ip_teacher))
+        teacher_model.load_weights(teacher_weights_path)
+        print("Teacher generator weights loaded from %s" % teacher_weights_path)
+
+        teacher_features = teacher_model.get_layer('sr_res_merge_%d' % self.teacher_network.nb_residual).output
+        self.teacher_model_ = Model(ip_teacher, [teacher_model.output, teacher_features])
+
+        ip = Input(shape=image_shape(self.img_width, self.img_height), name='x_generator')
+
+        sr_output = self.generative_network.create_sr_model(ip)
+        self.generative_model_ = Model(ip, sr_output)
+
+        student_features = self.generative_model_.get_layer('sr_res_merge_%d' %
+                                                            self.generative_network.nb_residual).output
+        self.srgan_model_ = Model(ip, [sr_output, student_features])
+
+        generator_optimizer = Adam(lr=1e-4)
+        distillation_optimizer = Adam(lr=1e-4)
+
+        self.generative_model_.compile(generator_optimizer, dummy_loss)
+        # Generator outputs are on the [0 - 255] scale
+        self.srgan_model_.compile(distillation_optimizer, loss=['mse', 'mse'],
+                                  loss_weights=[output_weight / 255. ** 2, feature_weight])
+
+        return self.srgan_model_
+
+    def pre_train_srgan(self, image_dir, nb_images=50000, nb_epochs=1, use_small_srgan=False, validation_dir=None,
+                        nb_validation_images=100, validation_interval=50, validation_seconds=None,
+                        priority_sampling=False, priority_state_path="weights/priority_state_srgan.npz"):
+        '''
+        Args:
+            validation_dir: optional directory of held out validation images. See _train_model.
+            priority_sampling: sample the training images by their last content loss. See _train_model.
+            priority_state_path: path where the priority state is saved and restored from.
+        '''
+        self.build_srgan_pretrain_model(use_small_srgan=use_small_srgan, per_image_loss=priority_sampling)
 
         self._train_model(image_dir, nb_images=nb_images, nb_epochs=nb_epochs, pre_train_srgan=True,
-                          load_generative_weights=True)
+                          load_generative_weights=True, validation_dir=validation_dir,
+                          nb_validation_images=nb_validation_images, validation_interval=validation_interval,
+                          validation_seconds=validation_seconds, priority_sampling=priority_sampling,
+                          priority_state_path=priority_state_path)
 
     def pre_train_discriminator(self, image_dir, nb_images=50000, nb_epochs=1, batch_size=128,
-                                use_small_discriminator=False):
+                                use_small_discriminator=False, fake_cache_dir=None):
+        '''
+        Args:
+            fake_cache_dir: optional directory in which the outputs of the frozen generator are cached.
+                Later epochs and reruns with the same generator weights read the fake samples from the
+                cache instead of running the generator. The cache requires whole images (no patch sampling),
+                and in memory image arrays are not shuffled when it is used.
+        '''
 
         self.batch_size = batch_size
         self.build_discriminator_pretrain_model(use_small_discriminator)
 
         self._train_model(image_dir, nb_images, nb_epochs, pre_train_discriminator=True,
-                          load_generative_weights=True)
+                          load_generative_weights=True, fake_cache_dir=fake_cache_dir)
 
     def train_full_model(self, image_dir, nb_images=50000, nb_epochs=10, use_small_srgan=False,
-                         use_small_discriminator=False):
+                         use_small_discriminator=False, discriminator_scheduler=None, validation_dir=None,
+                         nb_validation_images=100, validation_interval=50, validation_seconds=None):
+        '''
+        Args:
+            discriminator_scheduler: optional DiscriminatorScheduler which decides on every step
+                whether to update the discriminator, the generator or both. If None, both are
+                updated on every step.
+            validation_dir: optional directory of held out validation images. See _train_model.
+        '''
 
         self.build_srgan_model(use_small_srgan, use_small_discriminator)
 
-        self._train_model(image_dir, nb_images, nb_epochs, load_generative_weights=True, load_discriminator_weights=True)
+        self._train_model(image_dir, nb_images, nb_epochs, load_generative_weights=True, load_discriminator_weights=True,
+                          discriminator_scheduler=discriminator_scheduler, validation_dir=validation_dir,
+                          nb_validation_images=nb_validation_images, validation_interval=validation_interval,
+                          validation_seconds=validation_seconds)
+
+    def distill_small_model(self, image_dir, nb_images=50000, nb_epochs=1, teacher_weights_path=None,
+                            teacher_kwargs=None, output_weight=1.0, feature_weight=1.0, teacher_cache_dir=None,
+                            validation_dir=None, nb_validation_images=100, validation_interval=50,
+                            validation_seconds=None, priority_sampling=False,
+                            priority_state_path="weights/priority_state_distill.npz"):
+        '''
+        Trains the small generator (small_model=True) on the outputs and features of the frozen full size
+        generator. See build_distillation_model.
+
+        Args:
+            teacher_cache_dir: optional directory in which the teacher outputs and features are cached, so
+                that the teacher runs only once per image (over all epochs and reruns with the same teacher).
+                The cache requires whole images, and in memory image arrays are not shuffled when it is used.
+            validation_dir: optional directory of held out validation images. See _train_model.
+            priority_sampling: sample the training images by their last output loss. See _train_model.
+            priority_state_path: path where the priority state is saved and restored from.
+        '''
+        self.build_distillation_model(teacher_weights_path, teacher_kwargs, output_weight, feature_weight)
+
+        self._train_model(image_dir, nb_images, nb_epochs, distill=True, load_generative_weights=True,
+                          teacher_cache_dir=teacher_cache_dir, validation_dir=validation_dir,
+                          nb_validation_images=nb_validation_images, validation_interval=validation_interval,
+                          validation_seconds=validation_seconds, priority_sampling=priority_sampling,
+                          priority_state_path=priority_state_path)
 
     def _train_model(self, image_dir, nb_images=80000, nb_epochs=10, pre_train_srgan=False,
                      pre_train_discriminator=False, load_generative_weights=False, load_discriminator_weights=False,
-                     save_loss=True, disc_train_flip=0.1):
+                     save_loss=True, disc_train_flip=0.1, discriminator_scheduler=None, fake_cache_dir=None,
+                     save_weights=True, validation_dir=None, nb_validation_images=100, validation_interval=50,
+                     validation_seconds=None, validation_batch_size=32, validation_cache_path=None, distill=False,
+                     teacher_cache_dir=None, priority_sampling=False, priority_state_path=None,
+                     priority_refresh_interval=200, priority_refresh_size=None):
+        '''
+        Args:
+            image_dir: path to the directory of training images, a DatasetManifest of the training images,
+                or a numpy array of high resolution images [0 - 255 scale] (eg. synthetic images for benchmarks).
+            save_weights: save the model weights periodically and at the end of training.
+            validation_dir: directory (or DatasetManifest or numpy array) of held out validation images. The LR / HR validation
+                tensors are prepared once, and the generator is evaluated on them in batches every
+                validation_interval training steps (and / or every validation_seconds seconds). The best
+                generator weights (by validation PSNR) are saved separately. If None, a training batch is
+                used as a rough validation check every 50 images instead.
+            nb_validation_images: number of validation images used.
+            validation_batch_size: batch size used to evaluate the validation set.
+            validation_cache_path: optional path prefix under which the prepared validation tensors are stored,
+                so that they are memory mapped instead of being recomputed on the next run.
+            distill: train the student generator of build_distillation_model on the teacher outputs.
+            teacher_cache_dir: directory in which the teacher outputs and features are cached (distill only).
+            priority_sampling: draw the training images with a probability increasing with their last per image
+                loss (see priority_sampler.py) instead of passes over the shuffled images (pre_train_srgan and
+                distill only, whole images only). The per image loss is the training loss of every image (the
+                content loss of a model built with build_srgan_pretrain_model(per_image_loss=True), or the
+                distillation loss), returned by the training step itself. The importance weights are passed as
+                sample weights.
+            priority_state_path: path of the priority state, restored at the start of training and saved with
+                the model weights. A state saved for another image list is ignored.
+            priority_refresh_interval: every priority_refresh_interval steps, the losses of the
+                priority_refresh_size images with the oldest losses (default 4 batches) are recomputed.
+        '''
 
         assert self.img_width >= 16, "Minimum image width must be at least 16"
         assert self.img_height >= 16, "Minimum image height must be at least 16"
+        assert not priority_sampling or pre_train_srgan or distill, \
+            "Priority sampling is only supported when pre training the generator or distilling"
 
         if load_generative_weights:
             try:
@@ -476,17 +859,26 @@ class SRGANNetwork:
                 print("Could not load discriminator weights.")
 
         datagen = ImageDataGenerator(rescale=1. / 255)
-        img_width = self.img_width * 4
-        img_height = self.img_height * 4
+        img_width = self.img_width * self.scale
+        img_height = self.img_height * self.scale
 
         early_stop = False
         iteration = 0
         prev_improvement = -1
 
+        # Last seen losses, reported on steps where the scheduler skips a network
+        discriminator_loss = generative_loss = 0.0
+
+        loss_history = None
         if save_loss:
             if pre_train_srgan:
                 loss_history = {'generator_loss' : [],
                                 'val_psnr' : [], }
+            elif distill:
+                loss_history = {'distillation_loss' : [],
+                                'output_loss' : [],
+                                'feature_loss' : [],
+                                'val_psnr' : [], }
             elif pre_train_discriminator:
                 loss_history = {'discriminator_loss' : [],
                                 'discriminator_acc' : [], }
@@ -494,37 +886,102 @@ class SRGANNetwork:
                 loss_history = {'discriminator_loss' : [],
                                 'discriminator_acc' : [],
                                 'generator_loss' : [],
-                                'val_psnr': [], }
+                                'val_psnr': [],
+                                'scheduler_decisions': [], }
+
+        y_vgg_dummy = np.zeros((self.batch_size * 2,) + image_shape(img_width // 32, img_height // 32)) # 5 Max Pools = 2 ** 5 = 32
 
-        y_vgg_dummy = np.zeros((self.batch_size * 2, 3, img_width // 32, img_height // 32)) # 5 Max Pools = 2 ** 5 = 32
+        validation_set = None
+        if validation_dir is not None and not pre_train_discriminator:
+            validation_set = self._prepare_validation_set(datagen, validation_dir, nb_validation_images,
+                                                          validation_cache_path)
+
+            if save_loss:
+                loss_history['val_psnr_iteration'] = []
+
+        best_val_psnr = None
+        last_validation_time = time.time()
+        nb_steps = 0
 
         print("Training SRGAN network")
+        fake_cache = None
+        use_fake_cache = pre_train_discriminator and fake_cache_dir is not None
+
+        teacher_caches = None
+        use_teacher_cache = distill and teacher_cache_dir is not None
+
+        priority_sampler = None
+        if priority_sampling:
+            assert not pre_train_srgan or self.srgan_model_.output_shape == (None, 1), \
+                "Priority sampling requires a model built with build_srgan_pretrain_model(per_image_loss=True)"
+
+            # Returns the loss of every image of the batch along with the training losses
+            priority_train = per_sample_train_function(self.srgan_model_)
+            priority_loss = per_sample_loss_function(self.srgan_model_)
+            priority_refresh_size = priority_refresh_size or self.batch_size * 4
+
         for i in range(nb_epochs):
             print()
             print("Epoch : %d" % (i + 1))
 
-            for x in datagen.flow_from_directory(image_dir, class_mode=None, batch_size=self.batch_size,
-                                                 target_size=(img_width, img_height)):
+            # The caches identify images by their index in the image list (batch_indices of directory and manifest
+            # streams), or by their position in an unshuffled in memory array
+            use_cache = use_fake_cache or use_teacher_cache
+            image_flow = self._image_flow(datagen, image_dir, target_size=(img_width, img_height),
+                                          shuffle=not (use_cache and isinstance(image_dir, np.ndarray)),
+                                          whole_images=priority_sampling or use_cache)
+            image_position = 0
+
+            if priority_sampling:
+                assert isinstance(image_flow, DirectoryImageIterator), \
+                    "Priority sampling requires a directory or a DatasetManifest of training images"
+
+                if priority_sampler is None:
+                    fingerprint = dataset_fingerprint(image_flow.filenames, image_flow.directory)
+                    priority_sampler = PrioritySampler(len(image_flow.filenames), beta_steps=nb_images * nb_epochs,
+                                                       fingerprint=fingerprint)
+                    if priority_state_path is not None and priority_sampler.load(priority_state_path):
+                        print("Priority state loaded from %s" % priority_state_path)
+
+                # Draws the images of every batch from the priorities (the caches use the drawn indices)
+                image_flow.sampler = priority_sampler
+
+            if use_fake_cache and fake_cache is None:
+                generator_hash = weights_hash(self.generative_model_)
+                fake_cache = FakeSampleCache(fake_cache_dir, generator_hash, self.generative_model_.output_shape[1:],
+                                             capacity=image_flow.N)
+
+            if use_teacher_cache and teacher_caches is None:
+                # Teacher outputs are stored as uint8 images, teacher features as float16
+                teacher_hash = weights_hash(self.teacher_model_)
+                teacher_caches = [FakeSampleCache(teacher_cache_dir, teacher_hash, output_shape[1:],
+                                                  capacity=image_flow.N, dtype=dtype)
+                                  for output_shape, dtype in zip(self.teacher_model_.output_shape,
+                                                                 ['uint8', 'float16'])]
+
+            for x in image_flow:
                 try:
                     t1 = time.time()
 
-                    if not pre_train_srgan and not pre_train_discriminator:
-                        x_vgg = x.copy() * 255 # VGG input [0 - 255 scale]
-
-                    # resize images
-                    x_temp = x.copy()
-                    x_temp = x_temp.transpose((0, 2, 3, 1))
+                    X_cached = None
+                    if use_cache and isinstance(image_flow, DirectoryImageIterator):
+                        image_ids = [self._image_id(image_flow, index) for index in image_flow.batch_indices]
+                    elif use_cache:
+                        image_ids = [self._image_id(image_flow, (image_position + k) % image_flow.N)
+                                     for k in range(x.shape[0])]
+                        image_position += x.shape[0]
 
-                    x_generator = np.empty((self.batch_size, self.img_width, self.img_height, 3))
+                    if use_fake_cache:
+                        X_cached = fake_cache.get(image_ids)
 
-                    for j in range(self.batch_size):
-                        img = gaussian_filter(x_temp[j], sigma=0.1)
-                        img = imresize(img, (self.img_width, self.img_height), interp='bicubic')
-                        x_generator[j, :, :, :] = img
+                    if not pre_train_srgan and not pre_train_discriminator and not distill:
+                        x_vgg = x.copy() * 255 # VGG input [0 - 255 scale]
 
-                    x_generator = x_generator.transpose((0, 3, 1, 2))
+                    # resize images (not needed when the fake samples are already cached)
+                    if X_cached is None:
+                        x_generator = self._downscale_batch(x)
 
-                    if iteration % 50 == 0 and iteration != 0 and not pre_train_discriminator:
+                    if iteration % 50 == 0 and iteration != 0 and not pre_train_discriminator and validation_set is None:
                         print("Validation image..")
                         output_image_batch = self.generative_network.get_generator_output(x_generator,
                                                                                           self.srgan_model_)
@@ -559,11 +1016,11 @@ class SRGANNetwork:
                                                                                                         x_i + 1)
 
                             val_x = x[x_i].copy() * 255.
-                            val_x = val_x.transpose((1, 2, 0))
+                            val_x = to_channels_last(val_x)
                             val_x = np.clip(val_x, 0, 255).astype('uint8')
 
                             output_image = output_image_batch[x_i]
-                            output_image = output_image.transpose((1, 2, 0))
+                            output_image = to_channels_last(output_image)
                             output_image = np.clip(output_image, 0, 255).astype('uint8')
 
                             imsave(real_path, val_x)
@@ -582,14 +1039,20 @@ class SRGANNetwork:
 
                     if pre_train_srgan:
                         # Train only generator + vgg network
-
-                        # Use custom bypass_fit to bypass the check for same input and output batch size
-                        hist = bypass_fit(self.srgan_model_, [x_generator, x * 255], y_vgg_dummy,
-                                                     batch_size=self.batch_size, nb_epoch=1, verbose=0)
-                        sr_loss = hist.history['loss'][0]
+                        if priority_sampler is not None:
+                            y_content_dummy = np.zeros((x.shape[0], 1))
+                            losses, image_losses = priority_train([x_generator, x * 255], [y_content_dummy],
+                                                                  [image_flow.batch_weights])
+                            priority_sampler.update(image_flow.batch_indices, image_losses)
+                            sr_loss = float(losses[0])
+                        else:
+                            # Use custom bypass_fit to bypass the check for same input and output batch size
+                            hist = bypass_fit(self.srgan_model_, [x_generator, x * 255], y_vgg_dummy,
+                                                         batch_size=self.batch_size, nb_epoch=1, verbose=0)
+                            sr_loss = hist.history['loss'][0]
 
                         if save_loss:
-                            loss_history['generator_loss'].extend(hist.history['loss'])
+                            loss_history['generator_loss'].append(sr_loss)
 
                         if prev_improvement == -1:
                             prev_improvement = sr_loss
@@ -602,9 +1065,61 @@ class SRGANNetwork:
 
                         print("Iter : %d / %d | Improvement : %0.2f percent | Time required : %0.2f seconds | "
                               "Generative Loss : %0.2f" % (iteration, nb_images, improvement, t2 - t1, sr_loss))
+                    elif distill:
+                        # Train only the student generator on the (cached) teacher outputs and features
+                        y_teacher = None
+                        if use_teacher_cache:
+                            y_teacher = [cache.get(image_ids) for cache in teacher_caches]
+                            if any(y is None for y in y_teacher):
+                                y_teacher = None
+
+                        if y_teacher is None:
+                            y_teacher = self.teacher_model_.predict(x_generator, self.batch_size)
+
+                            if use_teacher_cache:
+                                for cache, y in zip(teacher_caches, y_teacher):
+                                    cache.put(image_ids, y)
+
+                        if priority_sampler is not None:
+                            losses, image_losses = priority_train([x_generator], y_teacher,
+                                                                  [image_flow.batch_weights] * len(y_teacher))
+                            priority_sampler.update(image_flow.batch_indices, image_losses)
+                            distillation_loss, output_loss, feature_loss = [float(loss) for loss in losses[:3]]
+                        else:
+                            hist = self.srgan_model_.fit(x_generator, y_teacher, batch_size=self.batch_size,
+                                                         nb_epoch=1, verbose=0)
+
+                            distillation_loss = hist.history['loss'][0]
+                            output_loss, feature_loss = [hist.history[name + '_loss'][0]
+                                                         for name in self.srgan_model_.output_names]
+
+                        if save_loss:
+                            loss_history['distillation_loss'].append(distillation_loss)
+                            loss_history['output_loss'].append(output_loss)
+                            loss_history['feature_loss'].append(feature_loss)
+
+                        if prev_improvement == -1:
+                            prev_improvement = distillation_loss
+
+                        improvement = (prev_improvement - distillation_loss) / prev_improvement * 100
+                        prev_improvement = distillation_loss
+
+                        iteration += self.batch_size
+                        t2 = time.time()
+
+                        print("Iter : %d / %d | Improvement : %0.2f percent | Time required : %0.2f seconds | "
+                              "Distillation Loss : %0.4f | Output Loss : %0.2f | Feature Loss : %0.4f" %
+                              (iteration, nb_images, improvement, t2 - t1, distillation_loss, output_loss,
+                               feature_loss))
                     elif pre_train_discriminator:
                         # Train only discriminator
-                        X_pred = self.generative_model_.predict(x_generator, self.batch_size)
+                        if X_cached is not None:
+                            X_pred = X_cached
+                        else:
+                            X_pred = self.generative_model_.predict(x_generator, self.batch_size)
+
+                            if use_fake_cache:
+                                fake_cache.put(image_ids, X_pred)
 
                         X = np.concatenate((X_pred, x * 255))
 
@@ -619,6 +1134,7 @@ class SRGANNetwork:
                         y_gan = np.asarray(y_gan, dtype=np.int).reshape(-1, 1)
                         y_gan = to_categorical(y_gan, nb_classes=2)
                         y_gan = smooth_gan_labels(y_gan)
+                        y_gan = patch_gan_labels(y_gan, self.discriminative_model_.output_shape)
 
                         hist = self.discriminative_model_.fit(X, y_gan, batch_size=self.batch_size,
                                                               nb_epoch=1, verbose=0)
@@ -645,56 +1161,73 @@ class SRGANNetwork:
                                                             discriminator_loss, discriminator_acc))
 
                     else:
-                        # Train only discriminator, disable training of srgan
-                        self.discriminative_network.set_trainable(self.srgan_model_, value=True)
-                        self.generative_network.set_trainable(self.srgan_model_, value=False)
+                        if discriminator_scheduler is not None:
+                            train_discriminator, train_generator = discriminator_scheduler.next_step()
+                        else:
+                            train_discriminator, train_generator = True, True
 
-                        # Use custom bypass_fit to bypass the check for same input and output batch size
-                        # hist = bypass_fit(self.srgan_model_, [x_generator, x * 255, x_vgg],
-                        #                          [y_gan, y_vgg_dummy],
-                        #                          batch_size=self.batch_size, nb_epoch=1, verbose=0)
+                        if train_discriminator:
+                            # Train only discriminator, disable training of srgan
+                            self.discriminative_network.set_trainable(self.srgan_model_, value=True)
+                            self.generative_network.set_trainable(self.srgan_model_, value=False)
 
-                        X_pred = self.generative_model_.predict(x_generator, self.batch_size)
+                            # Use custom bypass_fit to bypass the check for same input and output batch size
+                            # hist = bypass_fit(self.srgan_model_, [x_generator, x * 255, x_vgg],
+                            #                          [y_gan, y_vgg_dummy],
+                            #                          batch_size=self.batch_size, nb_epoch=1, verbose=0)
 
-                        X = np.concatenate((X_pred, x * 255))
+                            X_pred = self.generative_model_.predict(x_generator, self.batch_size)
 
-                        # Using soft and noisy labels
-                        if np.random.uniform() > disc_train_flip:
-                            # give correct classifications
-                            y_gan = [0] * self.batch_size + [1] * self.batch_size
-                        else:
-                            # give wrong classifications (noisy labels)
-                            y_gan = [1] * self.batch_size + [0] * self.batch_size
+                            X = np.concatenate((X_pred, x * 255))
 
-                        y_gan = np.asarray(y_gan, dtype=np.int).reshape(-1, 1)
-                        y_gan = to_categorical(y_gan, nb_classes=2)
-                        y_gan = smooth_gan_labels(y_gan)
+                            # Using soft and noisy labels
+                            if np.random.uniform() > disc_train_flip:
+                                # give correct classifications
+                                y_gan = [0] * self.batch_size + [1] * self.batch_size
+                            else:
+                                # give wrong classifications (noisy labels)
+                                y_gan = [1] * self.batch_size + [0] * self.batch_size
 
-                        hist1 = self.discriminative_model_.fit(X, y_gan, verbose=0, batch_size=self.batch_size,
-                                                              nb_epoch=1)
+                            y_gan = np.asarray(y_gan, dtype=np.int).reshape(-1, 1)
+                            y_gan = to_categorical(y_gan, nb_classes=2)
+                            y_gan = smooth_gan_labels(y_gan)
+                            y_gan = patch_gan_labels(y_gan, self.discriminative_model_.output_shape)
 
-                        discriminator_loss = hist1.history['loss'][-1]
+                            hist1 = self.discriminative_model_.fit(X, y_gan, verbose=0, batch_size=self.batch_size,
+                                                                  nb_epoch=1)
 
-                        # Train only generator, disable training of discriminator
-                        self.discriminative_network.set_trainable(self.srgan_model_, value=False)
-                        self.generative_network.set_trainable(self.srgan_model_, value=True)
+                            discriminator_loss = hist1.history['loss'][-1]
 
-                        # Using soft labels
-                        y_model = [1] * self.batch_size
-                        y_model = np.asarray(y_model, dtype=np.int).reshape(-1, 1)
-                        y_model = to_categorical(y_model, nb_classes=2)
-                        y_model = smooth_gan_labels(y_model)
+                            if discriminator_scheduler is not None:
+                                discriminator_scheduler.update(discriminator_loss, hist1.history['acc'][-1])
 
-                        # Use custom bypass_fit to bypass the check for same input and output batch size
-                        hist2 = bypass_fit(self.srgan_model_, [x_generator, x, x_vgg], [y_model, y_vgg_dummy],
-                                           batch_size=self.batch_size, nb_epoch=1, verbose=0)
+                            if save_loss:
+                                loss_history['discriminator_loss'].extend(hist1.history['loss'])
+                                loss_history['discriminator_acc'].extend(hist1.history['acc'])
 
-                        generative_loss = hist2.history['loss'][0]
+                        if train_generator:
+                            # Train only generator, disable training of discriminator
+                            self.discriminative_network.set_trainable(self.srgan_model_, value=False)
+                            self.generative_network.set_trainable(self.srgan_model_, value=True)
 
-                        if save_loss:
-                            loss_history['discriminator_loss'].extend(hist1.history['loss'])
-                            loss_history['discriminator_acc'].extend(hist1.history['acc'])
-                            loss_history['generator_loss'].extend(hist2.history['loss'])
+                            # Using soft labels
+                            y_model = [1] * self.batch_size
+                            y_model = np.asarray(y_model, dtype=np.int).reshape(-1, 1)
+                            y_model = to_categorical(y_model, nb_classes=2)
+                            y_model = smooth_gan_labels(y_model)
+                            y_model = patch_gan_labels(y_model, self.discriminative_model_.output_shape)
+
+                            # Use custom bypass_fit to bypass the check for same input and output batch size
+                            hist2 = bypass_fit(self.srgan_model_, [x_generator, x, x_vgg], [y_model, y_vgg_dummy],
+                                               batch_size=self.batch_size, nb_epoch=1, verbose=0)
+
+                            generative_loss = hist2.history['loss'][0]
+
+                            if save_loss:
+                                loss_history['generator_loss'].extend(hist2.history['loss'])
+
+                        if save_loss and discriminator_scheduler is not None:
+                            loss_history['scheduler_decisions'].append([train_discriminator, train_generator])
 
                         if prev_improvement == -1:
                             prev_improvement = discriminator_loss
@@ -708,11 +1241,55 @@ class SRGANNetwork:
                               "Discriminator Loss : %0.3f | Generative Loss : %0.3f" %
                               (iteration, nb_images, improvement, t2 - t1, discriminator_loss, generative_loss))
 
+                    nb_steps += 1
+
+                    if priority_sampler is not None and nb_steps % priority_refresh_interval == 0:
+                        self._refresh_priorities(priority_sampler, priority_loss, image_flow, priority_refresh_size,
+                                                 distill)
+
+                    if validation_set is not None:
+                        validate = validation_interval is not None and nb_steps % validation_interval == 0
+                        if validation_seconds is not None and time.time() - last_validation_time >= validation_seconds:
+                            validate = True
+
+                        if validate:
+                            last_validation_time = time.time()
+                            val_psnr = self._evaluate_validation_set(validation_set[0], validation_set[1],
+                                                                     validation_batch_size)
+
+                            print("Validation PSNR over %d held out images = %0.3f | Time required : %0.2f seconds" %
+                                  (len(validation_set[0]), val_psnr, time.time() - last_validation_time))
+
+                            if save_loss:
+                                loss_history['val_psnr'].append(val_psnr)
+                                loss_history['val_psnr_iteration'].append(nb_steps)
+
+                            if best_val_psnr is None or val_psnr > best_val_psnr:
+                                best_val_psnr = val_psnr
+
+                                if save_weights:
+                                    print("Saving best generator weights.")
+                                    self.generative_model_.save_weights(self.generative_network.sr_best_weights_path,
+                                                                        overwrite=True)
+
                     if iteration % 1000 == 0 and iteration != 0:
-                        print("Saving model weights.")
-                        # Save predictive (SR network) weights
-                        self._save_model_weights(pre_train_srgan, pre_train_discriminator)
-                        self._save_loss_history(loss_history, pre_train_srgan, pre_train_discriminator, save_loss)
+                        if save_weights:
+                            print("Saving model weights.")
+                            # Save predictive (SR network) weights
+                            self._save_model_weights(pre_train_srgan, pre_train_discriminator, distill)
+
+                        self._save_loss_history(loss_history, pre_train_srgan, pre_train_discriminator, save_loss,
+                                                distill)
+
+                        if fake_cache is not None:
+                            fake_cache.flush()
+
+                        if teacher_caches is not None:
+                            for cache in teacher_caches:
+                                cache.flush()
+
+                        if priority_sampler is not None and priority_state_path is not None:
+                            priority_sampler.save(priority_state_path)
 
                     if iteration >= nb_images:
                         break
@@ -722,31 +1299,236 @@ class SRGANNetwork:
                     early_stop = True
                     break
 
+            if hasattr(image_flow, 'stats'):
+                print("Patch sampler : %d images decoded | %d crops | Decoding time : %0.2f seconds" %
+                      (image_flow.nb_decoded, image_flow.nb_crops, image_flow.decode_time))
+
+                if image_flow.content_filter is not None:
+                    summary = image_flow.content_filter.summary()
+                    print("Content filter : %d / %d candidate patches accepted (%0.1f %%) | %d forced | "
+                          "Median score : %0.2f" % (summary['nb_accepted'], summary['nb_scored'],
+                                                    summary['acceptance_rate'] * 100, summary['nb_forced'],
+                                                    summary.get('score_p50', 0.)))
+
+                    # The filter is shared by the patch samplers of all the epochs
+                    image_flow.content_filter.reset_stats()
+
+            if priority_sampler is not None:
+                summary = priority_sampler.summary()
+                print("Priority sampler : %d / %d images with a known loss | Mean loss : %0.2f | "
+                      "Share of the top 10 %% images : %0.2f | Beta : %0.2f" %
+                      (summary['nb_known'], summary['nb_items'], summary['mean_loss'] or 0.,
+                       summary['top_10_percent_share'], summary['beta']))
+
             iteration = 0
 
             if early_stop:
                 break
 
-        print("Finished training SRGAN network. Saving model weights.")
-        # Save predictive (SR network) weights
-        self._save_model_weights(pre_train_srgan, pre_train_discriminator)
-        self._save_loss_history(loss_history, pre_train_srgan, pre_train_discriminator, save_loss)
+        if discriminator_scheduler is not None:
+            print("Discriminator scheduler summary :", discriminator_scheduler.summary())
+
+        if fake_cache is not None:
+            fake_cache.flush()
+            print("Fake sample cache : %d images cached | %d batch hits | %d batch misses" %
+                  (len(fake_cache), fake_cache.hits, fake_cache.misses))
+
+        if teacher_caches is not None:
+            for cache in teacher_caches:
+                cache.flush()
+            print("Teacher cache : %d images cached | %d batch hits | %d batch misses" %
+                  (len(teacher_caches[0]), teacher_caches[0].hits, teacher_caches[0].misses))
+
+        if priority_sampler is not None and priority_state_path is not None:
+            priority_sampler.save(priority_state_path)
+            print("Priority state saved to %s" % priority_state_path)
 
-    def _save_model_weights(self, pre_train_srgan, pre_train_discriminator):
+        if save_weights:
+            print("Finished training SRGAN network. Saving model weights.")
+            # Save predictive (SR network) weights
+            self._save_model_weights(pre_train_srgan, pre_train_discriminator, distill)
+        else:
+            print("Finished training SRGAN network.")
+
+        self._save_loss_history(loss_history, pre_train_srgan, pre_train_discriminator, save_loss, distill)
+
+    def _prepare_validation_set(self, datagen, validation_dir, nb_validation_images, cache_path=None):
+        '''
+        Creates the LR generator inputs and HR targets of the held out validation set once.
+        Both are stored as uint8 [0 - 255 scale]. If cache_path is given, they are saved as
+        cache_path + '_lr.npy' / '_hr.npy' and memory mapped on later runs, as long as the image
+        size, scale, number of images and validation images (cache_path + '_info.json') still match.
+
+        Every validation image is used at most once, so nb_validation_images is capped to the number
+        of validation images.
+
+        Returns:
+            (x_val_lr, x_val_hr) arrays
+        '''
+        img_width = self.img_width * self.scale
+        img_height = self.img_height * self.scale
+
+        if isinstance(validation_dir, np.ndarray):
+            source = "array %s" % str(validation_dir.shape)
+        elif isinstance(validation_dir, DatasetManifest):
+            source = "manifest %s" % os.path.abspath(validation_dir.db_path)
+        else:
+            source = os.path.abspath(validation_dir)
+
+        info = {'img_width': img_width,
+                'img_height': img_height,
+                'scale': self.scale,
+                'nb_validation_images': nb_validation_images,
+                'source': source}
+
+        if cache_path is not None and os.path.exists(cache_path + "_lr.npy"):
+            cached_info = None
+            if os.path.exists(cache_path + "_info.json"):
+                with open(cache_path + "_info.json", 'r') as f:
+                    cached_info = json.load(f)
+
+            if cached_info == info:
+                print("Loading cached validation set from %s" % cache_path)
+                return np.load(cache_path + "_lr.npy", mmap_mode='r'), np.load(cache_path + "_hr.npy", mmap_mode='r')
+
+            print("Cached validation set %s does not match the current settings. Rebuilding it." % cache_path)
+
+        print("Preparing validation set")
+        image_flow = self._image_flow(datagen, validation_dir, target_size=(img_width, img_height), shuffle=False)
+
+        # The image flows loop over the images forever, so stop after one pass
+        nb_validation_images = min(nb_validation_images, image_flow.N)
+
+        x_val_lr, x_val_hr = [], []
+        nb_prepared = 0
+
+        for x in image_flow:
+            x_val_lr.append(np.clip(self._downscale_batch(x), 0, 255).astype('uint8'))
+            x_val_hr.append(np.clip(x * 255, 0, 255).astype('uint8'))
+
+            nb_prepared += len(x)
+            if nb_prepared >= nb_validation_images:
+                break
+
+        x_val_lr = np.concatenate(x_val_lr)[:nb_validation_images]
+        x_val_hr = np.concatenate(x_val_hr)[:nb_validation_images]
+
+        if cache_path is not None:
+            np.save(cache_path + "_lr.npy", x_val_lr)
+            np.save(cache_path + "_hr.npy", x_val_hr)
+
+            with open(cache_path + "_info.json", 'w') as f:
+                json.dump(info, f)
+
+        print("Validation set prepared : %d images" % len(x_val_hr))
+        return x_val_lr, x_val_hr
+
+    def _evaluate_validation_set(self, x_val_lr, x_val_hr, batch_size=32):
+        ''' Average PSNR of the generator over the validation set, computed in batches '''
+        total_psnr = 0.0
+
+        for i in range(0, len(x_val_lr), batch_size):
+            x_lr = np.asarray(x_val_lr[i: i + batch_size], dtype='float32')
+            x_hr = np.asarray(x_val_hr[i: i + batch_size], dtype='float32') / 255.
+
+            x_sr = self.generative_model_.predict(x_lr, batch_size=len(x_lr))
+            x_sr = np.clip(x_sr, 0, 255) / 255.
+
+            mse = np.mean(np.square(x_sr - x_hr), axis=tuple(range(1, x_hr.ndim)))
+            total_psnr += np.sum(-10. * np.log10(mse))
+
+        return total_psnr / len(x_val_lr)
+
+    def _image_flow(self, datagen, images, target_size, shuffle=True, whole_images=False):
+        '''
+        Iterator over batches of high resolution images [0 - 1 scale], read either from
+        a directory, from the images listed in a DatasetManifest (without scanning the directory)
+        or from an in memory numpy array [0 - 255 scale].
+
+        JPEG images of a directory are decoded at a reduced size when they are larger than
+        the target size (see image_loader.py). With patch_sampling, shuffled directory streams
+        are random crops of the images instead, unless whole_images is set.
+        '''
+        if isinstance(images, np.ndarray):
+            return datagen.flow(images, batch_size=self.batch_size, shuffle=shuffle)
+
+        filenames = None
+        if isinstance(images, DatasetManifest):
+            filenames = images.filenames()
+            images = images.root
+
+        if self.patch_sampling and shuffle and not whole_images:
+            return RandomPatchIterator(images, patch_size=target_size, batch_size=self.batch_size,
+                                       crops_per_decode=self.crops_per_decode, reuse_window=self.reuse_window,
+                                       rescale=datagen.rescale, channels_first=K.image_dim_ordering() == "th",
+                                       filenames=filenames, content_filter=self.content_filter)
+
+        return DirectoryImageIterator(images, target_size=target_size, batch_size=self.batch_size, shuffle=shuffle,
+                                      rescale=datagen.rescale, channels_first=K.image_dim_ordering() == "th",
+                                      filenames=filenames)
+
+    def _refresh_priorities(self, priority_sampler, priority_loss, image_flow, count, distill=False):
+        '''
+        Recomputes the loss of the count images whose priority is the oldest, without training.
+
+        Args:
+            priority_loss: per sample loss function of the SRGAN model (see keras_ops.per_sample_loss_function)
+        '''
+        indices = priority_sampler.stale_indices(count)
+
+        for i in range(0, len(indices), self.batch_size):
+            batch_indices = indices[i: i + self.batch_size]
+            x = image_flow.load_batch(batch_indices)
+            x_generator = self._downscale_batch(x)
+
+            if distill:
+                image_losses = priority_loss([x_generator], self.teacher_model_.predict(x_generator, self.batch_size))
+            else:
+                image_losses = priority_loss([x_generator, x * 255], [np.zeros((x.shape[0], 1))])
+
+            priority_sampler.update(batch_indices, image_losses)
+
+    def _image_id(self, image_flow, index):
+        ''' Stable identifier of the index-th image of the image list of a flow (unshuffled for in memory arrays) '''
+        if hasattr(image_flow, 'filenames'):
+            return image_flow.filenames[index]
+
+        return str(index)
+
+    def _downscale_batch(self, x):
+        '''
+        Creates the low resolution generator inputs [0 - 255 scale] from a batch of
+        high resolution images [0 - 1 scale]
+        '''
+        x_temp = to_channels_last(x)
+
+        x_generator = np.empty((len(x), self.img_width, self.img_height, 3))
+
+        for j in range(len(x)):
+            img = gaussian_filter(x_temp[j], sigma=0.1)
+            img = imresize(img, (self.img_width, self.img_height), interp='bicubic')
+            x_generator[j, :, :, :] = img
+
+        return from_channels_last(x_generator)
+
+    def _save_model_weights(self, pre_train_srgan, pre_train_discriminator, distill=False):
         if not pre_train_discriminator:
             self.generative_model_.save_weights(self.generative_network.sr_weights_path, overwrite=True)
 
-        if not pre_train_srgan:
+        if not pre_train_srgan and not distill:
             # Save GAN (discriminative network) weights
             self.discriminative_network.save_gan_weights(self.discriminative_model_)
 
-    def _save_loss_history(self, loss_history, pre_train_srgan, pre_train_discriminator, save_loss):
+    def _save_loss_history(self, loss_history, pre_train_srgan, pre_train_discriminator, save_loss, distill=False):
         if save_loss:
             print("Saving loss history")
 
             if pre_train_srgan:
                 with open('pretrain losses - srgan.json', 'w') as f:
                     json.dump(loss_history, f)
+            elif distill:
+                with open('distillation losses.json', 'w') as f:
+                    json.dump(loss_history, f)
             elif pre_train_discriminator:
                 with open('pretrain losses - discriminator.json', 'w') as f:
                     json.dump(loss_history, f)
@@ -770,9 +1552,16 @@ if __name__ == "__main__":
 
     Batch size = 1 is slower, but uses the least amount of gpu memory, and also acts as
     Instance Normalization (batch norm with 1 input image) which speeds up training slightly.
+
+    To get the same Instance Normalization behaviour with larger (faster) batch sizes, use
+    SRGANNetwork(img_width=32, img_height=32, batch_size=16, normalization='instance')
     '''
 
     srgan_network = SRGANNetwork(img_width=32, img_height=32, batch_size=1)
+
+    # Alternatively, pick the fastest image size and batch size which fit in 8 GB of memory
+    #srgan_network.autotune('train_full_model', memory_budget_mb=8000)
+
     srgan_network.build_srgan_model()
     #plot(srgan_network.srgan_model_, 'SRGAN.png', show_shapes=True)
 
@@ -782,7 +1571,13 @@ if __name__ == "__main__":
     # Pretrain the discriminator network
     #srgan_network.pre_train_discriminator(coco_path, nb_images=40000, nb_epochs=1, batch_size=16)
 
+    # Distill the pretrained generator into the small generator (saved to weights/SRGAN_small.h5)
+    #srgan_network.distill_small_model(coco_path, nb_images=80000, nb_epochs=5, teacher_cache_dir="cache/teacher/")
+
     # Fully train the SRGAN with VGG loss and Discriminator loss
+    # Optionally skip discriminator updates while the discriminator is saturated
+    #scheduler = DiscriminatorScheduler(n_critic=1, warmup_steps=100, max_disc_acc=0.95)
+    #srgan_network.train_full_model(coco_path, nb_images=80000, nb_epochs=5, discriminator_scheduler=scheduler)
     srgan_network.train_full_model(coco_path, nb_images=80000, nb_epochs=5)
 
 
@@ -0,0 +1,249 @@
+'''
+Loss driven priority sampling of the training images (hard example mining).
+
+The last content loss of every training image is recorded in a compact array indexed by the position of
+the image in the (sorted) image list, eg. a DatasetManifest index. Images are then sampled with a
+probability proportional to priority = (loss + epsilon) ** alpha, using a sum tree (O(log n) updates and
+draws), so images the generator still handles badly are seen more often. The bias this introduces is
+corrected with importance weights w = (N * P(i)) ** -beta / max(w), with beta annealed towards 1.
+
+Priorities of images which have not been seen for a long time are stale. The training loop periodically
+recomputes the loss of the stalest images (see PrioritySampler.stale_indices), and the sampler state is
+saved with the model weights so that a resumed run keeps its priorities. The state records a fingerprint
+of the image list (see dataset_fingerprint), so it is never restored for another dataset of the same size.
+'''
+import os
+import hashlib
+import numpy as np
+
+
+def dataset_fingerprint(filenames, directory=None):
+    ''' Hash of the ordered image list (and of its directory), which the sampler indices refer to '''
+    sha = hashlib.sha1()
+    if directory is not None:
+        sha.update(os.path.abspath(directory).encode('utf-8'))
+
+    for filename in filenames:
+        sha.update(b"\n" + filename.encode('utf-8'))
+
+    return sha.hexdigest()[:16]
+
+
+class SumTree:
+    '''
+    Binary tree in which every node holds the sum of its children, stored as a flat array
+    (node i has children 2i + 1 and 2i + 2, the leaves are the last capacity nodes).
+    '''
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.tree_size = 1
+        while self.tree_size < capacity:
+            self.tree_size *= 2
+
+        self.nodes = np.zeros(2 * self.tree_size - 1, dtype='float64')
+
+    @property
+    def total(self):
+        return self.nodes[0]
+
+    def leaves(self):
+        return self.nodes[self.tree_size - 1: self.tree_size - 1 + self.capacity]
+
+    def update(self, indices, values):
+        ''' Sets the values of the given leaves and updates their ancestors '''
+        indices = np.asarray(indices, dtype='int64')
+        nodes = indices + self.tree_size - 1
+        self.nodes[nodes] = values
+
+        nodes = np.unique(nodes)
+        while nodes[0] > 0:
+            nodes = np.unique((nodes - 1) // 2)
+            self.nodes[nodes] = self.nodes[2 * nodes + 1] + self.nodes[2 * nodes + 2]
+
+    def rebuild(self, values):
+        ''' Sets all the leaves at once '''
+        self.nodes[:] = 0.
+        self.nodes[self.tree_size - 1: self.tree_size - 1 + self.capacity] = values
+
+        level_start = self.tree_size - 1
+        while level_start > 0:
+            parents = np.arange((level_start - 1) // 2, level_start)
+            self.nodes[parents] = self.nodes[2 * parents + 1] + self.nodes[2 * parents + 2]
+            level_start = (level_start - 1) // 2
+
+    def find(self, values):
+        ''' Leaf indices whose cumulative sum interval contains each of the values (in [0, total)) '''
+        if len(values) == 0:
+            return np.zeros(0, dtype='int64')
+
+        nodes = np.zeros(len(values), dtype='int64')
+        values = np.array(values, dtype='float64')
+
+        while nodes[0] < self.tree_size - 1:
+            left = 2 * nodes + 1
+            go_right = values >= self.nodes[left]
+            values -= np.where(go_right, self.nodes[left], 0.)
+            nodes = np.where(go_right, left + 1, left)
+
+        return np.minimum(nodes - (self.tree_size - 1), self.capacity - 1)
+
+
+class PrioritySampler:
+    '''
+    Samples training images with a probability increasing with their last content loss.
+
+    Args:
+        nb_items: number of training images.
+        alpha: priority exponent. 0 is uniform sampling, 1 is proportional to the loss.
+        beta: initial importance weight exponent, annealed linearly to 1 over beta_steps draws.
+        beta_steps: number of sampled images after which beta reaches 1.
+        epsilon: added to the losses, so that no image has a zero probability.
+        uniform_fraction: fraction of every batch sampled uniformly, which bounds the importance weights.
+        fingerprint: optional identity of the image list (see dataset_fingerprint), saved with the state
+            and checked when it is restored.
+
+    Images whose loss is not known yet get the largest priority seen so far, so every image is seen early.
+    '''
+
+    def __init__(self, nb_items, alpha=0.6, beta=0.4, beta_steps=100000, epsilon=1e-3, uniform_fraction=0.1,
+                 fingerprint=None):
+        assert nb_items > 0, "nb_items must be positive"
+        assert 0. <= uniform_fraction < 1., "uniform_fraction must be in the range [0, 1)"
+
+        self.nb_items = nb_items
+        self.alpha = alpha
+        self.beta_start = beta
+        self.beta_steps = beta_steps
+        self.epsilon = epsilon
+        self.uniform_fraction = uniform_fraction
+        self.fingerprint = fingerprint
+
+        self.losses = np.full(nb_items, np.nan, dtype='float32')
+        self.last_update = np.zeros(nb_items, dtype='int64')  # draw counter at the last loss update
+        self.nb_visits = np.zeros(nb_items, dtype='int32')
+        self.nb_draws = 0
+
+        self.max_priority = 1.
+        self.tree = SumTree(nb_items)
+        self.tree.rebuild(np.full(nb_items, self.max_priority))
+
+    @property
+    def beta(self):
+        return min(1., self.beta_start + (1. - self.beta_start) * self.nb_draws / float(max(self.beta_steps, 1)))
+
+    def _priorities(self, losses):
+        return (np.asarray(losses, dtype='float64') + self.epsilon) ** self.alpha
+
+    def sample(self, batch_size, rng=np.random):
+        '''
+        Draws a batch of image indices.
+
+        Returns:
+            (indices, importance weights) arrays of length batch_size. The weights are normalized
+            so that their maximum is 1.
+        '''
+        nb_uniform = int(round(batch_size * self.uniform_fraction))
+        nb_priority = batch_size - nb_uniform
+
+        # Stratified draws : one value in each of nb_priority equal segments of the total priority
+        segment = self.tree.total / max(nb_priority, 1)
+        values = (np.arange(nb_priority) + rng.uniform(size=nb_priority)) * segment
+        indices = np.concatenate([self.tree.find(np.minimum(values, np.nextafter(self.tree.total, 0))),
+                                  rng.randint(self.nb_items, size=nb_uniform)]).astype('int64')
+
+        # Probability of drawing each image under the mixture of priority and uniform sampling
+        probabilities = ((1. - self.uniform_fraction) * self.tree.leaves()[indices] / self.tree.total +
+                         self.uniform_fraction / self.nb_items)
+
+        weights = (self.nb_items * probabilities) ** -self.beta
+        weights /= weights.max()
+
+        self.nb_draws += batch_size
+        self.nb_visits[indices] += 1
+
+        return indices, weights.astype('float32')
+
+    def update(self, indices, losses):
+        ''' Records the latest content losses of the given images and updates their priorities '''
+        indices = np.asarray(indices, dtype='int64')
+        losses = np.asarray(losses, dtype='float32')
+
+        self.losses[indices] = losses
+        self.last_update[indices] = self.nb_draws
+
+        priorities = self._priorities(losses)
+        self.tree.update(indices, priorities)
+
+        if priorities.max() > self.max_priority:
+            # Unseen images keep the largest priority (rare after the first batches)
+            self.max_priority = float(priorities.max())
+            unknown = np.where(np.isnan(self.losses))[0]
+            if len(unknown) > 0:
+                self.tree.update(unknown, np.full(len(unknown), self.max_priority))
+
+    def stale_indices(self, count):
+        ''' Indices of the count images whose loss was updated the longest time ago (unseen images first) '''
+        age = np.where(np.isnan(self.losses), np.iinfo('int64').max, self.nb_draws - self.last_update)
+        count = min(count, self.nb_items)
+        return np.argpartition(-age, count - 1)[:count] if count < self.nb_items else np.arange(self.nb_items)
+
+    def summary(self):
+        ''' Loss statistics of the images and concentration of the sampling distribution '''
+        known = self.losses[~np.isnan(self.losses)]
+        probabilities = self.tree.leaves() / self.tree.total
+        top_share = np.sort(probabilities)[::-1][:max(self.nb_items // 10, 1)].sum()
+
+        return {'nb_items': self.nb_items,
+                'nb_known': len(known),
+                'nb_draws': self.nb_draws,
+                'beta': self.beta,
+                'mean_loss': float(known.mean()) if len(known) > 0 else None,
+                'max_loss': float(known.max()) if len(known) > 0 else None,
+                'top_10_percent_share': float(top_share),
+                'nb_never_visited': int(np.sum(self.nb_visits == 0))}
+
+    def save(self, path):
+        ''' Saves the sampler state (as a .npz file) '''
+        np.savez(path, losses=self.losses, last_update=self.last_update, nb_visits=self.nb_visits,
+                 nb_draws=self.nb_draws, alpha=self.alpha, epsilon=self.epsilon,
+                 fingerprint=self.fingerprint if self.fingerprint is not None else '')
+
+    def load(self, path):
+        '''
+        Restores the state saved by save(). The state is ignored if it was saved for a different
+        number of images, or for another image list than the fingerprint of the sampler.
+
+        Returns:
+            True if the state was restored
+        '''
+        if not os.path.exists(path):
+            return False
+
+        state = np.load(path)
+        if len(state['losses']) != self.nb_items:
+            print("Priority state %s was saved for %d images, not %d. Ignoring it." %
+                  (path, len(state['losses']), self.nb_items))
+            return False
+
+        if self.fingerprint is not None:
+            fingerprint = str(state['fingerprint']) if 'fingerprint' in state.files else ''
+            if fingerprint != self.fingerprint:
+                print("Priority state %s was saved for another image list (fingerprint %s, not %s). Ignoring it." %
+                      (path, fingerprint or 'missing', self.fingerprint))
+                return False
+
+        self.losses = state['losses'].astype('float32')
+        self.last_update = state['last_update'].astype('int64')
+        self.nb_visits = state['nb_visits'].astype('int32')
+        self.nb_draws = int(state['nb_draws'])
+
+        known = ~np.isnan(self.losses)
+        if known.any():
+            self.max_priority = max(1., float(self._priorities(self.losses[known].max())))
+
+        priorities = np.full(self.nb_items, self.max_priority)
+        priorities[known] = self._priorities(self.losses[known])
+        self.tree.rebuild(priorities)
+
+        return True
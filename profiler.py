@@ -0,0 +1,171 @@
+'''
+Per layer execution profiler for the generator, discriminator and VGG networks.
+
+The model is timed up to every profiled layer (a progressively truncated sub-model), in the
+topological order of the model layers. The time of a layer is the difference between the
+time up to that layer and the time up to the previous profiled layer. The backward time is
+obtained the same way from functions which also compute the gradients of the truncated
+output with respect to the trainable weights before it.
+
+Each truncated model is compiled separately, so profiling a large model takes a while.
+'''
+import time
+import json
+import numpy as np
+
+from keras import backend as K
+
+
+def _median_time(func, inputs, nb_runs):
+    func(inputs)  # warm up
+
+    timings = []
+    for i in range(nb_runs):
+        t1 = time.time()
+        func(inputs)
+        timings.append(time.time() - t1)
+
+    return float(np.median(timings))
+
+
+def _random_inputs(model, batch_size):
+    inputs = []
+    for shape in model.internal_input_shapes:
+        shape = (batch_size,) + tuple(shape[1:])
+        inputs.append(np.random.uniform(0, 255, size=shape).astype(K.floatx()))
+
+    return inputs
+
+
+def profile_model(model, layer_prefixes=('sr_res_', 'gan_', 'vgg_'), batch_size=1, inputs=None, nb_runs=10,
+                  backward=True):
+    '''
+    Profiles the forward (and backward) time of every layer of a model whose name starts with one of
+    the layer prefixes.
+
+    Args:
+        model: Keras model
+        layer_prefixes: tuple of layer name prefixes of the layers to profile
+        batch_size: batch size of the random inputs (ignored if inputs are given)
+        inputs: optional list of input arrays
+
+    Returns:
+        list of dicts with the name, type, forward_time, backward_time (in seconds) and output_bytes
+        of each profiled layer, in the topological order of the model.
+    '''
+    if inputs is None:
+        inputs = _random_inputs(model, batch_size)
+
+    function_inputs = list(model.inputs)
+    if model.uses_learning_phase and type(K.learning_phase()) is not int:
+        function_inputs.append(K.learning_phase())
+        inputs = inputs + [0.]
+
+    profiled_layers = [layer for layer in model.layers if layer.name.startswith(tuple(layer_prefixes))]
+
+    results = []
+    prev_forward = prev_total = 0.
+    weights = []
+
+    for layer in profiled_layers:
+        output = layer.get_output_at(0)
+        forward_func = K.function(function_inputs, [output])
+        forward = _median_time(forward_func, inputs, nb_runs)
+
+        weights.extend(layer.trainable_weights)
+
+        backward_time = None
+        if backward and len(weights) > 0:
+            try:
+                gradients = K.gradients(K.mean(output), weights)
+                total_func = K.function(function_inputs, [output] + gradients)
+                total = _median_time(total_func, inputs, nb_runs)
+
+                backward_time = max((total - prev_total) - (forward - prev_forward), 0.)
+                prev_total = total
+            except Exception as e:
+                print("Could not compute gradients of layer %s : %s" % (layer.name, str(e)))
+
+        # Batch size of the layer output, which differs from the input batch size in the VGG part of the SRGAN
+        # model (it sees the generated and the true images, 2 * batch_size)
+        output_batch_size = forward_func(inputs)[0].shape[0]
+        output_shape = layer.get_output_shape_at(0)
+        nb_elements = output_batch_size * int(np.prod([dim for dim in output_shape[1:]]))
+
+        results.append({'name': layer.name,
+                        'type': layer.__class__.__name__,
+                        'forward_time': max(forward - prev_forward, 0.),
+                        'backward_time': backward_time,
+                        'output_shape': [output_batch_size] + list(output_shape[1:]),
+                        'output_bytes': nb_elements * np.dtype(K.floatx()).itemsize})
+
+        prev_forward = forward
+
+    return results
+
+
+def profile_srgan(srgan_network, batch_size=None, nb_runs=10, backward=True):
+    '''
+    Profiles the networks built by an SRGANNetwork (after calling one of its build_* methods):
+    the generator (sr_res_* layers), the discriminator (gan_* layers) and the VGG part of
+    the SRGAN model (vgg_* layers).
+
+    Returns:
+        dictionary of network name -> list of layer profiles (see profile_model)
+    '''
+    batch_size = batch_size if batch_size is not None else srgan_network.batch_size
+    profiles = {}
+
+    if srgan_network.generative_model_ is not None:
+        print("Profiling generator")
+        profiles['generator'] = profile_model(srgan_network.generative_model_, ('sr_res_',), batch_size,
+                                              nb_runs=nb_runs, backward=backward)
+
+    if srgan_network.discriminative_model_ is not None:
+        print("Profiling discriminator")
+        profiles['discriminator'] = profile_model(srgan_network.discriminative_model_, ('gan_',), batch_size,
+                                                  nb_runs=nb_runs, backward=backward)
+
+    if srgan_network.vgg_network is not None and srgan_network.srgan_model_ is not None:
+        print("Profiling VGG")
+        vgg_profile = profile_model(srgan_network.srgan_model_, ('sr_res_', 'vgg_'), batch_size,
+                                    nb_runs=nb_runs, backward=backward)
+        # Generator layers are only profiled so that their time is not attributed to the first VGG layer
+        profiles['vgg'] = [layer for layer in vgg_profile if layer['name'].startswith('vgg_')]
+
+    return profiles
+
+
+def print_profile(profiles):
+    ''' Prints all profiled layers of all networks sorted by their total (forward + backward) time '''
+    layers = []
+    for network, network_layers in profiles.items():
+        for layer in network_layers:
+            layers.append((network, layer))
+
+    total_time = lambda item: item[1]['forward_time'] + (item[1]['backward_time'] or 0.)
+    layers = sorted(layers, key=total_time, reverse=True)
+
+    print("%-15s %-28s %-22s %14s %14s %14s" % ('Network', 'Layer', 'Type', 'Forward (ms)', 'Backward (ms)',
+                                                'Output (MB)'))
+    for network, layer in layers:
+        backward = "%14.3f" % (layer['backward_time'] * 1000.) if layer['backward_time'] is not None else "%14s" % "-"
+        print("%-15s %-28s %-22s %14.3f %s %14.3f" % (network, layer['name'], layer['type'],
+                                                      layer['forward_time'] * 1000., backward,
+                                                      layer['output_bytes'] / 2. ** 20))
+
+
+def save_profile(profiles, path):
+    with open(path, 'w') as f:
+        json.dump(profiles, f, indent=2)
+
+
+if __name__ == "__main__":
+    from models import SRGANNetwork
+
+    srgan_network = SRGANNetwork(img_width=32, img_height=32, batch_size=1)
+    srgan_network.build_srgan_model()
+
+    profiles = profile_srgan(srgan_network, nb_runs=5)
+    print_profile(profiles)
+    save_profile(profiles, "layer_profile.json")
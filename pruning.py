@@ -0,0 +1,405 @@
+'''
+Structured pruning of a trained generator (eg. weights/SRGAN.h5) to meet a latency budget without
+training from scratch.
+
+Two structures are pruned, which both physically shrink the generator:
+    - whole residual blocks. Removing a block is the same as dropping its residual branch, so the
+      remaining blocks keep their trained weights.
+    - filters of the first convolution of every residual block (and the matching input channels of
+      the second convolution). The trunk channels are shared by all the residual sums and are kept.
+
+Importance criteria:
+    - 'gamma': magnitude of the normalization scale. For a block, the mean |gamma| of its last
+      normalization layer, which scales the residual branch output. For a filter, |gamma| of the
+      normalization layer that follows it.
+    - 'psnr': PSNR drop on a calibration dataset when the residual branch of a block is disabled
+      (gamma and beta of its last normalization layer set to zero). Only used to rank blocks,
+      since it needs one evaluation per block. Filters are always ranked by gamma.
+
+The pruned generator configuration (nb_residual and residual_filters) is saved as JSON next to the
+weights, and can be passed to GenerativeNetwork or EvaluationEngine (see load_generator_config).
+'''
+import os
+import re
+import json
+import time
+import numpy as np
+
+from keras import backend as K
+from keras.layers import Input
+from keras.models import Model
+from keras.optimizers import Adam
+
+import models
+from cost_model import generator_cost, total_cost
+from evaluation import prepare_dataset, upscale_image, dataset_cache_path
+from loss import psnr
+
+# (number of residual blocks, fraction of filters kept in every block) of prune_sweep
+DEFAULT_CONFIGS = ((15, 0.75), (15, 0.5), (12, 1.0), (12, 0.75), (9, 1.0), (9, 0.75), (9, 0.5), (6, 1.0),
+                   (6, 0.5), (3, 1.0))
+
+
+def _kernel_axes():
+    ''' (output filter axis, input channel axis) of Convolution2D kernels '''
+    if K.image_dim_ordering() == "th":
+        return 0, 1  # (nb_filter, stack_size, rows, cols)
+    else:
+        return 3, 2  # (rows, cols, stack_size, nb_filter)
+
+
+def generator_config_path(weights_path):
+    return os.path.splitext(weights_path)[0] + ".json"
+
+
+def load_generator_config(weights_path):
+    '''
+    GenerativeNetwork arguments saved with pruned weights, or an empty dict for unpruned weights.
+    Eg. EvaluationEngine(path, generator_kwargs=load_generator_config(path))
+    '''
+    config_path = generator_config_path(weights_path)
+    if not os.path.exists(config_path):
+        return {}
+
+    with open(config_path, 'r') as f:
+        return json.load(f)
+
+
+def build_generator(tile_size, scale=4, weights_path=None, **generator_kwargs):
+    ''' Builds a GenerativeNetwork model with a tile_size x tile_size input and optionally loads its weights '''
+    generative_network = models.GenerativeNetwork(tile_size, tile_size, scale=scale, **generator_kwargs)
+
+    ip = Input(shape=models.image_shape(tile_size, tile_size), name='x_generator')
+    model = Model(ip, generative_network.create_sr_model(ip))
+
+    if weights_path is not None:
+        model.load_weights(weights_path)
+
+    return generative_network, model
+
+
+def evaluate_psnr(model, samples, tile_size, overlap=4, scale=4, shave=None, batch_size=16):
+    ''' Mean PSNR of the model over a list of (name, LR, HR) samples (see evaluation.prepare_dataset) '''
+    shave = shave if shave is not None else scale
+    channels_first = K.image_dim_ordering() == "th"
+
+    values = []
+    for _, lr, hr in samples:
+        sr = upscale_image(model, lr, tile_size, overlap, scale, batch_size, channels_first)
+
+        if shave > 0:
+            values.append(psnr(hr[shave:-shave, shave:-shave] / 255., sr[shave:-shave, shave:-shave] / 255.))
+        else:
+            values.append(psnr(hr / 255., sr / 255.))
+
+    return float(np.mean(values))
+
+
+def measure_latency(model, tile_size, batch_size=1, nb_runs=20):
+    ''' Median time in milliseconds of a predict call on a batch of tile_size x tile_size images '''
+    x = np.random.uniform(0, 255, size=(batch_size,) + models.image_shape(tile_size, tile_size)).astype('float32')
+    model.predict_on_batch(x)  # compile
+
+    timings = []
+    for i in range(nb_runs):
+        t1 = time.time()
+        model.predict_on_batch(x)
+        timings.append(time.time() - t1)
+
+    return float(np.median(timings)) * 1000.
+
+
+def block_importance(model, generative_network, method='gamma', samples=None, tile_size=64, overlap=4, scale=4):
+    '''
+    Importance score of every residual block (higher is more important).
+
+    Args:
+        method: 'gamma' or 'psnr' (see module docstring). 'psnr' requires calibration samples.
+
+    Returns:
+        array of shape (nb_residual,), where index i is the score of block i + 1
+    '''
+    assert method in ['gamma', 'psnr'], "method must be one of 'gamma' or 'psnr'"
+    nb_residual = generative_network.nb_residual
+
+    if method == 'gamma':
+        return np.array([np.mean(np.abs(model.get_layer('sr_res_bn_%d_2' % (i + 1)).get_weights()[0]))
+                         for i in range(nb_residual)])
+
+    assert samples is not None, "Calibration samples are needed to rank blocks by PSNR drop"
+
+    baseline_psnr = evaluate_psnr(model, samples, tile_size, overlap, scale)
+    scores = []
+
+    for i in range(nb_residual):
+        bn_layer = model.get_layer('sr_res_bn_%d_2' % (i + 1))
+        weights = bn_layer.get_weights()
+
+        # Zero gamma and beta, so the residual branch outputs zeros and the block is the identity
+        bn_layer.set_weights([np.zeros_like(w) for w in weights[:2]] + weights[2:])
+        scores.append(baseline_psnr - evaluate_psnr(model, samples, tile_size, overlap, scale))
+        bn_layer.set_weights(weights)
+
+        print("Block %d : PSNR drop when removed = %0.4f" % (i + 1, scores[-1]))
+
+    return np.array(scores)
+
+
+def filter_importance(model, block_id):
+    ''' |gamma| of the normalization layer after the first convolution of a residual block '''
+    return np.abs(model.get_layer('sr_res_bn_%d_1' % block_id).get_weights()[0])
+
+
+def select_structure(model, generative_network, nb_blocks, filter_fraction, block_scores):
+    '''
+    Keeps the nb_blocks most important residual blocks (in their original order), and the
+    ceil(filter_fraction * filters) most important filters of each of them.
+
+    Returns:
+        (keep_blocks, keep_filters) where keep_blocks is a list of 1-based block ids and
+        keep_filters is a dictionary of block id -> sorted array of filter indices
+    '''
+    nb_blocks = min(nb_blocks, generative_network.nb_residual)
+    keep_blocks = sorted(int(i) + 1 for i in np.argsort(block_scores)[::-1][:nb_blocks])
+
+    keep_filters = {}
+    for block_id in keep_blocks:
+        scores = filter_importance(model, block_id)
+        nb_filters = max(int(np.ceil(filter_fraction * len(scores))), 1)
+        keep_filters[block_id] = np.sort(np.argsort(scores)[::-1][:nb_filters])
+
+    return keep_blocks, keep_filters
+
+
+def prune_generator(model, generative_network, keep_blocks, keep_filters, tile_size, scale=4):
+    '''
+    Builds a physically smaller generator with only the kept blocks and filters, and copies the
+    corresponding weights of the trained model into it (by layer name).
+
+    Returns:
+        (pruned GenerativeNetwork, pruned model)
+    '''
+    generator_kwargs = {'gen_channels': generative_network.filters,
+                        'upscale_type': generative_network.upscale_type,
+                        'normalization': generative_network.normalization,
+                        'nb_residual': len(keep_blocks),
+                        'residual_filters': [len(keep_filters[block_id]) for block_id in keep_blocks]}
+
+    pruned_network, pruned_model = build_generator(tile_size, scale, **generator_kwargs)
+    out_axis, in_axis = _kernel_axes()
+
+    for layer in pruned_model.layers:
+        if len(layer.get_weights()) == 0:
+            continue
+
+        match = re.match(r'sr_res_(conv|bn)_(\d+)_(\d)$', layer.name)
+        if match is None:
+            layer.set_weights(model.get_layer(layer.name).get_weights())
+            continue
+
+        layer_type, block_id, position = match.group(1), int(match.group(2)), match.group(3)
+        source_id = keep_blocks[block_id - 1]
+        filters = keep_filters[source_id]
+        weights = model.get_layer('sr_res_%s_%d_%s' % (layer_type, source_id, position)).get_weights()
+
+        if position == '1':
+            if layer_type == 'conv':
+                weights = [np.take(weights[0], filters, axis=out_axis), weights[1][filters]]
+            else:
+                weights = [w[filters] for w in weights]
+        elif layer_type == 'conv':
+            weights = [np.take(weights[0], filters, axis=in_axis), weights[1]]
+
+        layer.set_weights(weights)
+
+    return pruned_network, pruned_model
+
+
+def sample_patches(samples, tile_size, scale=4, nb_patches=1000, seed=0):
+    '''
+    Random aligned LR / HR patches of a list of (name, LR, HR) samples, in the backend dim ordering
+    (LR patches are tile_size x tile_size, HR patches tile_size * scale x tile_size * scale).
+    '''
+    rng = np.random.RandomState(seed)
+    samples = [sample for sample in samples if min(sample[1].shape[:2]) >= tile_size]
+    assert len(samples) > 0, "No image is larger than the tile size %d" % tile_size
+
+    x_lr, x_hr = [], []
+    for i in range(nb_patches):
+        _, lr, hr = samples[rng.randint(len(samples))]
+        y = rng.randint(lr.shape[0] - tile_size + 1)
+        x = rng.randint(lr.shape[1] - tile_size + 1)
+
+        x_lr.append(lr[y: y + tile_size, x: x + tile_size])
+        x_hr.append(hr[y * scale: (y + tile_size) * scale, x * scale: (x + tile_size) * scale])
+
+    x_lr = models.from_channels_last(np.array(x_lr, dtype='float32'))
+    x_hr = models.from_channels_last(np.array(x_hr, dtype='float32'))
+    return x_lr, x_hr
+
+
+def fine_tune(model, x_lr, x_hr, nb_epochs=1, batch_size=16, lr=1e-4):
+    ''' Briefly fine tunes a pruned generator with a pixel MSE loss on LR / HR patches '''
+    model.compile(Adam(lr=lr), loss='mse')
+    model.fit(x_lr, x_hr, batch_size=batch_size, nb_epoch=nb_epochs, verbose=1)
+
+
+def save_pruned_generator(generative_network, model, weights_path):
+    ''' Saves the weights and the GenerativeNetwork arguments of a pruned generator '''
+    weights_dir = os.path.dirname(weights_path)
+    if weights_dir != '' and not os.path.exists(weights_dir):
+        os.makedirs(weights_dir)
+
+    model.save_weights(weights_path, overwrite=True)
+
+    config = {'gen_channels': generative_network.filters,
+              'upscale_type': generative_network.upscale_type,
+              'normalization': generative_network.normalization,
+              'nb_residual': generative_network.nb_residual,
+              'residual_filters': generative_network.residual_filters}
+
+    with open(generator_config_path(weights_path), 'w') as f:
+        json.dump(config, f, indent=2)
+
+
+def _table_row(name, generative_network, model, samples, tile_size, overlap, scale, nb_latency_runs):
+    macs = total_cost(generator_cost(tile_size, tile_size, 1, scale=generative_network.scale,
+                                     gen_channels=generative_network.filters,
+                                     nb_residual=generative_network.nb_residual,
+                                     residual_filters=generative_network.residual_filters,
+                                     upscale_type=generative_network.upscale_type,
+                                     normalization=generative_network.normalization))['macs']
+
+    return {'name': name,
+            'nb_residual': generative_network.nb_residual,
+            'residual_filters': generative_network.residual_filters,
+            'params': model.count_params(),
+            'gmacs': macs / 1e9,
+            'latency_ms': measure_latency(model, tile_size, nb_runs=nb_latency_runs),
+            'psnr': evaluate_psnr(model, samples, tile_size, overlap, scale)}
+
+
+def calibration_cache_path(cache_dir, calibration_dir, scale):
+    '''
+    Path of the prepared calibration samples, keyed by the scale and a hash of the calibration images
+    (see evaluation.dataset_cache_path), so that another dataset never reuses the cached samples.
+    '''
+    return dataset_cache_path(cache_dir, "pruning_calibration", calibration_dir, scale)
+
+
+def prune_sweep(weights_path, calibration_dir, configs=DEFAULT_CONFIGS, tile_size=64, overlap=4, scale=4,
+                method='gamma', finetune_dir=None, nb_finetune_patches=1000, finetune_epochs=1,
+                output_dir="weights/pruned/", nb_latency_runs=20, generator_kwargs=None, cache_dir="eval_cache/"):
+    '''
+    Prunes a trained generator to every (nb_blocks, filter_fraction) configuration, optionally fine tunes
+    each pruned generator, and measures its latency (one tile_size tile) and PSNR on the calibration images.
+
+    Args:
+        weights_path: trained generator weights (eg. weights/SRGAN.h5)
+        calibration_dir: directory of HR images used to rank blocks (method='psnr') and measure the PSNR.
+        configs: list of (number of residual blocks, fraction of filters kept in every block)
+        method: block importance criterion, 'gamma' or 'psnr'.
+        finetune_dir: optional directory of HR images used to fine tune every pruned generator.
+        output_dir: directory where the pruned weights (and their JSON configuration) are saved.
+        generator_kwargs: GenerativeNetwork arguments of the trained generator (eg. upscale_type).
+
+    Returns:
+        the latency / PSNR table, a list of dicts (the first row is the original generator)
+    '''
+    generator_kwargs = generator_kwargs if generator_kwargs is not None else load_generator_config(weights_path)
+
+    cache_path = None
+    if cache_dir is not None:
+        cache_path = calibration_cache_path(cache_dir, calibration_dir, scale)
+    samples = prepare_dataset(calibration_dir, scale, cache_path)
+
+    x_lr = x_hr = None
+    if finetune_dir is not None:
+        x_lr, x_hr = sample_patches(prepare_dataset(finetune_dir, scale), tile_size, scale, nb_finetune_patches)
+
+    generative_network, model = build_generator(tile_size, scale, weights_path, **generator_kwargs)
+
+    table = [_table_row('original', generative_network, model, samples, tile_size, overlap, scale, nb_latency_runs)]
+    table[0]['weights_path'] = weights_path
+    print("Original generator : %d blocks | PSNR : %0.4f | Latency : %0.2f ms" %
+          (generative_network.nb_residual, table[0]['psnr'], table[0]['latency_ms']))
+
+    block_scores = block_importance(model, generative_network, method, samples, tile_size, overlap, scale)
+
+    for nb_blocks, filter_fraction in configs:
+        name = "b%d_f%d" % (nb_blocks, int(round(filter_fraction * 100)))
+        keep_blocks, keep_filters = select_structure(model, generative_network, nb_blocks, filter_fraction,
+                                                     block_scores)
+
+        pruned_network, pruned_model = prune_generator(model, generative_network, keep_blocks, keep_filters,
+                                                       tile_size, scale)
+
+        if x_lr is not None:
+            print("Fine tuning %s" % name)
+            fine_tune(pruned_model, x_lr, x_hr, nb_epochs=finetune_epochs)
+
+        row = _table_row(name, pruned_network, pruned_model, samples, tile_size, overlap, scale, nb_latency_runs)
+        row['weights_path'] = os.path.join(output_dir, "SRGAN_%s.h5" % name)
+        save_pruned_generator(pruned_network, pruned_model, row['weights_path'])
+        table.append(row)
+
+        print("Pruned %s : PSNR : %0.4f | Latency : %0.2f ms" % (name, row['psnr'], row['latency_ms']))
+
+    return table
+
+
+def select_for_budget(table, latency_budget_ms):
+    ''' Row of the pruning table with the highest PSNR whose latency is within the budget (None if none is) '''
+    rows = [row for row in table if row['latency_ms'] <= latency_budget_ms]
+    if len(rows) == 0:
+        return None
+
+    return max(rows, key=lambda row: row['psnr'])
+
+
+def print_pruning_table(table):
+    original = table[0]
+
+    print("%-12s %8s %12s %10s %14s %10s %12s" % ('Model', 'Blocks', 'Params', 'GMACs', 'Latency (ms)', 'PSNR',
+                                                 'PSNR drop'))
+    for row in table:
+        print("%-12s %8d %12d %10.4f %14.2f %10.4f %12.4f" % (row['name'], row['nb_residual'], row['params'],
+                                                             row['gmacs'], row['latency_ms'], row['psnr'],
+                                                             original['psnr'] - row['psnr']))
+
+
+def save_pruning_table(table, path):
+    with open(path, 'w') as f:
+        json.dump(table, f, indent=2)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Structured pruning of a trained SRGAN generator")
+    parser.add_argument('weights_path', help='Trained generator weights (eg. weights/SRGAN.h5)')
+    parser.add_argument('calibration_dir', help='Directory of HR images used to measure the PSNR (eg. tests/set5)')
+    parser.add_argument('--method', default='gamma', choices=['gamma', 'psnr'], help='Block importance criterion')
+    parser.add_argument('--finetune_dir', default=None, help='Directory of HR images to fine tune pruned models')
+    parser.add_argument('--finetune_epochs', type=int, default=1)
+    parser.add_argument('--tile_size', type=int, default=64)
+    parser.add_argument('--scale', type=int, default=4)
+    parser.add_argument('--budget_ms', type=float, default=None, help='Latency budget of a tile in milliseconds')
+    parser.add_argument('--output_dir', default='weights/pruned/')
+    parser.add_argument('--table', default='pruning_table.json', help='Path of the JSON latency / PSNR table')
+    args = parser.parse_args()
+
+    table = prune_sweep(args.weights_path, args.calibration_dir, tile_size=args.tile_size, scale=args.scale,
+                        method=args.method, finetune_dir=args.finetune_dir, finetune_epochs=args.finetune_epochs,
+                        output_dir=args.output_dir)
+
+    print()
+    print_pruning_table(table)
+    save_pruning_table(table, args.table)
+
+    if args.budget_ms is not None:
+        best = select_for_budget(table, args.budget_ms)
+        if best is None:
+            print("No pruned generator fits in %0.2f ms" % args.budget_ms)
+        else:
+            print("Best generator within %0.2f ms : %s (%s)" % (args.budget_ms, best['name'], best['weights_path']))
@@ -0,0 +1,266 @@
+'''
+Content addressed cache of upscaled images, in front of the generator inference functions.
+
+Services often ask for the same images (or thumbnails) to be upscaled again. Results are keyed by a
+hash of the input bytes, the hash of the generator weights and the scale (plus any inference parameter
+which changes the output, eg. the tile size), so a repeated request is answered without decoding the
+input or running the generator, and a new checkpoint never returns stale results.
+
+There are two tiers:
+    - an in memory LRU of decoded results, bounded by its size in bytes
+    - an optional directory of .npy files, bounded by its total size. The least recently used files
+      are evicted first (file mtimes are refreshed on every hit).
+
+    cache = ResultCache(weights_hash(model), scale=4, max_memory_mb=256, disk_dir="cache/results/")
+    upscaler = CachedUpscaler(model, cache, tile_size=64)
+    sr = upscaler.upscale_bytes(open("photo.jpg", "rb").read())
+'''
+import io
+import os
+import time
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+from evaluation import upscale_image
+
+
+class ResultCache:
+    '''
+    Two tier (memory LRU and disk) cache of upscaled uint8 images.
+
+    Args:
+        weights_hash: hash of the generator weights (see sample_cache.weights_hash).
+        scale: upscaling factor of the generator.
+        max_memory_mb: size limit of the in memory tier.
+        disk_dir: optional directory of the disk tier. Results found on disk are also added to memory.
+        max_disk_mb: size limit of the disk tier.
+    '''
+
+    def __init__(self, weights_hash, scale, max_memory_mb=256, disk_dir=None, max_disk_mb=2048):
+        self.weights_hash = weights_hash
+        self.scale = scale
+        self.max_memory_bytes = int(max_memory_mb * 2 ** 20)
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = int(max_disk_mb * 2 ** 20)
+
+        self.memory = OrderedDict()  # key -> read only array, least recently used first
+        self.memory_bytes = 0
+
+        self.disk_files = OrderedDict()  # key -> file size, least recently used first
+        self.disk_bytes = 0
+
+        self.lock = threading.Lock()
+        self.reset_stats()
+
+        if disk_dir is not None:
+            if not os.path.exists(disk_dir):
+                os.makedirs(disk_dir)
+
+            entries = []
+            for name in os.listdir(disk_dir):
+                if name.endswith('.npy'):
+                    stat = os.stat(os.path.join(disk_dir, name))
+                    entries.append((stat.st_mtime, name[:-4], stat.st_size))
+
+            for _, key, size in sorted(entries):
+                self.disk_files[key] = size
+                self.disk_bytes += size
+
+            self._evict_disk()
+
+    def key(self, data, params=None):
+        '''
+        Cache key of an input, given as bytes (eg. an encoded image file) or as a numpy array.
+
+        Args:
+            params: optional dictionary of inference parameters which change the output (eg. tile size).
+        '''
+        sha = hashlib.sha1()
+
+        if isinstance(data, np.ndarray):
+            data = np.ascontiguousarray(data)
+            sha.update(("%s %s" % (data.shape, data.dtype.str)).encode('utf-8'))
+            sha.update(data.tobytes())
+        else:
+            sha.update(data)
+
+        sha.update(("%s x%d" % (self.weights_hash, self.scale)).encode('utf-8'))
+        if params:
+            sha.update(repr(sorted(params.items())).encode('utf-8'))
+
+        return sha.hexdigest()
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key + ".npy")
+
+    def get(self, key):
+        ''' Cached result (a read only array), or None '''
+        with self.lock:
+            result = self.memory.get(key)
+            if result is not None:
+                self.memory.move_to_end(key)
+                self.memory_hits += 1
+                return result
+
+            if key in self.disk_files:
+                path = self._disk_path(key)
+                try:
+                    result = np.load(path)
+                    os.utime(path, None)
+                except (IOError, OSError, ValueError):
+                    # Removed or truncated by another process
+                    self.disk_bytes -= self.disk_files.pop(key)
+                    result = None
+
+                if result is not None:
+                    self.disk_files.move_to_end(key)
+                    self.disk_hits += 1
+                    self._put_memory(key, result)
+                    return self.memory.get(key, result)
+
+            self.misses += 1
+            return None
+
+    def put(self, key, result):
+        ''' Stores a result in memory and on disk (if there is a disk tier) '''
+        result = np.array(result, dtype='uint8')
+
+        with self.lock:
+            self._put_memory(key, result)
+
+            if self.disk_dir is not None and key not in self.disk_files:
+                fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, suffix='.tmp')
+                with os.fdopen(fd, 'wb') as f:
+                    np.save(f, result)
+                os.replace(tmp_path, self._disk_path(key))
+
+                self.disk_files[key] = os.path.getsize(self._disk_path(key))
+                self.disk_bytes += self.disk_files[key]
+                self._evict_disk()
+
+    def _put_memory(self, key, result):
+        if result.nbytes > self.max_memory_bytes or key in self.memory:
+            return
+
+        result.flags.writeable = False
+        self.memory[key] = result
+        self.memory_bytes += result.nbytes
+
+        while self.memory_bytes > self.max_memory_bytes:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= evicted.nbytes
+            self.memory_evictions += 1
+
+    def _evict_disk(self):
+        while self.disk_bytes > self.max_disk_bytes and len(self.disk_files) > 0:
+            key, size = self.disk_files.popitem(last=False)
+            self.disk_bytes -= size
+            self.disk_evictions += 1
+
+            try:
+                os.remove(self._disk_path(key))
+            except OSError:
+                pass
+
+    def clear(self):
+        ''' Removes all the results of both tiers '''
+        with self.lock:
+            self.memory.clear()
+            self.memory_bytes = 0
+
+            for key in list(self.disk_files):
+                try:
+                    os.remove(self._disk_path(key))
+                except OSError:
+                    pass
+
+            self.disk_files.clear()
+            self.disk_bytes = 0
+
+    def reset_stats(self):
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.memory_evictions = 0
+        self.disk_evictions = 0
+
+    def stats(self):
+        ''' Hit, miss and eviction counters and the size of both tiers '''
+        nb_requests = self.memory_hits + self.disk_hits + self.misses
+
+        return {'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.memory_hits + self.disk_hits) / float(max(nb_requests, 1)),
+                'memory_evictions': self.memory_evictions,
+                'disk_evictions': self.disk_evictions,
+                'memory_items': len(self.memory),
+                'memory_mb': self.memory_bytes / 2. ** 20,
+                'disk_items': len(self.disk_files),
+                'disk_mb': self.disk_bytes / 2. ** 20}
+
+
+class CachedUpscaler:
+    '''
+    Tiled generator inference (evaluation.upscale_image) behind a ResultCache.
+
+    Args:
+        model: generator model with a tile_size x tile_size input.
+        cache: ResultCache created for the weights and scale of the model.
+        upscale_func: optional function (model, lr, tile_size, overlap, scale, batch_size, channels_first)
+            -> uint8 image, eg. a functools.partial of adaptive_inference.adaptive_upscale_image which
+            returns only the image. Its parameters should then be given in params.
+        params: additional parameters of upscale_func which are part of the cache key.
+    '''
+
+    def __init__(self, model, cache, tile_size=64, overlap=4, batch_size=16, channels_first=True, upscale_func=None,
+                 params=None):
+        self.model = model
+        self.cache = cache
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.batch_size = batch_size
+        self.channels_first = channels_first
+        self.upscale_func = upscale_func if upscale_func is not None else upscale_image
+
+        self.params = {'tile_size': tile_size, 'overlap': overlap}
+        if params is not None:
+            self.params.update(params)
+
+        self.inference_time = 0.
+
+    def _upscale(self, lr):
+        t1 = time.time()
+        sr = self.upscale_func(self.model, lr, self.tile_size, self.overlap, self.cache.scale, self.batch_size,
+                               self.channels_first)
+        self.inference_time += time.time() - t1
+
+        return sr
+
+    def upscale(self, lr):
+        ''' Upscales a uint8 image of shape (height, width, 3), or returns the cached result '''
+        key = self.cache.key(lr, self.params)
+
+        sr = self.cache.get(key)
+        if sr is None:
+            sr = self._upscale(lr)
+            self.cache.put(key, sr)
+
+        return sr
+
+    def upscale_bytes(self, data):
+        ''' Upscales an encoded image file (bytes). The image is only decoded if its result is not cached. '''
+        key = self.cache.key(data, self.params)
+
+        sr = self.cache.get(key)
+        if sr is None:
+            lr = np.asarray(Image.open(io.BytesIO(data)).convert('RGB'), dtype='uint8')
+            sr = self._upscale(lr)
+            self.cache.put(key, sr)
+
+        return sr
@@ -0,0 +1,114 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+
+def weights_hash(model):
+    ''' SHA1 hash of all the weights of a Keras model, used to identify a frozen generator '''
+    sha = hashlib.sha1()
+
+    for w in model.get_weights():
+        w = np.ascontiguousarray(w)
+        sha.update(str(w.shape).encode('utf-8'))
+        sha.update(w.tobytes())
+
+    return sha.hexdigest()
+
+
+class FakeSampleCache:
+    '''
+    Disk backed cache of generator outputs (fake samples), used while the generator is frozen.
+
+    Outputs are stored as uint8 (or as dtype, eg. float16 for intermediate features) in a memory mapped
+    file, one slot per image. A cache file is specific
+    to a generator weights hash and the output shape, so changing the generator or the image size
+    starts a new cache, while reruns with the same generator (for example with different discriminator
+    hyper parameters) reuse the outputs computed in earlier runs.
+
+    Args:
+        cache_dir: directory where the cache files are stored.
+        generator_hash: hash of the generator weights (see weights_hash).
+        sample_shape: shape of a single generator output, eg. (3, 128, 128).
+        capacity: maximum number of images that can be cached.
+        dtype: storage type. uint8 samples are rounded and clipped to the [0, 255] range.
+    '''
+
+    def __init__(self, cache_dir, generator_hash, sample_shape, capacity, dtype='uint8'):
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+        self.sample_shape = tuple(sample_shape)
+        self.capacity = capacity
+        self.dtype = np.dtype(dtype)
+
+        name = "%s_%s" % (generator_hash, "x".join(str(s) for s in self.sample_shape))
+        self.data_path = os.path.join(cache_dir, name + "." + self.dtype.name)
+        self.index_path = os.path.join(cache_dir, name + "_index.json")
+
+        self.index = {}
+        if os.path.exists(self.index_path) and os.path.exists(self.data_path):
+            with open(self.index_path, 'r') as f:
+                self.index = json.load(f)
+
+            mode = 'r+'
+        else:
+            mode = 'w+'
+
+        if mode == 'r+':
+            sample_size = int(np.prod(self.sample_shape)) * self.dtype.itemsize
+            nb_stored = os.path.getsize(self.data_path) // sample_size
+
+            if self.capacity > nb_stored:
+                # Grow a cache created with a smaller capacity
+                with open(self.data_path, 'r+b') as f:
+                    f.truncate(self.capacity * sample_size)
+            else:
+                self.capacity = nb_stored
+
+        self.data = np.memmap(self.data_path, dtype=self.dtype, mode=mode,
+                              shape=(self.capacity,) + self.sample_shape)
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, image_ids):
+        '''
+        Returns the cached float32 outputs for all the image ids, or None if any of them is not cached.
+        '''
+        slots = [self.index.get(image_id) for image_id in image_ids]
+
+        if any(slot is None for slot in slots):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return self.data[slots].astype('float32')
+
+    def put(self, image_ids, samples):
+        ''' Stores a batch of generator outputs (in the [0, 255] range for uint8 caches) '''
+        if self.dtype == np.uint8:
+            samples = np.clip(np.round(samples), 0, 255)
+
+        samples = samples.astype(self.dtype)
+
+        for image_id, sample in zip(image_ids, samples):
+            slot = self.index.get(image_id)
+
+            if slot is None:
+                if len(self.index) >= self.capacity:
+                    return
+
+                slot = len(self.index)
+                self.index[image_id] = slot
+
+            self.data[slot] = sample
+
+    def flush(self):
+        self.data.flush()
+
+        with open(self.index_path, 'w') as f:
+            json.dump(self.index, f)
+
+    def __len__(self):
+        return len(self.index)
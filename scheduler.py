@@ -0,0 +1,126 @@
+class DiscriminatorScheduler:
+    '''
+    Decides on every step of full SRGAN training whether the discriminator, the generator or both
+    should be updated.
+
+    The discriminator is skipped while it is saturated (its tracked accuracy is above max_disc_acc or
+    its tracked loss is below min_disc_loss), since those updates barely change it. The generator is
+    skipped while the discriminator is too weak (tracked accuracy below min_disc_acc) to give useful
+    gradients. Neither network can be skipped for more than max_consecutive_skips steps in a row, which
+    also keeps the tracked discriminator statistics from going stale.
+
+    Args:
+        n_critic: number of discriminator updates per generator update once warm up is over.
+        warmup_steps: number of initial steps in which only the discriminator is updated.
+        max_disc_acc: skip the discriminator when its tracked accuracy is above this value. None disables.
+        min_disc_loss: skip the discriminator when its tracked loss is below this value. None disables.
+        min_disc_acc: skip the generator when the tracked discriminator accuracy is below this value.
+            None disables.
+        max_consecutive_skips: maximum number of steps a network can be skipped in a row.
+        ema_decay: decay of the exponential moving averages of the discriminator loss and accuracy.
+        verbose: print every decision.
+    '''
+
+    def __init__(self, n_critic=1, warmup_steps=0, max_disc_acc=0.95, min_disc_loss=None, min_disc_acc=None,
+                 max_consecutive_skips=10, ema_decay=0.9, verbose=True):
+        assert n_critic >= 1, "n_critic must be at least 1"
+        assert 0. <= ema_decay < 1., "ema_decay must be in the range [0, 1)"
+
+        self.n_critic = n_critic
+        self.warmup_steps = warmup_steps
+        self.max_disc_acc = max_disc_acc
+        self.min_disc_loss = min_disc_loss
+        self.min_disc_acc = min_disc_acc
+        self.max_consecutive_skips = max_consecutive_skips
+        self.ema_decay = ema_decay
+        self.verbose = verbose
+
+        self.step = 0
+        self.disc_acc = None
+        self.disc_loss = None
+
+        self.disc_skips = 0
+        self.gen_skips = 0
+
+        self.nb_disc_updates = 0
+        self.nb_gen_updates = 0
+        self.history = []
+
+    def next_step(self):
+        '''
+        Returns:
+            (train_discriminator, train_generator) booleans for the current step.
+        '''
+        train_discriminator, train_generator, reason = self._decide()
+
+        # Never allow a step which does nothing
+        if not train_discriminator and not train_generator:
+            train_discriminator, train_generator, reason = True, True, "forced"
+
+        # Skips during warm up are planned, so they do not count towards max_consecutive_skips
+        is_warmup = self.step < self.warmup_steps
+
+        if train_discriminator:
+            self.disc_skips = 0
+            self.nb_disc_updates += 1
+        elif not is_warmup:
+            self.disc_skips += 1
+
+        if train_generator:
+            self.gen_skips = 0
+            self.nb_gen_updates += 1
+        elif not is_warmup:
+            self.gen_skips += 1
+
+        self.history.append((self.step, train_discriminator, train_generator, reason))
+
+        if self.verbose:
+            print("Scheduler step %d : train discriminator = %s | train generator = %s | reason : %s" %
+                  (self.step, train_discriminator, train_generator, reason))
+
+        self.step += 1
+        return train_discriminator, train_generator
+
+    def update(self, discriminator_loss, discriminator_acc):
+        ''' Tracks the discriminator statistics of the latest discriminator update '''
+        if self.disc_loss is None:
+            self.disc_loss = discriminator_loss
+            self.disc_acc = discriminator_acc
+        else:
+            self.disc_loss = self.ema_decay * self.disc_loss + (1. - self.ema_decay) * discriminator_loss
+            self.disc_acc = self.ema_decay * self.disc_acc + (1. - self.ema_decay) * discriminator_acc
+
+    def summary(self):
+        return {'steps': self.step,
+                'discriminator_updates': self.nb_disc_updates,
+                'generator_updates': self.nb_gen_updates,
+                'discriminator_acc': self.disc_acc,
+                'discriminator_loss': self.disc_loss}
+
+    def _decide(self):
+        if self.step < self.warmup_steps:
+            return True, False, "warmup"
+
+        train_discriminator = True
+        train_generator = (self.step - self.warmup_steps) % self.n_critic == self.n_critic - 1
+        reason = "n_critic" if not train_generator else "default"
+
+        if self.disc_acc is not None and self.disc_skips < self.max_consecutive_skips:
+            if self.max_disc_acc is not None and self.disc_acc > self.max_disc_acc:
+                return False, True, "discriminator accuracy %0.3f > %0.3f" % (self.disc_acc, self.max_disc_acc)
+
+            if self.min_disc_loss is not None and self.disc_loss < self.min_disc_loss:
+                return False, True, "discriminator loss %0.4f < %0.4f" % (self.disc_loss, self.min_disc_loss)
+
+        if self.disc_acc is not None and self.min_disc_acc is not None and self.disc_acc < self.min_disc_acc:
+            if self.gen_skips < self.max_consecutive_skips:
+                return True, False, "discriminator accuracy %0.3f < %0.3f" % (self.disc_acc, self.min_disc_acc)
+
+            train_generator = True
+            reason = "max consecutive skips"
+
+        if not train_generator and self.gen_skips >= self.max_consecutive_skips:
+            train_generator = True
+            reason = "max consecutive skips"
+
+        return train_discriminator, train_generator, reason
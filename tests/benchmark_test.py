@@ -2,12 +2,15 @@ from keras.layers import Input
 from keras.models import Model
 from keras.optimizers import Adam
 from keras.preprocessing.image import ImageDataGenerator
+from keras import backend as K
 
 import sys
 sys.path.append("..")
 
 import models
 from loss import PSNRLoss, psnr
+from evaluation import EvaluationEngine
+from image_loader import DirectoryImageIterator
 
 import os
 import time
@@ -32,10 +35,10 @@ if not os.path.exists(base_val_images_path):
 if not os.path.exists(base_test_images):
     os.makedirs(base_test_images)
 
-def test_set5(model : Model, img_width=32, img_height=32, batch_size=1):
+def test_set5(model : Model, img_width=32, img_height=32, batch_size=1, scale=4):
     datagen = ImageDataGenerator(rescale=1. / 255)
-    large_img_width = img_width * 4
-    large_img_height = img_height * 4
+    large_img_width = img_width * scale
+    large_img_height = img_height * scale
 
     iteration = 0
     total_psnr = 0.0
@@ -48,10 +51,10 @@ def test_set5(model : Model, img_width=32, img_height=32, batch_size=1):
     print()
 
 
-def test_set14(model : Model, img_width=32, img_height=32, batch_size=1):
+def test_set14(model : Model, img_width=32, img_height=32, batch_size=1, scale=4):
     datagen = ImageDataGenerator(rescale=1. / 255)
-    large_img_width = img_width * 4
-    large_img_height = img_height * 4
+    large_img_width = img_width * scale
+    large_img_height = img_height * scale
 
     iteration = 0
     total_psnr = 0.0
@@ -63,10 +66,10 @@ def test_set14(model : Model, img_width=32, img_height=32, batch_size=1):
     print("Average PSNR of Set5 validation images : ", total_psnr / 14)
     print()
 
-def test_bsd100(model : Model, img_width=32, img_height=32, batch_size=1):
+def test_bsd100(model : Model, img_width=32, img_height=32, batch_size=1, scale=4):
     datagen = ImageDataGenerator(rescale=1. / 255)
-    large_img_width = img_width * 4
-    large_img_height = img_height * 4
+    large_img_width = img_width * scale
+    large_img_height = img_height * scale
 
     iteration = 0
     total_psnr = 0.0
@@ -79,15 +82,32 @@ def test_bsd100(model : Model, img_width=32, img_height=32, batch_size=1):
     print()
 
 
+def test_all_datasets(weights_path, scale=4, tile_size=64, nb_workers=None, report_path=None, save_images=False):
+    '''
+    Evaluates the generator weights on Set5, Set14 and BSD100 at native resolution, in parallel.
+    Much faster than the test_set* functions, and therefore suitable for every saved checkpoint.
+    '''
+    output_dir = base_test_images if save_images else None
+    engine = EvaluationEngine(weights_path, scale=scale, tile_size=tile_size, nb_workers=nb_workers,
+                              output_dir=output_dir)
+
+    report = engine.evaluate({'set5': set5_path, 'set14': set14_path, 'bsd100': bsd100_path})
+    engine.print_report(report)
+
+    if report_path is not None:
+        engine.save_report(report, report_path)
+
+    return report
+
+
 def _test_loop(path, batch_size, datagen, img_height, img_width, iteration, large_img_height, large_img_width, model,
                total_psnr, prefix, nb_images):
-    for x in datagen.flow_from_directory(path, class_mode=None, batch_size=batch_size,
-                                         target_size=(large_img_width, large_img_height)):
+    for x in DirectoryImageIterator(path, target_size=(large_img_width, large_img_height), batch_size=batch_size,
+                                    rescale=datagen.rescale, channels_first=K.image_dim_ordering() == "th"):
         t1 = time.time()
 
         # resize images
-        x_temp = x.copy()
-        x_temp = x_temp.transpose((0, 2, 3, 1))
+        x_temp = models.to_channels_last(x)
 
         x_generator = np.empty((batch_size, img_width, img_height, 3))
 
@@ -95,15 +115,15 @@ def _test_loop(path, batch_size, datagen, img_height, img_width, iteration, larg
             img = imresize(x_temp[j], (img_width, img_height))
             x_generator[j, :, :, :] = img
 
-        x_generator = x_generator.transpose((0, 3, 1, 2))
+        x_generator = models.from_channels_last(x_generator)
 
         output_image_batch = model.predict_on_batch(x_generator)
 
         average_psnr = 0.0
         for x_i in range(batch_size):
             average_psnr += psnr(x[x_i], output_image_batch[x_i] / 255.)
-            total_psnr += average_psnr
 
+        total_psnr += average_psnr
         average_psnr /= batch_size
 
         iteration += batch_size
@@ -117,11 +137,11 @@ def _test_loop(path, batch_size, datagen, img_height, img_width, iteration, larg
             generated_path = base_test_images + prefix + "_iteration_%d_num_%d_generated.png" % (iteration, x_i + 1)
 
             val_x = x[x_i].copy() * 255.
-            val_x = val_x.transpose((1, 2, 0))
+            val_x = models.to_channels_last(val_x)
             val_x = np.clip(val_x, 0, 255).astype('uint8')
 
             output_image = output_image_batch[x_i]
-            output_image = output_image.transpose((1, 2, 0))
+            output_image = models.to_channels_last(output_image)
             output_image = np.clip(output_image, 0, 255).astype('uint8')
 
             imsave(real_path, val_x)
@@ -134,21 +154,22 @@ def _test_loop(path, batch_size, datagen, img_height, img_width, iteration, larg
 
 class SRResNetTest:
 
-    def __init__(self, img_width=96, img_height=96, batch_size=16):
+    def __init__(self, img_width=96, img_height=96, batch_size=16, scale=4):
         assert img_width >= 16, "Minimum image width must be at least 16"
         assert img_height >= 16, "Minimum image height must be at least 16"
 
         self.img_width = img_width
         self.img_height = img_height
         self.batch_size = batch_size
+        self.scale = scale
 
         self.model = None # type: Model
         self.weights_path = base_weights_path + "sr_resnet_weights.h5"
 
     def build_model(self, load_weights=False) -> Model:
-        sr_resnet = models.GenerativeNetwork(self.img_width, self.img_height, self.batch_size)
+        sr_resnet = models.GenerativeNetwork(self.img_width, self.img_height, self.batch_size, scale=self.scale)
 
-        ip = Input(shape=(3, self.img_width, self.img_height), name='x_generator')
+        ip = Input(shape=models.image_shape(self.img_width, self.img_height), name='x_generator')
         output = sr_resnet.create_sr_model(ip)
 
         self.model = Model(ip, output)
@@ -171,8 +192,8 @@ class SRResNetTest:
 
     def train_model(self, image_dir, nb_images=50000, nb_epochs=1):
         datagen = ImageDataGenerator(rescale=1. / 255)
-        img_width = self.img_width * 4
-        img_height = self.img_height * 4
+        img_width = self.img_width * self.scale
+        img_height = self.img_height * self.scale
 
         early_stop = False
         iteration = 0
@@ -183,15 +204,14 @@ class SRResNetTest:
             print()
             print("Epoch : %d" % (i + 1))
 
-            for x in datagen.flow_from_directory(image_dir, class_mode=None, batch_size=self.batch_size,
-                                                 target_size=(img_width, img_height)):
+            for x in DirectoryImageIterator(image_dir, target_size=(img_width, img_height), batch_size=self.batch_size,
+                                            rescale=datagen.rescale, channels_first=K.image_dim_ordering() == "th"):
 
                 try:
                     t1 = time.time()
 
                     # resize images
-                    x_temp = x.copy()
-                    x_temp = x_temp.transpose((0, 2, 3, 1))
+                    x_temp = models.to_channels_last(x)
 
                     x_generator = np.empty((self.batch_size, self.img_width, self.img_height, 3))
 
@@ -200,7 +220,7 @@ class SRResNetTest:
                         img = imresize(img, (self.img_width, self.img_height))
                         x_generator[j, :, :, :] = img
 
-                    x_generator = x_generator.transpose((0, 3, 1, 2))
+                    x_generator = models.from_channels_last(x_generator)
 
                     if iteration % 50 == 0 and iteration != 0 :
                         print("Random Validation image..")
@@ -231,11 +251,11 @@ class SRResNetTest:
                                                                                             x_i + 1)
 
                             val_x = x[x_i].copy() * 255.
-                            val_x = val_x.transpose((1, 2, 0))
+                            val_x = models.to_channels_last(val_x)
                             val_x = np.clip(val_x, 0, 255).astype('uint8')
 
                             output_image = output_image_batch[x_i]
-                            output_image = output_image.transpose((1, 2, 0))
+                            output_image = models.to_channels_last(output_image)
                             output_image = np.clip(output_image, 0, 255).astype('uint8')
 
                             imsave(real_path, val_x)
@@ -303,3 +323,6 @@ if __name__ == "__main__":
     test_set5(sr_resnet_test.model, img_width=img_width, img_height=img_height)
     test_set14(sr_resnet_test.model, img_width=img_width, img_height=img_height)
     test_bsd100(sr_resnet_test.model, img_width=img_width, img_height=img_height)
+
+    # Native resolution PSNR / SSIM on all 3 datasets
+    #test_all_datasets("../weights/SRGAN.h5", report_path="benchmark_report.json")
@@ -0,0 +1,103 @@
+'''
+Checks of the patch scores and acceptance decisions of content_filter.ContentFilter, alone and in
+image_loader.RandomPatchIterator. Does not need Keras.
+
+Usage:
+    python content_filter_test.py
+    python -m pytest content_filter_test.py
+'''
+import sys
+import os
+import shutil
+import tempfile
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np
+from PIL import Image
+
+from content_filter import ContentFilter, patch_score
+from image_loader import RandomPatchIterator
+
+
+def _flat_patch(value=128, size=32):
+    return np.full((size, size, 3), value, dtype='uint8')
+
+
+def _striped_patch(size=32, period=8):
+    ''' Vertical stripes, 0 and 255 gray levels alternating every period // 2 pixels '''
+    stripes = ((np.arange(size) // (period // 2)) % 2 * 255).astype('uint8')
+    return np.repeat(np.tile(stripes, (size, 1))[..., None], 3, axis=2)
+
+
+def test_patch_score():
+    assert patch_score(_flat_patch(), 'gradient') == 0.
+    assert patch_score(_flat_patch(), 'variance') == 0.
+
+    # Downscaled by 4, the stripes alternate on every pixel : the horizontal gradient is 255
+    assert np.isclose(patch_score(_striped_patch(), 'gradient', downscale=4), 255.)
+    assert np.isclose(patch_score(_striped_patch(), 'variance', downscale=4), 127.5, atol=0.5)
+
+
+def test_acceptance_ramp():
+    content_filter = ContentFilter('gradient', low=2., high=8., min_acceptance=0.1)
+
+    assert np.isclose(content_filter.acceptance(0.), 0.1)
+    assert np.isclose(content_filter.acceptance(2.), 0.1)
+    assert np.isclose(content_filter.acceptance(5.), 0.55)
+    assert np.isclose(content_filter.acceptance(8.), 1.)
+    assert np.isclose(content_filter.acceptance(100.), 1.)
+
+
+def test_flat_patches_are_down_weighted():
+    rng = np.random.RandomState(0)
+    content_filter = ContentFilter(min_acceptance=0.2)
+
+    flat = np.mean([content_filter.accept(_flat_patch(), rng) for _ in range(2000)])
+    assert abs(flat - 0.2) < 0.03
+    assert all(content_filter.accept(_striped_patch(), rng) for _ in range(100))
+
+
+def test_forced_acceptance_and_stats():
+    rng = np.random.RandomState(1)
+    content_filter = ContentFilter(acceptance_curve=lambda score: 0., history_size=5)
+
+    assert not content_filter.accept(_flat_patch(), rng)
+    assert content_filter.accept(_flat_patch(), rng, force=True)
+
+    for _ in range(10):
+        content_filter.accept(_flat_patch(), rng)
+
+    summary = content_filter.summary()
+    assert (summary['nb_scored'], summary['nb_accepted'], summary['nb_forced']) == (12, 1, 1)
+    assert len(content_filter.scores) == 5
+
+    content_filter.reset_stats()
+    assert content_filter.summary()['nb_scored'] == 0
+
+
+def test_patch_iterator_forces_a_patch_after_max_tries():
+    directory = tempfile.mkdtemp()
+    try:
+        for i in range(3):
+            Image.fromarray(_flat_patch(50 * i, size=64)).save(os.path.join(directory, "%d.png" % i))
+
+        # Every candidate is rejected, so the last of max_tries candidates is forced
+        content_filter = ContentFilter(acceptance_curve=lambda score: 0., max_tries=3)
+        patches = RandomPatchIterator(directory, (16, 16), batch_size=4, crops_per_decode=2, reuse_window=2,
+                                      seed=0, channels_first=False, content_filter=content_filter)
+        batch = next(patches)
+
+        assert batch.shape == (4, 16, 16, 3)
+        summary = content_filter.summary()
+        assert (summary['nb_scored'], summary['nb_accepted'], summary['nb_forced']) == (12, 4, 4)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    test_patch_score()
+    test_acceptance_ramp()
+    test_flat_patches_are_down_weighted()
+    test_forced_acceptance_and_stats()
+    test_patch_iterator_forces_a_patch_after_max_tries()
+    print("All content_filter checks passed.")
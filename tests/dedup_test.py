@@ -0,0 +1,84 @@
+'''
+Checks of the multi-index hashing search of dedup.HashIndex against a brute force Hamming distance search.
+Does not need Keras.
+
+Usage:
+    python dedup_test.py
+    python -m pytest dedup_test.py
+'''
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np
+
+from dedup import HashIndex, hamming_distance
+
+
+def _random_hashes(nb_hashes, nb_near_duplicates, max_flips, seed=0):
+    ''' Random 64 bit hashes, followed by copies of some of them with up to max_flips flipped bits '''
+    rng = np.random.RandomState(seed)
+    hashes = list(rng.randint(0, 2 ** 32, size=nb_hashes, dtype='uint64') << np.uint64(32) |
+                  rng.randint(0, 2 ** 32, size=nb_hashes, dtype='uint64'))
+
+    for _ in range(nb_near_duplicates):
+        code = int(hashes[rng.randint(nb_hashes)])
+        for bit in rng.choice(64, rng.randint(max_flips + 1), replace=False):
+            code ^= 1 << int(bit)
+        hashes.append(np.uint64(code))
+
+    return np.array(hashes, dtype='uint64')
+
+
+def _brute_force_pairs(hashes, radius):
+    i, j = np.triu_indices(len(hashes), k=1)
+    keep = hamming_distance(hashes[i], hashes[j]) <= radius
+    return set(zip(i[keep].tolist(), j[keep].tolist()))
+
+
+def test_hamming_distance():
+    assert hamming_distance([0], [0])[0] == 0
+    assert hamming_distance([0], [2 ** 64 - 1])[0] == 64
+    assert hamming_distance([0b1011], [0b0110])[0] == 3
+
+
+def test_query_matches_brute_force():
+    hashes = _random_hashes(300, 100, max_flips=8)
+
+    # Radii below, equal to and above a multiple of nb_chunks (the number of candidate chunk values grows
+    # quickly with radius // nb_chunks on wide chunks)
+    for nb_chunks, radii in [(2, [0, 3]), (4, [0, 3, 4, 7, 8]), (8, [0, 7, 8, 9])]:
+        index = HashIndex(hashes, nb_chunks)
+
+        for radius in radii:
+            for code in hashes[::7]:
+                expected = np.where(hamming_distance(hashes, code) <= radius)[0]
+                assert np.array_equal(np.sort(index.query(code, radius)), expected)
+
+
+def test_pairs_matches_brute_force():
+    hashes = _random_hashes(400, 150, max_flips=6, seed=1)
+
+    for nb_chunks in [4, 8]:
+        for radius in [0, 2, 5, 6]:
+            expected = _brute_force_pairs(hashes, radius)
+
+            # Small blocks check the pairs across query blocks
+            for block_size in [65536, 37]:
+                pairs = HashIndex(hashes, nb_chunks).pairs(radius, block_size=block_size)
+                assert len(pairs) == len(expected)
+                assert set(map(tuple, pairs.tolist())) == expected
+
+
+def test_exact_duplicates():
+    hashes = np.array([5, 9, 5, 5], dtype='uint64')
+    pairs = HashIndex(hashes).pairs(0)
+    assert pairs.tolist() == [[0, 2], [0, 3], [2, 3]]
+
+
+if __name__ == "__main__":
+    test_hamming_distance()
+    test_query_matches_brute_force()
+    test_pairs_matches_brute_force()
+    test_exact_duplicates()
+    print("All dedup checks passed.")
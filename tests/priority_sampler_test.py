@@ -0,0 +1,130 @@
+'''
+Checks of the sum tree and of the priority sampler against brute force numpy computations.
+Does not need Keras.
+
+Usage:
+    python priority_sampler_test.py
+    python -m pytest priority_sampler_test.py
+'''
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np
+
+from priority_sampler import SumTree, PrioritySampler, dataset_fingerprint
+
+
+def _brute_force_find(values, targets):
+    ''' Index of the first leaf whose cumulative sum exceeds every target '''
+    return np.searchsorted(np.cumsum(values), targets, side='right')
+
+
+def test_sum_tree_find_matches_cumsum():
+    rng = np.random.RandomState(0)
+
+    # Non power of two capacities leave padding leaves in the tree
+    for capacity in [1, 2, 3, 5, 17, 100]:
+        values = rng.uniform(0.1, 2., size=capacity)
+        tree = SumTree(capacity)
+        tree.rebuild(values)
+
+        assert np.isclose(tree.total, values.sum())
+
+        targets = rng.uniform(0, values.sum(), size=200)
+        assert np.array_equal(tree.find(targets), _brute_force_find(values, targets))
+
+
+def test_sum_tree_update_matches_rebuild():
+    rng = np.random.RandomState(1)
+    capacity = 37
+
+    values = rng.uniform(0.1, 2., size=capacity)
+    tree = SumTree(capacity)
+    tree.rebuild(values)
+
+    for _ in range(20):
+        # Repeated indices within an update keep the last value, as numpy assignment does
+        indices = rng.randint(capacity, size=5)
+        new_values = rng.uniform(0.1, 2., size=5)
+        tree.update(indices, new_values)
+        values[indices] = new_values
+
+        expected = SumTree(capacity)
+        expected.rebuild(values)
+        assert np.allclose(tree.nodes, expected.nodes)
+
+    targets = rng.uniform(0, values.sum(), size=200)
+    assert np.array_equal(tree.find(targets), _brute_force_find(values, targets))
+
+
+def test_sum_tree_find_empty():
+    tree = SumTree(5)
+    tree.rebuild(np.ones(5))
+    assert len(tree.find(np.zeros(0))) == 0
+
+
+def test_sample_with_only_uniform_draws():
+    # One image per batch and uniform_fraction 0.9 : no priority draw at all
+    sampler = PrioritySampler(10, uniform_fraction=0.9)
+    indices, weights = sampler.sample(1)
+
+    assert len(indices) == 1 and 0 <= indices[0] < 10
+    assert np.allclose(weights, 1.)
+
+
+def test_sample_follows_priorities():
+    rng = np.random.RandomState(2)
+    sampler = PrioritySampler(4, alpha=1., epsilon=0., uniform_fraction=0.)
+    sampler.update(np.arange(4), [1., 1., 1., 5.])
+
+    indices = np.concatenate([sampler.sample(8, rng)[0] for _ in range(500)])
+    frequencies = np.bincount(indices, minlength=4) / float(len(indices))
+    assert np.allclose(frequencies, [0.125, 0.125, 0.125, 0.625], atol=0.02)
+
+    # The most likely image has the smallest importance weight
+    indices, weights = sampler.sample(8, rng)
+    assert weights.max() == 1.
+    assert np.all(weights[indices == 3] <= weights[indices != 3].min())
+
+
+def test_unseen_images_keep_the_largest_priority():
+    sampler = PrioritySampler(6, alpha=1., epsilon=0.)
+    sampler.update([0, 1], [3., 0.5])
+
+    leaves = sampler.tree.leaves()
+    assert np.allclose(leaves[2:], 3.)
+    assert np.isclose(leaves[1], 0.5)
+
+    assert set(sampler.stale_indices(4)) == {2, 3, 4, 5}
+
+
+def test_state_is_restored_for_the_same_image_list(tmp_path=None):
+    directory = str(tmp_path) if tmp_path is not None else "."
+    path = os.path.join(directory, "priority_state_test.npz")
+
+    fingerprint = dataset_fingerprint(["a.png", "b.png", "c.png"], "images/")
+    sampler = PrioritySampler(3, fingerprint=fingerprint)
+    sampler.update([0, 2], [1., 4.])
+    sampler.save(path)
+
+    restored = PrioritySampler(3, fingerprint=fingerprint)
+    assert restored.load(path)
+    assert np.allclose(restored.tree.nodes, sampler.tree.nodes)
+
+    other = PrioritySampler(3, fingerprint=dataset_fingerprint(["a.png", "b.png", "d.png"], "images/"))
+    assert not other.load(path)
+
+    if tmp_path is None:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    test_sum_tree_find_matches_cumsum()
+    test_sum_tree_update_matches_rebuild()
+    test_sum_tree_find_empty()
+    test_sample_with_only_uniform_draws()
+    test_sample_follows_priorities()
+    test_unseen_images_keep_the_largest_priority()
+    test_state_is_restored_for_the_same_image_list()
+    print("All priority_sampler checks passed.")
@@ -0,0 +1,101 @@
+'''
+Checks of the update decisions of scheduler.DiscriminatorScheduler. Does not need Keras.
+
+Usage:
+    python scheduler_test.py
+    python -m pytest scheduler_test.py
+'''
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from scheduler import DiscriminatorScheduler
+
+
+def _run(scheduler, nb_steps, disc_loss=None, disc_acc=None):
+    ''' Decisions of nb_steps steps, feeding back constant discriminator statistics after every update '''
+    decisions = []
+    for _ in range(nb_steps):
+        train_discriminator, train_generator = scheduler.next_step()
+        decisions.append((train_discriminator, train_generator))
+
+        if train_discriminator and disc_acc is not None:
+            scheduler.update(disc_loss, disc_acc)
+
+    return decisions
+
+
+def test_default_updates_both_networks():
+    scheduler = DiscriminatorScheduler(verbose=False)
+    assert _run(scheduler, 5, 0.5, 0.7) == [(True, True)] * 5
+
+
+def test_warmup_and_n_critic():
+    scheduler = DiscriminatorScheduler(n_critic=3, warmup_steps=4, max_consecutive_skips=10, verbose=False)
+    decisions = _run(scheduler, 10, 0.5, 0.7)
+
+    assert decisions[:4] == [(True, False)] * 4
+    assert [train_generator for _, train_generator in decisions[4:]] == [False, False, True] * 2
+    assert all(train_discriminator for train_discriminator, _ in decisions)
+
+
+def test_warmup_skips_do_not_count():
+    # The generator is skipped for the 20 warm up steps, more than max_consecutive_skips
+    scheduler = DiscriminatorScheduler(n_critic=2, warmup_steps=20, max_consecutive_skips=3, verbose=False)
+    decisions = _run(scheduler, 22, 0.5, 0.7)
+
+    assert scheduler.gen_skips == 0
+    assert decisions[20:] == [(True, False), (True, True)]
+
+
+def test_saturated_discriminator_is_skipped_at_most_max_consecutive_skips():
+    scheduler = DiscriminatorScheduler(max_disc_acc=0.9, max_consecutive_skips=3, verbose=False)
+    decisions = _run(scheduler, 9, disc_loss=0.1, disc_acc=0.99)
+
+    # The first step has no statistics yet
+    assert [train_discriminator for train_discriminator, _ in decisions] == [True, False, False, False, True,
+                                                                            False, False, False, True]
+    assert all(train_generator for _, train_generator in decisions)
+
+
+def test_low_discriminator_loss_skips_the_discriminator():
+    scheduler = DiscriminatorScheduler(max_disc_acc=None, min_disc_loss=0.05, max_consecutive_skips=2, verbose=False)
+    decisions = _run(scheduler, 4, disc_loss=0.01, disc_acc=0.5)
+
+    assert decisions == [(True, True), (False, True), (False, True), (True, True)]
+
+
+def test_weak_discriminator_skips_the_generator():
+    scheduler = DiscriminatorScheduler(max_disc_acc=None, min_disc_acc=0.6, max_consecutive_skips=2, verbose=False)
+    decisions = _run(scheduler, 7, disc_loss=1., disc_acc=0.3)
+
+    assert decisions == [(True, True), (True, False), (True, False), (True, True), (True, False), (True, False),
+                         (True, True)]
+
+
+def test_n_critic_is_bounded_by_max_consecutive_skips():
+    scheduler = DiscriminatorScheduler(n_critic=10, max_consecutive_skips=2, verbose=False)
+    decisions = _run(scheduler, 9, 0.5, 0.7)
+
+    assert [train_generator for _, train_generator in decisions] == [False, False, True] * 3
+
+
+def test_summary_counts():
+    scheduler = DiscriminatorScheduler(n_critic=2, warmup_steps=2, verbose=False)
+    _run(scheduler, 6, 0.5, 0.7)
+
+    summary = scheduler.summary()
+    assert (summary['steps'], summary['discriminator_updates'], summary['generator_updates']) == (6, 6, 2)
+    assert len(scheduler.history) == 6
+
+
+if __name__ == "__main__":
+    test_default_updates_both_networks()
+    test_warmup_and_n_critic()
+    test_warmup_skips_do_not_count()
+    test_saturated_discriminator_is_skipped_at_most_max_consecutive_skips()
+    test_low_discriminator_loss_skips_the_discriminator()
+    test_weak_discriminator_skips_the_generator()
+    test_n_critic_is_bounded_by_max_consecutive_skips()
+    test_summary_counts()
+    print("All scheduler checks passed.")
@@ -0,0 +1,180 @@
+'''
+Throughput and latency benchmarks on synthetic in memory images.
+
+Does not need any downloaded dataset, so it can be run offline on any machine.
+Every benchmark runs in its own process, so that the peak resident memory (RSS)
+and the graph build time are measured independently for each training mode.
+
+Usage:
+    python throughput_benchmark.py --output results.json
+    python throughput_benchmark.py --output results.json --baseline baseline.json --threshold 0.1
+
+When a baseline is given, the process exits with status 1 if any metric is worse
+than the baseline by more than the threshold (fraction).
+'''
+import sys
+sys.path.append("..")
+
+import os
+import json
+import time
+import argparse
+import platform
+
+from autotune import TRAINING_MODES, peak_rss_mb, benchmark_training_mode, run_isolated
+
+# Metrics where a higher value is better. All the other numeric metrics are lower is better.
+HIGHER_IS_BETTER = ('steps_per_sec', 'images_per_sec')
+
+
+def _benchmark_inference(img_size, nb_runs):
+    import numpy as np
+    from keras.layers import Input
+    from keras.models import Model
+    import models
+
+    generative_network = models.GenerativeNetwork(img_size, img_size, batch_size=1)
+
+    shape = models.image_shape(img_size, img_size)
+
+    t1 = time.time()
+    ip = Input(shape=shape, name='x_generator')
+    model = Model(ip, generative_network.create_sr_model(ip))
+    build_time = time.time() - t1
+
+    x = np.random.uniform(0, 255, size=(1,) + shape).astype('float32')
+
+    t1 = time.time()
+    model.predict_on_batch(x)
+    compile_time = time.time() - t1
+
+    latencies = []
+    for i in range(nb_runs):
+        t1 = time.time()
+        model.predict_on_batch(x)
+        latencies.append(time.time() - t1)
+
+    latencies = np.sort(latencies)
+
+    return {'build_time': build_time,
+            'compile_time': compile_time,
+            'latency_median_ms': float(latencies[len(latencies) // 2]) * 1000.,
+            'latency_p90_ms': float(latencies[int(len(latencies) * 0.9)]) * 1000.,
+            'peak_rss_mb': peak_rss_mb()}
+
+
+def run_benchmarks(img_width=32, img_height=32, batch_size=4, nb_steps=20, warmup_steps=2,
+                   inference_sizes=(32, 64, 128), nb_inference_runs=20):
+    results = {'config': {'img_width': img_width,
+                          'img_height': img_height,
+                          'batch_size': batch_size,
+                          'nb_steps': nb_steps,
+                          'platform': platform.platform(),
+                          'python': platform.python_version()},
+               'training': {},
+               'inference': {}}
+
+    for mode in TRAINING_MODES:
+        print("Benchmarking %s" % mode)
+        results['training'][mode] = run_isolated(benchmark_training_mode, mode, img_width, img_height,
+                                                 batch_size, nb_steps, warmup_steps)
+
+    for img_size in inference_sizes:
+        print("Benchmarking generator inference at %dx%d" % (img_size, img_size))
+        results['inference'][str(img_size)] = run_isolated(_benchmark_inference, img_size, nb_inference_runs)
+
+    return results
+
+
+def _flatten(results, prefix=''):
+    flat = {}
+    for key, value in results.items():
+        name = prefix + key
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name + '/'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare_to_baseline(results, baseline, threshold=0.1):
+    '''
+    Returns a list of (metric, baseline value, current value, relative change) for every
+    benchmark metric which regressed by more than the threshold.
+    '''
+    current = _flatten({'training': results['training'], 'inference': results['inference']})
+    previous = _flatten({'training': baseline['training'], 'inference': baseline['inference']})
+
+    regressions = []
+    for metric, base_value in sorted(previous.items()):
+        if metric not in current or base_value == 0:
+            continue
+
+        value = current[metric]
+        change = (value - base_value) / base_value
+
+        if metric.endswith(HIGHER_IS_BETTER):
+            regressed = change < -threshold
+        else:
+            regressed = change > threshold
+
+        if regressed:
+            regressions.append((metric, base_value, value, change))
+
+    return regressions
+
+
+def print_results(results):
+    for mode, stats in sorted(results['training'].items()):
+        if 'error' in stats:
+            print("%s : failed with %s" % (mode, stats['error']))
+            continue
+
+        print("%s | Steps / sec : %0.2f | Images / sec : %0.2f | Build time : %0.2f s | Compile time : %0.2f s | "
+              "Peak RSS : %0.1f MB" % (mode, stats['steps_per_sec'], stats['images_per_sec'], stats['build_time'],
+                                       stats['compile_time'], stats['peak_rss_mb']))
+
+    for img_size, stats in sorted(results['inference'].items(), key=lambda item: int(item[0])):
+        if 'error' in stats:
+            print("Inference %sx%s : failed with %s" % (img_size, img_size, stats['error']))
+            continue
+
+        print("Inference %sx%s | Median latency : %0.2f ms | P90 latency : %0.2f ms | Build time : %0.2f s | "
+              "Peak RSS : %0.1f MB" % (img_size, img_size, stats['latency_median_ms'], stats['latency_p90_ms'],
+                                       stats['build_time'], stats['peak_rss_mb']))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SRGAN throughput benchmarks on synthetic images")
+    parser.add_argument('--output', default='benchmark_results.json', help='Path of the JSON results')
+    parser.add_argument('--baseline', default=None, help='Path of baseline JSON results to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1, help='Allowed relative regression')
+    parser.add_argument('--img_size', type=int, default=32, help='Low resolution training image size')
+    parser.add_argument('--batch_size', type=int, default=4)
+    parser.add_argument('--nb_steps', type=int, default=20)
+    args = parser.parse_args()
+
+    results = run_benchmarks(img_width=args.img_size, img_height=args.img_size, batch_size=args.batch_size,
+                             nb_steps=args.nb_steps)
+
+    print()
+    print_results(results)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    print("Results saved to %s" % args.output)
+
+    if args.baseline is not None and os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+
+        regressions = compare_to_baseline(results, baseline, args.threshold)
+
+        for metric, base_value, value, change in regressions:
+            print("Regression in %s : %0.4f -> %0.4f (%+0.1f percent)" % (metric, base_value, value, change * 100))
+
+        if len(regressions) > 0:
+            sys.exit(1)
+
+        print("No regressions above %0.1f percent" % (args.threshold * 100))
@@ -0,0 +1,77 @@
+from keras.layers import Input
+from keras.models import Model
+from keras.layers.convolutional import Convolution2D
+
+import sys
+sys.path.append("..")
+
+import models
+
+import time
+import numpy as np
+
+
+def conv_macs(model : Model):
+    ''' Multiply-accumulate count of all the convolution layers in the model for a single image '''
+    total_macs = 0
+
+    for layer in model.layers:
+        if isinstance(layer, Convolution2D):
+            nb_channels = layer.input_shape[models.channel_axis]
+            nb_filters = layer.output_shape[models.channel_axis]
+            output_size = np.prod(layer.output_shape[1:]) // nb_filters  # rows * cols
+
+            total_macs += output_size * nb_filters * nb_channels * layer.nb_row * layer.nb_col
+
+    return total_macs
+
+
+def benchmark_upscale(upscale_type, img_width=32, img_height=32, batch_size=16, nb_runs=10, small_model=False):
+    sr_resnet = models.GenerativeNetwork(img_width, img_height, batch_size, small_model=small_model,
+                                         upscale_type=upscale_type)
+
+    shape = models.image_shape(img_width, img_height)
+
+    ip = Input(shape=shape, name='x_generator')
+    output = sr_resnet.create_sr_model(ip)
+    model = Model(ip, output)
+
+    x = np.random.uniform(0, 255, size=(batch_size,) + shape).astype('float32')
+
+    # Warm up (compiles the predict function)
+    t1 = time.time()
+    model.predict_on_batch(x)
+    compile_time = time.time() - t1
+
+    t1 = time.time()
+    for i in range(nb_runs):
+        model.predict_on_batch(x)
+    t2 = time.time()
+
+    time_per_batch = (t2 - t1) / nb_runs
+
+    results = {'upscale_type': upscale_type,
+               'params': model.count_params(),
+               'gmacs_per_image': conv_macs(model) / 1e9,
+               'compile_time': compile_time,
+               'time_per_batch': time_per_batch,
+               'images_per_sec': batch_size / time_per_batch}
+
+    return results
+
+
+if __name__ == "__main__":
+    img_width = img_height = 32
+    batch_size = 16
+
+    nearest = benchmark_upscale('nearest', img_width, img_height, batch_size)
+    subpixel = benchmark_upscale('subpixel', img_width, img_height, batch_size)
+
+    for result in [nearest, subpixel]:
+        print("%s upscaling | Params : %d | GMACs / image : %0.3f | Time per batch : %0.4f seconds | "
+              "Images / sec : %0.2f" % (result['upscale_type'], result['params'], result['gmacs_per_image'],
+                                        result['time_per_batch'], result['images_per_sec']))
+
+    print("Subpixel speedup : %0.2fx | MAC reduction : %0.2fx" %
+          (nearest['time_per_batch'] / subpixel['time_per_batch'],
+           nearest['gmacs_per_image'] / subpixel['gmacs_per_image']))
@@ -0,0 +1,56 @@
+import numpy as np
+
+
+def tile_image(img, tile_size, overlap=4):
+    '''
+    Splits an image of shape (height, width, channels) into overlapping square tiles, so that
+    images of any size can be processed by a model with a fixed input size.
+
+    The image is reflect padded, so that every output pixel is predicted from a tile
+    in which it has at least `overlap` pixels of context on every side.
+
+    Returns:
+        tiles: array of shape (nb_tiles, tile_size, tile_size, channels)
+        grid: (nb_rows, nb_cols, height, width) needed by stitch_tiles
+    '''
+    stride = tile_size - 2 * overlap
+    assert stride > 0, "Tile size must be larger than twice the overlap"
+
+    height, width = img.shape[:2]
+    nb_rows = int(np.ceil(height / float(stride)))
+    nb_cols = int(np.ceil(width / float(stride)))
+
+    padding = ((overlap, nb_rows * stride - height + overlap),
+               (overlap, nb_cols * stride - width + overlap),
+               (0, 0))
+    padded = np.pad(img, padding, mode='reflect')
+
+    tiles = np.empty((nb_rows * nb_cols, tile_size, tile_size, img.shape[2]), dtype=img.dtype)
+    for i in range(nb_rows):
+        for j in range(nb_cols):
+            tiles[i * nb_cols + j] = padded[i * stride: i * stride + tile_size, j * stride: j * stride + tile_size]
+
+    return tiles, (nb_rows, nb_cols, height, width)
+
+
+def stitch_tiles(tiles, grid, overlap=4, scale=1):
+    '''
+    Inverse of tile_image for (upscaled) tiles of shape (nb_tiles, tile_size * scale, tile_size * scale, channels).
+    The overlapping borders of every tile are discarded.
+
+    Returns:
+        image of shape (height * scale, width * scale, channels)
+    '''
+    nb_rows, nb_cols, height, width = grid
+
+    tile_size = tiles.shape[1]
+    border = overlap * scale
+    stride = tile_size - 2 * border
+
+    out = np.empty((nb_rows * stride, nb_cols * stride, tiles.shape[3]), dtype=tiles.dtype)
+    for i in range(nb_rows):
+        for j in range(nb_cols):
+            out[i * stride: (i + 1) * stride, j * stride: (j + 1) * stride] = \
+                tiles[i * nb_cols + j, border: border + stride, border: border + stride]
+
+    return out[:height * scale, :width * scale]
@@ -0,0 +1,24 @@
+'''
+Decomposition of the overall scale factor of a generator into the factors of its upscale blocks.
+
+Shared by the generator builders (models.py) and the analytic cost model (cost_model.py), and free of
+Keras imports so that the cost model can use it without a backend.
+'''
+
+
+def upscale_factors(scale):
+    '''
+    Factors of the upscale blocks of a generator with the given overall scale factor : 2x blocks for the
+    powers of 2, and 3x blocks for the remaining factors of 3 (eg. 3 -> [3], 4 -> [2, 2], 6 -> [2, 3]).
+    '''
+    assert scale >= 2, "scale must be at least 2"
+
+    factors = []
+    remainder = scale
+    for factor in [2, 3]:
+        while remainder % factor == 0:
+            factors.append(factor)
+            remainder //= factor
+
+    assert remainder == 1, "scale must be a product of 2s and 3s, found %d" % scale
+    return factors
@@ -0,0 +1,216 @@
+'''
+Streaming video super resolution with temporal tile reuse.
+
+Frames are read sequentially and split into the same overlapping LR tiles as evaluation.upscale_image.
+In talking head or surveillance footage most tiles do not change from one frame to the next, so the
+upscaled (HR) tile of the previous frames is kept for every tile position, together with the LR tile it
+was computed from. Tiles are compared to that reference LR tile on small sub blocks, so that a small
+moving object is not averaged out by the rest of the tile : a tile whose mean absolute difference is within
+the tolerance on every sub block reuses its HR tile, and only the changed tiles are batched through the
+generator.
+
+Comparing against the reference tile (rather than only the previous frame) means that slow changes,
+which stay below the tolerance from one frame to the next, still trigger an update once they accumulate.
+
+    python video_sr.py weights/SRGAN.h5 /path/to/frames/ --output_dir sr_frames/ --tolerance 1.5
+'''
+import os
+import time
+import numpy as np
+
+from tiling import tile_image, stitch_tiles
+from image_loader import list_image_files, load_image
+
+
+def read_frames(path):
+    '''
+    Yields the uint8 RGB frames of shape (height, width, 3) of a video file (read with imageio), or of a
+    directory of frame images (in sorted order).
+    '''
+    if os.path.isdir(path):
+        for filename in list_image_files(path):
+            yield load_image(os.path.join(path, filename))
+    else:
+        import imageio
+
+        reader = imageio.get_reader(path)
+        try:
+            for frame in reader:
+                yield np.asarray(frame, dtype='uint8')[..., :3]
+        finally:
+            reader.close()
+
+
+class VideoUpscaler:
+    '''
+    Upscales the frames of a video one by one, running the generator only on the changed tiles.
+
+    Args:
+        model: generator model with a tile_size x tile_size input.
+        tolerance: largest mean absolute difference (in gray levels [0 - 255]) between any block_size x
+            block_size sub block of a tile and of its reference tile for which the HR tile is reused.
+            0 only reuses identical tiles.
+        block_size: size of the sub blocks changes are detected on. Averaging over a sub block keeps
+            sensor noise below the tolerance, while a change of a few pixels still exceeds it.
+        keyframe_interval: optional number of frames after which all the tiles are recomputed.
+    '''
+
+    def __init__(self, model, tile_size=64, overlap=4, scale=4, tolerance=1.5, batch_size=16, channels_first=True,
+                 keyframe_interval=None, block_size=4):
+        self.model = model
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.scale = scale
+        self.tolerance = tolerance
+        self.block_size = block_size
+        self.batch_size = batch_size
+        self.channels_first = channels_first
+        self.keyframe_interval = keyframe_interval
+
+        self.grid = None
+        self.reference_tiles = None  # LR tiles the HR tiles were computed from
+        self.hr_tiles = None
+
+        self.reset_stats()
+
+    def reset(self):
+        ''' Forgets the cached tiles, eg. at a scene cut or before a new video '''
+        self.grid = None
+        self.reference_tiles = None
+        self.hr_tiles = None
+
+    def reset_stats(self):
+        self.nb_frames = 0
+        self.nb_tiles = 0
+        self.nb_reused = 0
+        self.inference_time = 0.
+        self.total_time = 0.
+
+    def _changed_tiles(self, tiles, grid):
+        keyframe = self.keyframe_interval is not None and self.nb_frames % self.keyframe_interval == 0
+        if self.reference_tiles is None or grid != self.grid or keyframe:
+            return np.arange(len(tiles))
+
+        difference = np.abs(tiles.astype('int16') - self.reference_tiles.astype('int16')).mean(axis=3)
+
+        # Mean difference of every block_size x block_size sub block (the last blocks may be partial)
+        block = self.block_size
+        nb_blocks = -(-self.tile_size // block)
+        padding = nb_blocks * block - self.tile_size
+        difference = np.pad(difference, ((0, 0), (0, padding), (0, padding)), mode='edge')
+        difference = difference.reshape(len(tiles), nb_blocks, block, nb_blocks, block).mean(axis=(2, 4))
+
+        return np.where(difference.reshape(len(tiles), -1).max(axis=1) > self.tolerance)[0]
+
+    def process(self, frame):
+        ''' Upscales the next uint8 frame of shape (height, width, 3) '''
+        t1 = time.time()
+
+        tiles, grid = tile_image(frame, self.tile_size, self.overlap)
+        changed = self._changed_tiles(tiles, grid)
+
+        if len(changed) == len(tiles):
+            hr_size = self.tile_size * self.scale
+            self.hr_tiles = np.empty((len(tiles), hr_size, hr_size, 3), dtype='uint8')
+            self.reference_tiles = tiles.copy()
+            self.grid = grid
+
+        if len(changed) > 0:
+            x = tiles[changed].astype('float32')
+            if self.channels_first:
+                x = x.transpose((0, 3, 1, 2))
+
+            t2 = time.time()
+            outputs = np.concatenate([self.model.predict_on_batch(x[i: i + self.batch_size])
+                                      for i in range(0, len(x), self.batch_size)])
+            self.inference_time += time.time() - t2
+
+            if self.channels_first:
+                outputs = outputs.transpose((0, 2, 3, 1))
+
+            self.hr_tiles[changed] = np.clip(outputs, 0, 255).astype('uint8')
+            self.reference_tiles[changed] = tiles[changed]
+
+        sr = stitch_tiles(self.hr_tiles, grid, self.overlap, self.scale)
+
+        self.nb_frames += 1
+        self.nb_tiles += len(tiles)
+        self.nb_reused += len(tiles) - len(changed)
+        self.total_time += time.time() - t1
+
+        return sr
+
+    def stats(self):
+        ''' Frames per second, tile reuse ratio and share of the time spent in the generator '''
+        return {'nb_frames': self.nb_frames,
+                'fps': self.nb_frames / max(self.total_time, 1e-8),
+                'reuse_ratio': self.nb_reused / float(max(self.nb_tiles, 1)),
+                'nb_tiles': self.nb_tiles,
+                'nb_reused': self.nb_reused,
+                'inference_time': self.inference_time,
+                'total_time': self.total_time}
+
+
+def upscale_video(upscaler, frames, output_dir=None, nb_frames=None, verbose=True):
+    '''
+    Upscales a sequence of frames (eg. read_frames(path)) with a VideoUpscaler, and optionally saves
+    the upscaled frames as PNG images in output_dir.
+
+    Returns:
+        the statistics of the upscaler (see VideoUpscaler.stats)
+    '''
+    from PIL import Image
+
+    if output_dir is not None and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    for i, frame in enumerate(frames):
+        sr = upscaler.process(frame)
+
+        if output_dir is not None:
+            Image.fromarray(sr).save(os.path.join(output_dir, "frame_%06d.png" % (i + 1)))
+
+        if verbose and (i + 1) % 50 == 0:
+            stats = upscaler.stats()
+            print("Frame %d | FPS : %0.2f | Tile reuse ratio : %0.1f %%" % (i + 1, stats['fps'],
+                                                                         stats['reuse_ratio'] * 100))
+
+        if nb_frames is not None and i + 1 >= nb_frames:
+            break
+
+    stats = upscaler.stats()
+    if verbose:
+        print("Upscaled %d frames | FPS : %0.2f | Tile reuse ratio : %0.1f %% | Generator time : %0.2f / %0.2f "
+              "seconds" % (stats['nb_frames'], stats['fps'], stats['reuse_ratio'] * 100, stats['inference_time'],
+                           stats['total_time']))
+
+    return stats
+
+
+if __name__ == "__main__":
+    import argparse
+    from keras import backend as K
+
+    from pruning import build_generator, load_generator_config
+
+    parser = argparse.ArgumentParser(description="Streaming video super resolution with temporal tile reuse")
+    parser.add_argument('weights_path', help='Generator weights (eg. weights/SRGAN.h5)')
+    parser.add_argument('input', help='Video file (requires imageio) or directory of frame images')
+    parser.add_argument('--output_dir', default=None, help='Directory where the upscaled frames are saved')
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help='Mean absolute difference of the sub blocks of an unchanged tile')
+    parser.add_argument('--block_size', type=int, default=4)
+    parser.add_argument('--keyframe_interval', type=int, default=None)
+    parser.add_argument('--nb_frames', type=int, default=None)
+    parser.add_argument('--tile_size', type=int, default=64)
+    parser.add_argument('--overlap', type=int, default=4)
+    parser.add_argument('--scale', type=int, default=4)
+    args = parser.parse_args()
+
+    _, model = build_generator(args.tile_size, args.scale, args.weights_path,
+                               **load_generator_config(args.weights_path))
+
+    upscaler = VideoUpscaler(model, args.tile_size, args.overlap, args.scale, args.tolerance,
+                             channels_first=K.image_dim_ordering() == "th", keyframe_interval=args.keyframe_interval,
+                             block_size=args.block_size)
+    upscale_video(upscaler, read_frames(args.input), args.output_dir, args.nb_frames)
@@ -0,0 +1,431 @@
+'''
+Local, offline registry of model weights.
+
+Every weight array is stored once as an .npy blob named by the SHA256 of its file contents
+(content addressed), so identical arrays of different entries are only stored once and every
+blob can be checked against its name. An entry (eg. 'vgg16_notop_th') is a JSON manifest which
+maps layer names to the blobs of their weights.
+
+Blobs are memory mapped when loaded, so several processes on the same host share the pages of the
+weight files through the page cache, and only the requested layers are read (partial loads).
+Weights are assigned to the layers of a model by layer name (including the layers of nested models),
+never by position.
+
+The registry directory defaults to weights/registry/ and can be set with the SRGAN_WEIGHT_REGISTRY
+environment variable. To populate it on a machine with network access (or from a local copy of the
+Keras VGG16 weights) and copy it to offline machines:
+
+    python weight_registry.py fetch-vgg
+    python weight_registry.py import-vgg /path/to/vgg16_weights_th_dim_ordering_th_kernels_notop.h5
+    python weight_registry.py import "weights/Discriminator weights.h5" discriminator
+    python weight_registry.py list
+    python weight_registry.py verify vgg16_notop_th
+
+Loading does not check the blob checksums by default (hashing every blob on every load costs as much as
+reading it) : run the verify command after copying a registry, or pass verify=True. Replacing an entry
+deletes its previous blobs, and blobs left over by removed entries are deleted by the gc command.
+'''
+import os
+import re
+import json
+import hashlib
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+
+DEFAULT_REGISTRY_DIR = os.environ.get('SRGAN_WEIGHT_REGISTRY', 'weights/registry/')
+
+VGG_WEIGHTS_URLS = {
+    'th': r'https://github.com/fchollet/deep-learning-models/releases/download/v0.1/vgg16_weights_th_dim_ordering_th_kernels_notop.h5',
+    'tf': r'https://github.com/fchollet/deep-learning-models/releases/download/v0.1/vgg16_weights_tf_dim_ordering_tf_kernels_notop.h5',
+}
+
+
+def _decode(name):
+    return name.decode('utf8') if isinstance(name, bytes) else name
+
+
+def _file_sha256(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+
+    return sha.hexdigest()
+
+
+def _write_atomic_json(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f, indent=2)
+
+    os.replace(tmp_path, path)
+
+
+def vgg_layer_name(name):
+    ''' Name of a layer of the Keras VGG16 weight files (eg. block2_conv1) in VGGNetwork (eg. vgg_conv2_1) '''
+    name = re.sub(r'^block(\d+)_conv(\d+)$', r'vgg_conv\1_\2', name)
+    return re.sub(r'^block(\d+)_pool$', r'vgg_maxpool\1', name)
+
+
+def vgg_layer_names(up_to_block=5):
+    ''' Names of the VGGNetwork convolution layers of the first up_to_block blocks '''
+    nb_convs = [2, 2, 3, 3, 3]
+    return ['vgg_conv%d_%d' % (block + 1, conv + 1) for block in range(up_to_block)
+            for conv in range(nb_convs[block])]
+
+
+def vgg_entry_name(dim_ordering):
+    return 'vgg16_notop_%s' % dim_ordering
+
+
+def read_h5_weights(path, rename=None):
+    '''
+    Reads the weights of a Keras weight file (model.save_weights) by layer name.
+    Layers without weights are skipped.
+
+    Args:
+        rename: optional function mapping the layer names of the file to the layer names of the model
+
+    Returns:
+        OrderedDict of layer name -> list of numpy arrays
+    '''
+    import h5py
+
+    weights = OrderedDict()
+    with h5py.File(path, 'r') as f:
+        for layer_name in f.attrs['layer_names']:
+            layer_name = _decode(layer_name)
+            g = f[layer_name]
+            weight_names = [_decode(name) for name in g.attrs['weight_names']]
+
+            if len(weight_names) == 0:
+                continue
+
+            name = rename(layer_name) if rename is not None else layer_name
+            weights[name] = [np.asarray(g[weight_name]) for weight_name in weight_names]
+
+    return weights
+
+
+def _model_layers(model):
+    ''' All the layers of a model, including the layers of nested models (eg. the discriminator in SRGAN) '''
+    layers = []
+    for layer in model.layers:
+        if hasattr(layer, 'layers'):
+            layers.extend(_model_layers(layer))
+        else:
+            layers.append(layer)
+
+    return layers
+
+
+def model_weights(model):
+    ''' OrderedDict of layer name -> list of weight arrays of all the layers with weights of a model '''
+    weights = OrderedDict()
+    for layer in _model_layers(model):
+        layer_weights = layer.get_weights()
+        if len(layer_weights) > 0:
+            weights[layer.name] = layer_weights
+
+    return weights
+
+
+def set_weights_by_name(model, weights, layer_names=None):
+    '''
+    Assigns the weights of a dictionary of layer name -> list of arrays to the layers of the model
+    with the same name. Layers of the model which are not in the dictionary are left unchanged.
+
+    Args:
+        layer_names: optional list of layer names to restrict the assignment to.
+
+    Returns:
+        list of the names of the layers whose weights were set
+    '''
+    loaded = []
+    for layer in _model_layers(model):
+        if layer.name not in weights or (layer_names is not None and layer.name not in layer_names):
+            continue
+
+        layer.set_weights(weights[layer.name])
+        loaded.append(layer.name)
+
+    return loaded
+
+
+class WeightRegistry:
+    '''
+    Directory of content addressed weight blobs and the entries (manifests) which reference them.
+
+    Args:
+        registry_dir: registry directory. Defaults to DEFAULT_REGISTRY_DIR.
+    '''
+
+    def __init__(self, registry_dir=None):
+        self.registry_dir = registry_dir if registry_dir is not None else DEFAULT_REGISTRY_DIR
+        self.blob_dir = os.path.join(self.registry_dir, 'blobs')
+        self.entry_dir = os.path.join(self.registry_dir, 'entries')
+
+        for path in [self.blob_dir, self.entry_dir]:
+            if not os.path.exists(path):
+                os.makedirs(path)
+
+    def _blob_path(self, sha):
+        return os.path.join(self.blob_dir, sha + '.npy')
+
+    def _entry_path(self, name):
+        return os.path.join(self.entry_dir, name + '.json')
+
+    def _put_blob(self, array):
+        fd, tmp_path = tempfile.mkstemp(dir=self.blob_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, np.ascontiguousarray(array))
+
+        sha = _file_sha256(tmp_path)
+        if os.path.exists(self._blob_path(sha)):
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, self._blob_path(sha))
+
+        return sha
+
+    def has(self, name):
+        return os.path.exists(self._entry_path(name))
+
+    def entries(self):
+        return sorted(os.path.splitext(path)[0] for path in os.listdir(self.entry_dir) if path.endswith('.json'))
+
+    def entry(self, name):
+        ''' Manifest of an entry : {'name', 'source', 'layers': {layer name: [blob sha256, ...]}} '''
+        if not self.has(name):
+            raise KeyError("Weight registry %s has no entry '%s'. Available entries : %s" %
+                           (self.registry_dir, name, str(self.entries())))
+
+        with open(self._entry_path(name), 'r') as f:
+            return json.load(f, object_pairs_hook=OrderedDict)
+
+    def put(self, name, weights, source=None):
+        '''
+        Stores (or replaces) an entry. When an entry is replaced (eg. by every checkpoint of a model), its
+        previous blobs which no other entry references are deleted.
+
+        Args:
+            weights: OrderedDict of layer name -> list of arrays
+            source: optional description of where the weights come from (eg. the original file)
+        '''
+        previous_blobs = self._entry_blobs(name) if self.has(name) else set()
+
+        layers = OrderedDict((layer_name, [self._put_blob(w) for w in layer_weights])
+                             for layer_name, layer_weights in weights.items())
+
+        _write_atomic_json(self._entry_path(name), {'name': name, 'source': source, 'layers': layers})
+
+        replaced_blobs = previous_blobs.difference(*layers.values())
+        if len(replaced_blobs) > 0:
+            for other in self.entries():
+                if other != name:
+                    replaced_blobs -= self._entry_blobs(other)
+
+            for sha in replaced_blobs:
+                if os.path.exists(self._blob_path(sha)):
+                    os.remove(self._blob_path(sha))
+
+        return self.entry(name)
+
+    def _entry_blobs(self, name):
+        return set(sha for blobs in self.entry(name)['layers'].values() for sha in blobs)
+
+    def get(self, name, layer_names=None, verify=False):
+        '''
+        Memory maps the weights of an entry.
+
+        Args:
+            layer_names: optional list of layer names to load (partial load). Defaults to all layers.
+            verify: check the SHA256 of every loaded blob (reads the whole blobs).
+
+        Returns:
+            OrderedDict of layer name -> list of read only memory mapped arrays
+        '''
+        layers = self.entry(name)['layers']
+
+        weights = OrderedDict()
+        for layer_name, blobs in layers.items():
+            if layer_names is not None and layer_name not in layer_names:
+                continue
+
+            if verify:
+                for sha in blobs:
+                    if _file_sha256(self._blob_path(sha)) != sha:
+                        raise IOError("Checksum mismatch of blob %s (layer %s of entry %s)" % (sha, layer_name, name))
+
+            weights[layer_name] = [np.load(self._blob_path(sha), mmap_mode='r') for sha in blobs]
+
+        return weights
+
+    def load_into(self, model, name, layer_names=None, verify=False):
+        '''
+        Sets the weights of the layers of the model from an entry, by layer name.
+
+        Returns:
+            list of the names of the layers whose weights were set
+        '''
+        return set_weights_by_name(model, self.get(name, layer_names, verify), layer_names)
+
+    def put_model(self, name, model, source=None):
+        ''' Stores the weights of all the layers of a Keras model as an entry '''
+        return self.put(name, model_weights(model), source)
+
+    def import_h5(self, path, name, rename=None):
+        ''' Stores the weights of a Keras weight file (by layer name) as an entry '''
+        return self.put(name, read_h5_weights(path, rename), source=os.path.abspath(path))
+
+    def verify(self, name):
+        ''' Returns the list of corrupted or missing blobs of an entry '''
+        corrupted = []
+        for blobs in self.entry(name)['layers'].values():
+            for sha in blobs:
+                if not os.path.exists(self._blob_path(sha)) or _file_sha256(self._blob_path(sha)) != sha:
+                    corrupted.append(sha)
+
+        return corrupted
+
+    def remove(self, name):
+        ''' Removes an entry. Its blobs are deleted by the next gc() if no other entry references them. '''
+        if self.has(name):
+            os.remove(self._entry_path(name))
+
+    def gc(self):
+        '''
+        Deletes the blobs which are not referenced by any entry. Returns the number of deleted blobs.
+
+        The blobs of an entry are written before its manifest, so gc() must not run while another
+        process stores weights in the same registry.
+        '''
+        referenced = set()
+        for name in self.entries():
+            referenced.update(self._entry_blobs(name))
+
+        nb_removed = 0
+        for path in os.listdir(self.blob_dir):
+            if path.endswith('.npy') and os.path.splitext(path)[0] not in referenced:
+                os.remove(os.path.join(self.blob_dir, path))
+                nb_removed += 1
+
+        return nb_removed
+
+
+def fetch_vgg16(registry=None, dim_ordering=None):
+    '''
+    Downloads the Keras VGG16 (no top) weights (needs network access) and stores them in the registry.
+    '''
+    from keras import backend as K
+    from keras.utils.data_utils import get_file
+
+    registry = registry if registry is not None else WeightRegistry()
+    dim_ordering = dim_ordering if dim_ordering is not None else K.image_dim_ordering()
+
+    url = VGG_WEIGHTS_URLS[dim_ordering]
+    path = get_file(url.split('/')[-1], url, cache_subdir='models')
+
+    return registry.import_h5(path, vgg_entry_name(dim_ordering), rename=vgg_layer_name)
+
+
+def load_vgg16(model, up_to_block=5, registry=None, verify=False):
+    '''
+    Loads the VGG16 weights of the backend dim ordering into the vgg_* layers of the model, from the
+    registry. If the registry does not have them yet, they are downloaded once (see fetch_vgg16).
+
+    Args:
+        up_to_block: only load the convolutions of the first up_to_block VGG blocks.
+        verify: check the SHA256 of the loaded blobs (see WeightRegistry.get).
+
+    Returns:
+        list of the names of the layers whose weights were set
+    '''
+    from keras import backend as K
+
+    registry = registry if registry is not None else WeightRegistry()
+    name = vgg_entry_name(K.image_dim_ordering())
+
+    if not registry.has(name):
+        try:
+            print("VGG16 weights are not in the weight registry %s. Downloading them." % registry.registry_dir)
+            fetch_vgg16(registry)
+        except Exception as e:
+            raise IOError("Could not download the VGG16 weights (%s). On offline machines, import a local copy with "
+                          "'python weight_registry.py import-vgg <path to the h5 file>' or copy a populated "
+                          "registry to %s" % (str(e), registry.registry_dir))
+
+    return registry.load_into(model, name, vgg_layer_names(up_to_block), verify)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Offline weight registry")
+    parser.add_argument('--registry', default=None, help='Registry directory (default : %s)' % DEFAULT_REGISTRY_DIR)
+    subparsers = parser.add_subparsers(dest='command')
+
+    subparsers.add_parser('list', help='List the entries')
+
+    import_parser = subparsers.add_parser('import', help='Import a Keras weight file')
+    import_parser.add_argument('path')
+    import_parser.add_argument('name')
+
+    vgg_parser = subparsers.add_parser('import-vgg', help='Import a local copy of the Keras VGG16 (no top) weights')
+    vgg_parser.add_argument('path')
+    vgg_parser.add_argument('--dim_ordering', default=None, choices=['th', 'tf'],
+                            help='Dim ordering of the weights (default : guessed from the file name)')
+
+    fetch_parser = subparsers.add_parser('fetch-vgg', help='Download the Keras VGG16 (no top) weights')
+    fetch_parser.add_argument('--dim_ordering', default=None, choices=['th', 'tf'])
+
+    verify_parser = subparsers.add_parser('verify', help='Check the checksums of an entry')
+    verify_parser.add_argument('name')
+
+    remove_parser = subparsers.add_parser('remove', help='Remove an entry')
+    remove_parser.add_argument('name')
+
+    subparsers.add_parser('gc', help='Delete the blobs which are not referenced by any entry')
+
+    args = parser.parse_args()
+    registry = WeightRegistry(args.registry)
+
+    if args.command == 'list':
+        for name in registry.entries():
+            entry = registry.entry(name)
+            print("%-30s %4d layers | source : %s" % (name, len(entry['layers']), entry['source']))
+
+    elif args.command == 'import':
+        entry = registry.import_h5(args.path, args.name)
+        print("Imported %d layers as %s" % (len(entry['layers']), args.name))
+
+    elif args.command == 'import-vgg':
+        dim_ordering = args.dim_ordering
+        if dim_ordering is None:
+            dim_ordering = 'tf' if 'tf_dim_ordering' in os.path.basename(args.path) else 'th'
+
+        entry = registry.import_h5(args.path, vgg_entry_name(dim_ordering), rename=vgg_layer_name)
+        print("Imported %d layers as %s" % (len(entry['layers']), vgg_entry_name(dim_ordering)))
+
+    elif args.command == 'fetch-vgg':
+        entry = fetch_vgg16(registry, args.dim_ordering)
+        print("Stored %d layers as %s" % (len(entry['layers']), entry['name']))
+
+    elif args.command == 'verify':
+        corrupted = registry.verify(args.name)
+        if len(corrupted) > 0:
+            print("Entry %s has %d corrupted or missing blobs : %s" % (args.name, len(corrupted), str(corrupted)))
+        else:
+            print("Entry %s is valid" % args.name)
+
+    elif args.command == 'remove':
+        registry.remove(args.name)
+        print("Removed %s. Run the gc command to delete its unreferenced blobs." % args.name)
+
+    elif args.command == 'gc':
+        print("Deleted %d unreferenced blobs" % registry.gc())
+
+    else:
+        parser.print_help()